@@ -2,7 +2,7 @@
 
 from project.webapi import *
 import project.configuration as config
-from flask_bcrypt import Bcrypt
+import project.webapi as webapi
 from werkzeug.local import LocalProxy
 from project.backend.models import Consumer
 from project.cli.consumer import add_consumer, add_admin, remove_admin
@@ -29,7 +29,8 @@ class BackendManager:
         return 'manager <command> [<args>]\n' \
                '\tThe most commonly used commands are:\n' \
                '\tadd        Adds an element to the database\n' \
-               '\tadmin      Manage consumer admin roles\n'
+               '\tadmin      Manage consumer admin roles\n' \
+               '\tcheckpoint Write the write-ahead log back to the database\n'
 
     def add(self):
         parser = argparse.ArgumentParser(
@@ -39,7 +40,7 @@ class BackendManager:
         args = parser.parse_args(sys.argv[2:])
 
         if args.type == 'consumer':
-            add_consumer(api, bcrypt)
+            add_consumer(api, webapi.hasher)
         elif args.type == 'department':
             add_department(api)
         else:
@@ -53,12 +54,27 @@ class BackendManager:
         args = parser.parse_args(sys.argv[2:])
 
         if args.operation == 'add':
-            add_admin(api, bcrypt)
+            add_admin(api, webapi.hasher)
         elif args.operation == 'remove':
             remove_admin(api)
         else:
             sys.exit('{} is not a valid operation'.format(args.operation))
 
+    def checkpoint(self):
+        parser = argparse.ArgumentParser(
+            description='Write the write-ahead log back to the database')
+
+        parser.add_argument('mode', nargs='?', default='passive',
+                            choices=['passive', 'full', 'restart', 'truncate'])
+        args = parser.parse_args(sys.argv[2:])
+
+        try:
+            log, checkpointed = api.checkpoint(args.mode.upper())
+        except exc.DatabaseUnavailable:
+            sys.exit('The database is busy, please try again later')
+
+        print('{} of {} frames written back'.format(checkpointed, log))
+
 
 if __name__ == '__main__':
     app, api = set_app(config.BaseConfig)
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+
+import collections
+import threading
+import time
+
+
+_missing = object()
+
+
+class TTLCache(object):
+    """A mapping of at most maxsize entries, which expire ttl seconds after
+    they have been stored. When the cache is full, the least recently used
+    entry is dropped. All methods are thread-safe."""
+
+    def __init__(self, maxsize, ttl, timer=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self._entries = collections.OrderedDict()
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def get(self, key, default=None):
+        """Return the value of a key, if it has not expired yet."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+
+            expires, value = entry
+            if expires <= self.timer():
+                del self._entries[key]
+                return default
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        """Store a value for ttl seconds, by default those of the cache."""
+        with self._lock:
+            self._store(key, value, ttl)
+
+    def get_or_load(self, key, load):
+        """Return the value of a key and load it with load(key) if it is not
+        cached. A value is not stored if the key has been invalidated while
+        it was loaded, because it may be outdated already."""
+        value = self.get(key, _missing)
+        if value is not _missing:
+            return value
+
+        with self._lock:
+            generation = self._generation
+
+        value = load(key)
+        with self._lock:
+            if self._generation == generation:
+                self._store(key, value, None)
+        return value
+
+    def invalidate(self, key):
+        """Drop the value of a key."""
+        with self._lock:
+            self._generation += 1
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Drop all values."""
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def _store(self, key, value, ttl):
+        if self.maxsize <= 0:
+            return
+
+        ttl = self.ttl if ttl is None else ttl
+        self._entries[key] = (self.timer() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
@@ -1,17 +1,19 @@
 #!/usr/bin/env python3
 
+import bisect
 import collections
 import datetime
 import os
 import pdb
 import sys
 import sqlite3
+import threading
 from math import floor
-from operator import itemgetter
 
 import project.backend.models as models
 import project.backend.validation as validation
 import project.backend.exceptions as exc
+from project.backend.cache import TTLCache
 
 
 # convert booleans since sqlite3 has no booleans
@@ -21,21 +23,69 @@ sqlite3.register_converter("BOOLEAN", lambda v: bool(int(v)))
 
 
 def factory(cls):
-    """ Helper function for ORM Mapping """
+    """ Helper function for ORM Mapping. The column mapping is only built
+    once per query, see validation.loader """
+    description = None
+    load = None
+
     def fun(cursor, row):
-        p = cls()
-        for idx, col in enumerate(cursor.description):
-            setattr(p, col[0], row[idx])
-        return p
+        nonlocal description, load
+        if cursor.description is not description:
+            description = cursor.description
+            load = validation.loader(cls, [col[0] for col in description])
+        return load(row)
     return fun
 
 
+# The ids of a query are bound in chunks below the default limit of 999
+# host parameters of older sqlite versions
+MAX_VARIABLES = 500
+
+
+def chunks(ids):
+    """ Split the ids into lists of at most MAX_VARIABLES ids """
+    ids = list(ids)
+    for start in range(0, len(ids), MAX_VARIABLES):
+        yield ids[start:start + MAX_VARIABLES]
+
+
 class DatabaseApi(object):
 
-    def __init__(self, sqlite3_connection, configuration):
+    def __init__(self, pool, configuration):
         self.configuration = configuration
-        self.con = sqlite3_connection
-        self.con.execute('PRAGMA foreign_keys = ON;')
+        self.pool = pool
+        self._local = threading.local()
+        self._price_table = None
+        self._principals = TTLCache(configuration['PRINCIPAL_CACHE_SIZE'],
+                                    configuration['PRINCIPAL_CACHE_TTL'])
+
+    @property
+    def con(self):
+        """The connection of the current thread. Unless the thread uses a
+        connection of its own, it is checked out of the pool."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            return self.pool.connection()
+        return connection
+
+    def use_connection(self, connection):
+        """Use a connection of its own in the current thread, e.g. the
+        batch connection of the writer. None switches back to the pool."""
+        self._local.connection = connection
+
+    def checkpoint(self, mode='PASSIVE'):
+        """Write the changes in the write-ahead log back to the database and
+        return the numbers of the frames in the log and of the frames which
+        have been written back, see
+        https://www.sqlite.org/pragma.html#pragma_wal_checkpoint"""
+        if mode not in ['PASSIVE', 'FULL', 'RESTART', 'TRUNCATE']:
+            raise ValueError('Invalid checkpoint mode: {}'.format(mode))
+
+        busy, log, checkpointed = self.con.execute(
+            'PRAGMA wal_checkpoint({});'.format(mode)).fetchone()
+        if busy:
+            raise exc.DatabaseUnavailable()
+        return log, checkpointed
 
     def create_tables(self):
         cursor = self.con.cursor()
@@ -49,6 +99,32 @@ class DatabaseApi(object):
             schema = models.read()
 
         self.con.executescript(schema)
+        self.upgrade_tables()
+
+    def upgrade_tables(self):
+        """Add the columns, tables, triggers and indexes which a database of
+        an older schema lacks. A database without tables is left alone, it
+        is set up by create_tables."""
+        cursor = self.con.cursor()
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' "
+                       "AND name='activities';")
+        if cursor.fetchone() is None:
+            return
+
+        columns = [row[1] for row in
+                   cursor.execute('PRAGMA table_info(activities);')]
+        if 'reviewed' not in columns:
+            try:
+                cursor.execute('ALTER TABLE activities ADD COLUMN reviewed '
+                               'BOOLEAN NOT NULL DEFAULT 0 '
+                               'CHECK (reviewed IN (0, 1));')
+            except sqlite3.OperationalError as e:
+                # Another process has added the column meanwhile
+                if 'duplicate column' not in str(e):
+                    raise
+
+        with open(self.configuration['DATABASE_UPGRADE']) as upgrade:
+            self.con.executescript(upgrade.read())
 
     def _assert_mandatory_fields(self, object, fields):
         """Check all mandatory fields of a given object."""
@@ -96,22 +172,52 @@ class DatabaseApi(object):
         if c.fetchone() is None:
             raise exc.ForeignKeyNotExisting(foreign_key)
 
-    def _calculate_product_price(self, base_price, karma):
-        pricecategories = self.list_pricecategories()
-        bounds = {}
-        percent = 0
-        for scale in pricecategories:
-            bounds[scale.price_lower_bound] = scale.additional_percent
-
-        bounds = collections.OrderedDict(sorted(bounds.items()))
+    def _get_price_table(self, version):
+        """Return the price table of the given version of the price
+        categories: their sorted lower bounds, their additional percents as
+        a parallel list and the karma prices of each base price. The table
+        is built again once the version has changed, also by a commit of
+        another process. It holds the karma prices of all products at once,
+        other base prices are added when they are first asked for."""
+        table = self._price_table
+        if table is None or table[0] != version:
+            bounds = {}
+            for scale in self.list_pricecategories():
+                bounds[scale.price_lower_bound] = scale.additional_percent
+
+            lower_bounds = sorted(bounds)
+            percents = [bounds[bound] for bound in lower_bounds]
+            karma_prices = {}
+            for (price, ) in self.con.execute('SELECT DISTINCT price '
+                                              'FROM products;'):
+                karma_prices[price] = self._karma_prices(price, lower_bounds,
+                                                         percents)
+            table = (version, lower_bounds, percents, karma_prices)
+            self._price_table = table
+
+        return table[1:]
+
+    @staticmethod
+    def _karma_prices(base_price, lower_bounds, percents):
+        """Return the prices of a base price for all karma values from -10
+        to 10."""
+        index = bisect.bisect_right(lower_bounds, base_price)
+        percent = percents[index - 1] if index else 0
+        return tuple(
+            floor(base_price * (1 + percent * (-karma + 10) / 2000))
+            for karma in range(-10, 11)
+        )
 
-        for bound in bounds:
-            if base_price >= bound:
-                percent = bounds[bound]
-            else:
-                break
+    def _calculate_product_price(self, base_price, karma, version):
+        """Return the price of a product with the price categories of the
+        given version. Once their table is built, this runs no query."""
+        lower_bounds, percents, karma_prices = self._get_price_table(version)
+        prices = karma_prices.get(base_price)
+        if prices is None:
+            prices = self._karma_prices(base_price, lower_bounds, percents)
+            karma_prices[base_price] = prices
 
-        return floor(base_price * (1 + percent * (-karma + 10) / 2000))
+        return prices[karma + 10]
 
     def setAdmin(self, consumer, department, admin):
         self._check_foreign_key(consumer, 'id', 'consumers')
@@ -157,6 +263,24 @@ class DatabaseApi(object):
                     'WHERE consumer_id = ?;', (consumer.id, ))
         return cur.fetchall()
 
+    def get_principal(self, consumer_id):
+        """Return the id of a consumer and the department ids of its
+        adminroles. They are cached with the version of the adminroles, so
+        that every committed change of them, also by another process, takes
+        effect at once. Unused entries expire after PRINCIPAL_CACHE_TTL
+        seconds."""
+        version = self.get_versions(('adminroles', ))[0]
+        adminroles = self._principals.get_or_load((version, consumer_id),
+                                                  self._load_adminroles)
+        return {'id': consumer_id, 'adminroles': list(adminroles)}
+
+    def _load_adminroles(self, key):
+        version, consumer_id = key
+        cur = self.con.execute('SELECT department_id FROM adminroles '
+                               'WHERE consumer_id=? ORDER BY id;',
+                               (consumer_id, ))
+        return tuple(row[0] for row in cur)
+
     def _simple_update(self, cur, object, table, updateable_fields):
         params = []
         query_parts = []
@@ -413,95 +537,206 @@ class DatabaseApi(object):
         self.con.commit()
 
     def insert_purchase(self, purchase):
+        self.insert_purchases([purchase])
+
+    def insert_purchases(self, purchases):
+        """Insert the purchases of a cart of one consumer at once. All of
+        them are checked before any is applied and they are committed
+        together or not at all."""
         cur = self.con.cursor()
+        if not purchases:
+            raise exc.MissingData()
 
-        self._assert_mandatory_fields(purchase, ['product_id',
-                                                 'consumer_id',
-                                                 'amount',
-                                                 'comment'])
+        for purchase in purchases:
+            self._assert_mandatory_fields(purchase, ['product_id',
+                                                     'consumer_id',
+                                                     'amount',
+                                                     'comment'])
+
+            self._assert_forbidden_fields(
+                purchase, ['id', 'timestamp', 'revoked',
+                           'paid_base_price_per_product',
+                           'paid_karma_per_product']
+            )
 
-        self._assert_forbidden_fields(
-            purchase, ['id', 'timestamp', 'revoked',
-                       'paid_base_price_per_product',
-                       'paid_karma_per_product']
-        )
+        if len(set(p.consumer_id for p in purchases)) > 1:
+            raise exc.ForbiddenField('consumer_id')
 
         # TODO: purchase should be only allowed if the product and the consumer
         #       is active
-        purchase.timestamp = datetime.datetime.now()
-        purchase.revoked = False
-
-        self._check_foreign_key(purchase, 'consumer_id', 'consumers')
-        self._check_foreign_key(purchase, 'product_id', 'products')
-
-        consumer = self.get_consumer(purchase.consumer_id)
-        product = self.get_product(purchase.product_id)
-        if self.configuration['USE_KARMA']:
-            price_to_pay = self._calculate_product_price(product.price,
-                                                         consumer.karma)
-        else:
-            price_to_pay = product.price
+        timestamp = datetime.datetime.now()
+        for purchase in purchases:
+            purchase.timestamp = timestamp
+            purchase.revoked = False
+
+        # Everything the checkout needs is selected by primary key in a
+        # single statement, so its costs do not grow with the tables. This
+        # includes the version of the price categories for the karma prices.
+        consumer_ids = sorted(set(p.consumer_id for p in purchases))
+        product_ids = sorted(set(p.product_id for p in purchases))
+        res = cur.execute(
+            'SELECT consumers.id, consumers.karma, products.id, '
+            'products.price, products.countable, products.department_id, '
+            '(SELECT version FROM versions '
+            " WHERE tablename = 'pricecategories') "
+            'FROM consumers, products '
+            'WHERE consumers.id IN ({}) AND products.id IN ({});'.format(
+                ', '.join('?' * len(consumer_ids)),
+                ', '.join('?' * len(product_ids))),
+            consumer_ids + product_ids
+        ).fetchall()
+        karmas = {row[0]: row[1] for row in res}
+        products = {row[2]: row[3:6] for row in res}
 
-        cur.execute(
-            'INSERT INTO purchases('
-            '    consumer_id, '
-            '    product_id, '
-            '    comment, '
-            '    revoked, '
-            '    timestamp,'
-            '    amount,'
-            '    paid_base_price_per_product,'
-            '    paid_karma_per_product) '
-            'VALUES ('
-            '    ?, '
-            '    ?, '
-            '    ?, '
-            '    ?, '
-            '    ?, '
-            '    ?, '
-            '    ?, '
-            '    ? '
-            ');',
-            (purchase.consumer_id,
-             purchase.product_id,
-             purchase.comment,
-             purchase.revoked,
-             purchase.timestamp,
-             purchase.amount,
-             product.price,
-             price_to_pay - product.price)
-        )
+        for purchase in purchases:
+            if purchase.consumer_id not in karmas:
+                self._check_foreign_key(purchase, 'consumer_id', 'consumers')
+            if purchase.product_id not in products:
+                self._check_foreign_key(purchase, 'product_id', 'products')
+
+        # The counters are updated once per consumer, product and department
+        rows = []
+        credits = {}
+        stocks = {}
+        incomes = {}
+        for purchase in purchases:
+            price, countable, department_id = products[purchase.product_id]
+            if self.configuration['USE_KARMA']:
+                price_to_pay = self._calculate_product_price(
+                    price, karmas[purchase.consumer_id], res[0][6])
+            else:
+                price_to_pay = price
+
+            rows.append((purchase.consumer_id,
+                         purchase.product_id,
+                         purchase.comment,
+                         purchase.revoked,
+                         purchase.timestamp,
+                         purchase.amount,
+                         price,
+                         price_to_pay - price))
+            credits[purchase.consumer_id] = (
+                credits.get(purchase.consumer_id, 0) +
+                purchase.amount * price_to_pay)
+            if countable:
+                stocks[purchase.product_id] = (
+                    stocks.get(purchase.product_id, 0) + purchase.amount)
+            base, karma = incomes.get(department_id, (0, 0))
+            incomes[department_id] = (
+                base + purchase.amount * price,
+                karma + purchase.amount * (price_to_pay - price))
 
-        cur.execute(
-            'UPDATE consumers '
-            'SET credit = credit - ?*?'
-            'WHERE id=?;',
-            (purchase.amount,
-             price_to_pay,
-             purchase.consumer_id)
-        )
-        if product.countable:
-            cur.execute(
-                'UPDATE products '
-                'SET stock = stock - ?'
-                'WHERE id=?;',
-                (purchase.amount,
-                 product.id)
+        try:
+            cur.executemany(
+                'INSERT INTO purchases('
+                '    consumer_id, '
+                '    product_id, '
+                '    comment, '
+                '    revoked, '
+                '    timestamp,'
+                '    amount,'
+                '    paid_base_price_per_product,'
+                '    paid_karma_per_product) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?);',
+                rows
             )
 
-        cur.execute('UPDATE departments SET '
-                    'income_base = income_base + ?*?, '
-                    'income_karma = income_karma + ?*? '
+            for consumer_id, credit in credits.items():
+                cur.execute(
+                    'UPDATE consumers '
+                    'SET credit = credit - ? '
                     'WHERE id=?;',
-                    (purchase.amount,
-                     product.price,
-                     purchase.amount,
-                     price_to_pay - product.price,
-                     product.department_id)
-                    )
+                    (credit, consumer_id)
+                )
+            for product_id, amount in stocks.items():
+                cur.execute(
+                    'UPDATE products '
+                    'SET stock = stock - ? '
+                    'WHERE id=?;',
+                    (amount, product_id)
+                )
+            for department_id, (base, karma) in incomes.items():
+                cur.execute('UPDATE departments SET '
+                            'income_base = income_base + ?, '
+                            'income_karma = income_karma + ? '
+                            'WHERE id=?;',
+                            (base, karma, department_id)
+                            )
+        except:
+            self.con.rollback()
+            raise
 
         self.con.commit()
 
+    def insert_departmentpurchases(self, dpcollection, dpurchases):
+        """Insert a departmentpurchase collection together with all of its
+        departmentpurchases and return the id of the collection. Everything
+        is checked before anything is written and committed at once."""
+        cur = self.con.cursor()
+        if not dpurchases:
+            raise exc.MissingData()
+
+        self._assert_mandatory_fields(dpcollection,
+                                      ['admin_id', 'department_id'])
+        self._assert_forbidden_fields(dpcollection, ['id', 'timestamp',
+                                                     'revoked', 'sum_price'])
+        self._check_foreign_key(dpcollection, 'admin_id', 'consumers')
+        self._check_foreign_key(dpcollection, 'department_id', 'departments')
+        for dpurchase in dpurchases:
+            self._assert_mandatory_fields(
+                dpurchase, ['product_id', 'amount', 'total_price'])
+            self._assert_forbidden_fields(dpurchase, ['id', 'collection_id'])
+
+        product_ids = sorted(set(d.product_id for d in dpurchases))
+        res = cur.execute('SELECT id FROM products WHERE id IN ({});'.format(
+                          ', '.join('?' * len(product_ids))), product_ids)
+        existing = set(row[0] for row in res)
+        for dpurchase in dpurchases:
+            if dpurchase.product_id not in existing:
+                self._check_foreign_key(dpurchase, 'product_id', 'products')
+
+        # The stock is updated once per product
+        stocks = {}
+        for dpurchase in dpurchases:
+            stocks[dpurchase.product_id] = (
+                stocks.get(dpurchase.product_id, 0) + dpurchase.amount)
+
+        dpcollection.timestamp = datetime.datetime.now()
+        try:
+            cur.execute('INSERT INTO departmentpurchasecollections '
+                        '(timestamp, admin_id, department_id, comment) '
+                        'VALUES (?,?,?,?);',
+                        (dpcollection.timestamp, dpcollection.admin_id,
+                         dpcollection.department_id, dpcollection.comment)
+                        )
+            collection_id = cur.lastrowid
+            cur.executemany('INSERT INTO departmentpurchases '
+                            '(collection_id, product_id, '
+                            'amount, total_price) '
+                            'VALUES (?,?,?,?);',
+                            [(collection_id, d.product_id,
+                              d.amount, d.total_price) for d in dpurchases]
+                            )
+
+            # Update departments expenses
+            cur.execute('UPDATE departments SET expenses=expenses+? '
+                        'WHERE id=?;',
+                        (sum(d.total_price for d in dpurchases),
+                         dpcollection.department_id)
+                        )
+
+            # Update product stock
+            cur.executemany('UPDATE products SET stock=stock+? WHERE id=?;',
+                            [(amount, product_id)
+                             for product_id, amount in stocks.items()]
+                            )
+        except:
+            self.con.rollback()
+            raise
+
+        self.con.commit()
+        return collection_id
+
     def insert_departmentpurchase(self, dpurchase):
         cur = self.con.cursor()
         try:
@@ -585,36 +820,36 @@ class DatabaseApi(object):
         self.con.commit()
 
     def _consumer_credit(self, id):
-        _purchases = self.get_purchases_of_consumer(id=id)
-        _deposits = self.get_deposits_of_consumer(id=id)
-
-        _purchases = [x for x in _purchases if not x.revoked]
-        _deposits = [x for x in _deposits if not x.revoked]
-
-        purchases = list(map(validation.to_dict, _purchases))
-        deposits = list(map(validation.to_dict, _deposits))
-
-        d_amount = sum(map(itemgetter('amount'), deposits))
-        p_amount = - \
-            sum(map(lambda x: x['paid_base_price_per_product']
-                    * x['amount'], purchases))
-        k_amount = - \
-            sum(map(lambda x: x['paid_karma_per_product']
-                    * x['amount'], purchases))
+        """Calculate the credit of a consumer from its purchase and deposit
+        history. The result must always match the credit stored in the
+        consumers table, which is maintained by all write operations."""
+        cur = self.con.cursor()
+        cur.execute('SELECT COALESCE(SUM(amount), 0) FROM deposits AS d '
+                    'WHERE consumer_id=? AND COALESCE(('
+                    '    SELECT revoked FROM depositrevokes '
+                    '    WHERE deposit_id=d.id ORDER BY id DESC LIMIT 1'
+                    '), 0)=0;', (id, ))
+        d_amount = cur.fetchone()[0]
+
+        cur.execute('SELECT COALESCE(SUM(amount * ('
+                    '    paid_base_price_per_product + '
+                    '    paid_karma_per_product)), 0) '
+                    'FROM purchases WHERE consumer_id=? AND revoked=0;',
+                    (id, ))
+        p_amount = cur.fetchone()[0]
 
-        return d_amount + p_amount + k_amount
+        return d_amount - p_amount
 
-    def _get_dpcollection_price(self, id):
-        dpurchases = self.list_departmentpurchases(collection_id=id)
-        dpurchases = list(map(validation.to_dict, dpurchases))
-        amount = sum(map(itemgetter('total_price'), dpurchases))
-        return amount
+    def verify_consumer_credit(self, id):
+        """Check the stored credit of a consumer against its ledger."""
+        consumer = self._get_one(model=models.Consumer, id=id)
+        return consumer.credit == self._consumer_credit(id=consumer.id)
 
     def get_last_departmentpurchasecollection(self):
         cur = self.con.cursor()
         model = models.DepartmentpurchaseCollection
         cur.row_factory = factory(model)
-        cur.execute('SELECt * FROM {} DESC ORDER BY id DESC LIMIT 1;'.format(
+        cur.execute('SELECT * FROM {} ORDER BY id DESC LIMIT 1;'.format(
                     model._tablename))
         return cur.fetchone()
 
@@ -626,52 +861,78 @@ class DatabaseApi(object):
 
     def get_consumer(self, id):
         consumer = self._get_one(model=models.Consumer, id=id)
-        consumer.credit = self._consumer_credit(id=consumer.id)
         consumer.isAdmin = len(self.getAdminroles(consumer)) > 0
         consumer.hasCredentials = all([consumer.email, consumer.password])
         return consumer
 
-    def _get_dpcoll_revoked(self, id):
-        cur = self.con.cursor()
-        cur.row_factory = factory(models.DpcollRevoke)
-        cur.execute('SELECT revoked FROM {} WHERE dpcoll_id=? '
-                    'ORDER BY id DESC;'.format(models.DpcollRevoke._tablename),
-                    (id, ))
-        res = cur.fetchone()
-        return res.revoked if res else False
+    def get_departmentpurchasecollection(self, id):
+        dpc = self._get_one(model=models.DepartmentpurchaseCollection,
+                            id=id)
+        return self._hydrate_dpcollections([dpc])[0]
 
-    def _get_dpcoll_revokehistory(self, id):
-        cur = self.con.cursor()
-        cur.row_factory = factory(models.DpcollRevoke)
-        cur.execute('SELECT * FROM {} WHERE dpcoll_id=?;'.format(
-                    models.DpcollRevoke._tablename), (id, ))
-        res = cur.fetchall()
-        return res if res else None
+    def _get_revokes(self, model, parent_field, ids):
+        """Load the revokes of all given parent ids with a single query and
+        group them by parent id, oldest revoke first."""
+        revokes = collections.defaultdict(list)
+        if not ids:
+            return revokes
 
-    def _get_deposit_revoked(self, id):
         cur = self.con.cursor()
-        cur.row_factory = factory(models.DepositRevoke)
-        cur.execute('SELECT revoked FROM {} WHERE deposit_id=? '
-                    'ORDER BY id DESC;'.format(models.DepositRevoke._tablename),
-                    (id, ))
-        res = cur.fetchone()
-        return res.revoked if res else False
-
-    def _get_deposit_revokehistory(self, id):
+        cur.row_factory = factory(model)
+        for chunk in chunks(ids):
+            cur.execute('SELECT * FROM {0} WHERE {1} IN ({2}) '
+                        'ORDER BY id;'.format(model._tablename, parent_field,
+                                              ', '.join('?' * len(chunk))),
+                        chunk)
+            for revoke in cur:
+                revokes[getattr(revoke, parent_field)].append(revoke)
+
+        return revokes
+
+    def _get_dpcollection_prices(self, ids):
+        """Sum up the departmentpurchases of all given collections."""
+        if not ids:
+            return {}
+
+        prices = {}
         cur = self.con.cursor()
-        cur.row_factory = factory(models.DepositRevoke)
-        cur.execute('SELECT * FROM {} WHERE deposit_id=?;'.format(
-                    models.DepositRevoke._tablename), (id, ))
-        res = cur.fetchall()
-        return res if res else None
+        for chunk in chunks(ids):
+            cur.execute('SELECT collection_id, SUM(total_price) FROM {0} '
+                        'WHERE collection_id IN ({1}) '
+                        'GROUP BY collection_id;'.format(
+                         models.Departmentpurchase._tablename,
+                         ', '.join('?' * len(chunk))),
+                        chunk)
+            prices.update(cur.fetchall())
+        return prices
+
+    def _hydrate_deposits(self, deposits):
+        """Set the revoke history and revoke state of all given deposits.
+        The latest revoke of a deposit determines whether it is revoked."""
+        revokes = self._get_revokes(model=models.DepositRevoke,
+                                    parent_field='deposit_id',
+                                    ids=[d.id for d in deposits])
+        for deposit in deposits:
+            history = revokes.get(deposit.id)
+            deposit.revoke_history = history if history else None
+            deposit.revoked = history[-1].revoked if history else False
 
-    def get_departmentpurchasecollection(self, id):
-        dpc = self._get_one(model=models.DepartmentpurchaseCollection,
-                            id=id)
-        dpc.sum_price = self._get_dpcollection_price(id=id)
-        dpc.revoked = self._get_dpcoll_revoked(id=id)
-        dpc.revoke_history = self._get_dpcoll_revokehistory(id=id)
-        return dpc
+        return deposits
+
+    def _hydrate_dpcollections(self, dpcollections):
+        """Set the price, revoke history and revoke state of all given
+        departmentpurchase collections."""
+        ids = [d.id for d in dpcollections]
+        prices = self._get_dpcollection_prices(ids)
+        revokes = self._get_revokes(model=models.DpcollRevoke,
+                                    parent_field='dpcoll_id', ids=ids)
+        for dpcollection in dpcollections:
+            history = revokes.get(dpcollection.id)
+            dpcollection.sum_price = prices.get(dpcollection.id, 0)
+            dpcollection.revoke_history = history if history else None
+            dpcollection.revoked = history[-1].revoked if history else False
+
+        return dpcollections
 
     def get_product(self, id):
         return self._get_one(model=models.Product, id=id)
@@ -683,8 +944,8 @@ class DatabaseApi(object):
         return self._get_one(model=models.Departmentpurchase, id=id)
 
     def get_deposit(self, id):
-        deposits = self.list_deposits()
-        return next(x for x in deposits if x.id == id)
+        deposit = self._get_one(model=models.Deposit, id=id)
+        return self._hydrate_deposits([deposit])[0]
 
     def get_department(self, id):
         return self._get_one(model=models.Department, id=id)
@@ -695,6 +956,16 @@ class DatabaseApi(object):
     def get_bank(self):
         return self._get_one(model=models.Bank, id=1)
 
+    def get_versions(self, tablenames):
+        """Return the versions of the given tables, which are increased by
+        triggers on every change of the tables."""
+        cur = self.con.cursor()
+        cur.execute('SELECT tablename, version FROM versions '
+                    'WHERE tablename IN ({});'.format(
+                     ', '.join('?' * len(tablenames))), tablenames)
+        versions = dict(cur.fetchall())
+        return tuple(versions[tablename] for tablename in tablenames)
+
     def _get_one(self, model, id):
         cur = self.con.cursor()
         cur.row_factory = factory(model)
@@ -716,44 +987,53 @@ class DatabaseApi(object):
             raise exc.ObjectNotFound()
 
         consumer = res[0]
-        consumer.credit = self._consumer_credit(id=consumer.id)
         consumer.isAdmin = len(self.getAdminroles(consumer)) > 0
         consumer.hasCredentials = all([consumer.email, consumer.password])
         return consumer
 
     def get_activityfeedback(self, activity_id, list_all=False):
-        consumers = self.list_consumers()
+        if not list_all:
+            matrix = self.get_activityfeedback_matrix([activity_id])
+            return matrix[activity_id]
 
         cur = self.con.cursor()
-        cur.row_factory = factory(models.Activityfeedback)
-
-        feedback = {}
-        for consumer in consumers:
-            feedback[consumer.id] = [] if list_all else None
-
-        if list_all:
-            cur.execute('SELECT * FROM {}  WHERE activity_id=?;'.format(
-                        models.Activityfeedback._tablename),
-                        (activity_id, )
-                        )
-        else:
-            cur.execute('SELECT * FROM activityfeedbacks  WHERE activity_id=? '
-                        'GROUP BY consumer_id;'.format(
-                         models.Activityfeedback._tablename), (activity_id, )
-                        )
+        consumer_ids = [row[0] for row in
+                        cur.execute('SELECT id FROM consumers;')]
+        feedback = {consumer_id: [] for consumer_id in consumer_ids}
 
-        res = cur.fetchall()
-
-        if list_all:
-            for r in res:
-                feedback[r.consumer_id].append(validation.to_dict(r))
-
-        else:
-            for r in res:
-                feedback[r.consumer_id] = r.feedback
+        cur.row_factory = factory(models.Activityfeedback)
+        cur.execute('SELECT * FROM {} WHERE activity_id=? ORDER BY id;'.format(
+                    models.Activityfeedback._tablename), (activity_id, ))
+        for r in cur.fetchall():
+            feedback[r.consumer_id].append(validation.to_dict(r))
 
         return feedback
 
+    def get_activityfeedback_matrix(self, activity_ids):
+        """Return the latest feedback of every consumer for the given
+        activities as {activity_id: {consumer_id: feedback}}. Consumers who
+        have not given feedback have None. The feedbacks are selected on the
+        (activity_id, consumer_id, id) index with a query per MAX_VARIABLES
+        activities."""
+        cur = self.con.cursor()
+        consumer_ids = [row[0] for row in
+                        cur.execute('SELECT id FROM consumers;')]
+        matrix = {activity_id: dict.fromkeys(consumer_ids)
+                  for activity_id in activity_ids}
+        if not activity_ids:
+            return matrix
+
+        # With MAX(id), the feedback is taken from the latest row of a group
+        for chunk in chunks(activity_ids):
+            cur.execute('SELECT activity_id, consumer_id, feedback, MAX(id) '
+                        'FROM activityfeedbacks WHERE activity_id IN ({}) '
+                        'GROUP BY activity_id, consumer_id;'.format(
+                         ', '.join('?' * len(chunk))), chunk)
+            for activity_id, consumer_id, feedback, _ in cur:
+                matrix[activity_id][consumer_id] = feedback
+
+        return matrix
+
     def getDepartmentStatistics(self, id):
         statistics = {}
         statistics['department_id'] = id
@@ -803,14 +1083,43 @@ class DatabaseApi(object):
 
         return out
 
-    def get_purchases_of_consumer(self, id):
-        purchases = self.list_purchases()
-        return list(filter(lambda x: x.consumer_id == id, purchases))
-        return self._get_consumer_data(model=models.Purchase, id=id)
-
-    def get_deposits_of_consumer(self, id):
-        deposits = self.list_deposits()
-        return list(filter(lambda x: x.consumer_id == id, deposits))
+    def get_purchases_of_consumer(self, id, limit=None, offset=None,
+                                  before_id=None):
+        return self._get_consumer_data(model=models.Purchase, id=id,
+                                       limit=limit, offset=offset,
+                                       before_id=before_id)
+
+    def get_deposits_of_consumer(self, id, limit=None, offset=None,
+                                 before_id=None):
+        deposits = self._get_consumer_data(model=models.Deposit, id=id,
+                                           limit=limit, offset=offset,
+                                           before_id=before_id)
+        return self._hydrate_deposits(deposits)
+
+    def _get_consumer_data(self, model, id, limit=None, offset=None,
+                           before_id=None):
+        """Select the rows of a consumer via the (consumer_id, id) index.
+        Without limit and before_id, all rows are returned in ascending
+        order and the offset skips the oldest of them. Otherwise the newest
+        rows (older than before_id) are returned first and the offset skips
+        the newest of them."""
+        cur = self.con.cursor()
+        cur.row_factory = factory(model)
+        offset = int(offset) if offset else 0
+        if limit is None and before_id is None:
+            cur.execute('SELECT * FROM {} WHERE consumer_id=? '
+                        'ORDER BY id LIMIT -1 OFFSET ?;'.format(
+                         model._tablename), (id, offset))
+        else:
+            query = 'SELECT * FROM {} WHERE consumer_id=? '
+            params = [id]
+            if before_id is not None:
+                query += 'AND id<? '
+                params.append(int(before_id))
+            query += 'ORDER BY id DESC LIMIT ? OFFSET ?;'
+            params += [-1 if limit is None else int(limit), offset]
+            cur.execute(query.format(model._tablename), params)
+        return cur.fetchall()
 
     def get_favorite_products(self, id):
         cur = self.con.cursor()
@@ -821,37 +1130,49 @@ class DatabaseApi(object):
                     )
         return cur.fetchall()
 
-    def list_consumers(self):
-        _consumers = self._list(model=models.Consumer, limit=None)
+    def list_consumers(self, with_password=False):
+        """List all consumers with a single query. The password hashes are
+        only loaded if they are explicitly requested."""
+        columns = ['id', 'name', 'active', 'karma', 'credit', 'email',
+                   'studentnumber']
+        if with_password:
+            columns.append('password')
 
-        consumers = []
-
-        for consumer in _consumers:
-            consumer.credit = self._consumer_credit(id=consumer.id)
-            consumers.append(consumer)
-            consumer.isAdmin = len(self.getAdminroles(consumer)) > 0
-            consumer.hasCredentials = all([consumer.email, consumer.password])
+        cur = self.con.cursor()
+        cur.row_factory = factory(models.Consumer)
+        cur.execute('SELECT {}, '
+                    'EXISTS (SELECT 1 FROM adminroles '
+                    '        WHERE consumer_id=consumers.id) AS isAdmin, '
+                    '(email IS NOT NULL AND password IS NOT NULL) '
+                    '    AS hasCredentials '
+                    'FROM consumers;'.format(', '.join(columns)))
+        consumers = cur.fetchall()
+        for consumer in consumers:
+            consumer.isAdmin = bool(consumer.isAdmin)
+            consumer.hasCredentials = bool(consumer.hasCredentials)
 
         return consumers
 
-    def list_deposits(self, limit=None):
+    def list_adminroles(self):
+        """Return the adminroles of all consumers, grouped by consumer id."""
         cur = self.con.cursor()
-        cur.row_factory = factory(models.Deposit)
-        if limit:
-            cur.execute('SELECT * FROM {} ORDER BY id  DESC LIMIT ?;'.format(
-                        models.Deposit._tablename), (limit, )
-                        )
-        else:
-            cur.execute('SELECT * FROM {};'.format(
-                        models.Deposit._tablename)
-                        )
-        deposits = cur.fetchall()
-        for deposit in deposits:
-            id = deposit.id
-            deposit.revoke_history = self._get_deposit_revokehistory(id)
-            deposit.revoked = self._get_deposit_revoked(id)
+        cur.row_factory = factory(models.AdminRole)
+        cur.execute('SELECT * FROM adminroles ORDER BY id;')
+        adminroles = collections.defaultdict(list)
+        for adminrole in cur:
+            adminroles[adminrole.consumer_id].append(adminrole)
 
-        return deposits
+        return adminroles
+
+    def list_deposits(self, limit=None, before_id=None):
+        deposits = self._list(model=models.Deposit, limit=limit or None,
+                              before_id=before_id)
+        return self._hydrate_deposits(deposits)
+
+    def iter_deposits(self, limit=None, before_id=None):
+        deposits = self._iter_list(model=models.Deposit, limit=limit or None,
+                                   before_id=before_id)
+        return map(self._hydrate_deposits, deposits)
 
     def list_departmentpurchasecollections(self):
         cur = self.con.cursor()
@@ -859,14 +1180,7 @@ class DatabaseApi(object):
         cur.execute('SELECT * FROM {};'.format(
                     models.DepartmentpurchaseCollection._tablename)
                     )
-        dpcollections = cur.fetchall()
-        for dpcollection in dpcollections:
-            id = dpcollection.id
-            dpcollection.sum_price = self._get_dpcollection_price(id)
-            dpcollection.revoke_history = self._get_dpcoll_revokehistory(id)
-            dpcollection.revoked = self._get_dpcoll_revoked(id)
-
-        return dpcollections
+        return self._hydrate_dpcollections(cur.fetchall())
 
     def list_departmentpurchases(self, collection_id):
         cur = self.con.cursor()
@@ -878,8 +1192,13 @@ class DatabaseApi(object):
     def list_products(self):
         return self._list(model=models.Product, limit=None)
 
-    def list_purchases(self, limit=None):
-        return self._list(model=models.Purchase, limit=limit)
+    def list_purchases(self, limit=None, before_id=None):
+        return self._list(model=models.Purchase, limit=limit,
+                          before_id=before_id)
+
+    def iter_purchases(self, limit=None, before_id=None):
+        return self._iter_list(model=models.Purchase, limit=limit,
+                               before_id=before_id)
 
     def list_departments(self):
         return self._list(model=models.Department, limit=None)
@@ -887,8 +1206,13 @@ class DatabaseApi(object):
     def list_pricecategories(self):
         return self._list(model=models.PriceCategory, limit=None)
 
-    def list_payoffs(self, limit=None):
-        return self._list(model=models.Payoff, limit=limit)
+    def list_payoffs(self, limit=None, before_id=None):
+        return self._list(model=models.Payoff, limit=limit,
+                          before_id=before_id)
+
+    def iter_payoffs(self, limit=None, before_id=None):
+        return self._iter_list(model=models.Payoff, limit=limit,
+                               before_id=before_id)
 
     def list_logs(self, limit=None):
         return self._list(model=models.Log, limit=limit)
@@ -902,18 +1226,36 @@ class DatabaseApi(object):
     def list_banks(self):
         return self._list(model=models.Bank, limit=None)
 
-    def _list(self, model, limit):
+    def _list(self, model, limit, before_id=None):
+        """List the rows of a table. With limit or before_id, the newest rows
+        (older than before_id) are listed first. The pages are selected by
+        primary key, so that an old page costs as much as the first one."""
+        return self._select(model, limit, before_id).fetchall()
+
+    def _iter_list(self, model, limit, before_id=None):
+        """Like _list, but return an iterator over chunks of the rows, which
+        are only fetched when the chunk is needed. The query is executed
+        at once, so that its errors are raised here."""
+        cur = self._select(model, limit, before_id)
+        size = self.configuration['STREAM_CHUNK_SIZE']
+        return iter(lambda: cur.fetchmany(size), [])
+
+    def _select(self, model, limit, before_id):
         cur = self.con.cursor()
         cur.row_factory = factory(model)
-        if limit is None:
+        if limit is None and before_id is None:
             cur.execute('SELECT * FROM {};'.format(model._tablename))
 
         else:
-            limit = int(limit)
-            cur.execute(
-                'SELECT * FROM {} ORDER BY id  DESC LIMIT ?;'.format(
-                    model._tablename), (limit,))
-        return cur.fetchall()
+            query = 'SELECT * FROM {} '
+            params = []
+            if before_id is not None:
+                query += 'WHERE id<? '
+                params.append(int(before_id))
+            query += 'ORDER BY id DESC LIMIT ?;'
+            params.append(-1 if limit is None else int(limit))
+            cur.execute(query.format(model._tablename), params)
+        return cur
 
     def _list_purchases_department(self, department_id, limit=None):
         cur = self.con.cursor()
@@ -181,6 +181,18 @@ class NotRevocable(FieldBasedException):
         FieldBasedException.__init__(self, product.name)
 
 
+class ServerException(Exception):
+
+    def __init__(self, **kwargs):
+        self.info = kwargs
+
+
+class DatabaseUnavailable(ServerException):
+
+    def __init__(self):
+        ServerException.__init__(self)
+
+
 exception_mapping = {
     MissingData:
     {
@@ -330,5 +342,11 @@ exception_mapping = {
         "types": ["input-exception",
                   "invalid-departmentpurchase"],
         "code": 400
+    },
+    DatabaseUnavailable:
+    {
+        "types": ["server-exception",
+                  "database-unavailable"],
+        "code": 503
     }
 }
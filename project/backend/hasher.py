@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import flask_bcrypt
+
+
+def generate_password_hash(password, log_rounds):
+    return flask_bcrypt.generate_password_hash(password, log_rounds)
+
+
+def check_password_hash(pwhash, password):
+    return flask_bcrypt.check_password_hash(pwhash, password)
+
+
+def log_rounds(pwhash):
+    """Return the work factor of a bcrypt hash, e.g. 12 of $2b$12$..."""
+    if isinstance(pwhash, str):
+        pwhash = pwhash.encode('utf-8')
+    return int(pwhash.split(b'$')[2])
+
+
+class PasswordHasher(object):
+    """Hashes and checks the passwords of the consumers with bcrypt. Each
+    hash costs tens to hundreds of milliseconds of CPU, so the hashes are
+    computed in a pool of at most processes processes, which the requests
+    share. With no processes, they are computed in the calling thread.
+
+    The pool is started on first use. Its processes are spawned instead of
+    forked, because a fork would copy the threads and database connections
+    of the caller."""
+
+    def __init__(self, log_rounds, processes=0):
+        self.log_rounds = log_rounds
+        self._executor = None
+        if processes > 0:
+            context = multiprocessing.get_context('spawn')
+            self._executor = ProcessPoolExecutor(processes,
+                                                 mp_context=context)
+
+    def generate(self, password):
+        """Return the hash of a password with the current work factor."""
+        return self._call(generate_password_hash, password, self.log_rounds)
+
+    def check(self, pwhash, password):
+        """Return whether a password matches its hash."""
+        return self._call(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """Return whether a hash has been made with another work factor."""
+        return log_rounds(pwhash) != self.log_rounds
+
+    def close(self):
+        """Stop the processes of the pool."""
+        if self._executor is not None:
+            self._executor.shutdown()
+
+    def _call(self, function, *args):
+        if self._executor is None:
+            return function(*args)
+        return self._executor.submit(function, *args).result()
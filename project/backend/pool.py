@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+
+import logging
+import sqlite3
+import threading
+import time
+from urllib.request import pathname2url
+
+import project.backend.exceptions as exc
+
+
+logger = logging.getLogger(__name__)
+
+
+def connect(uri, read_only=False, pragmas=()):
+    """Open a connection to the shop database. A read-only connection can
+    not change the database, so it never has to wait for the writer."""
+    if read_only:
+        uri = 'file:{}?mode=ro'.format(pathname2url(uri))
+    connection = sqlite3.connect(uri,
+                                 detect_types=sqlite3.PARSE_DECLTYPES,
+                                 check_same_thread=False,
+                                 uri=read_only)
+    connection.execute('PRAGMA foreign_keys = ON;')
+    for pragma in pragmas:
+        connection.execute('PRAGMA {};'.format(pragma))
+    return connection
+
+
+class ConnectionPool(object):
+    """A limited number of connections to the database, which are shared by
+    all threads. A thread checks out its own connection on first use and
+    keeps it until it releases it, e.g. at the end of a request.
+
+    Connections of threads which ended without releasing them are leaks.
+    They are reported and taken back as soon as the pool runs out of
+    connections."""
+
+    def __init__(self, uri, size, timeout=None, read_only=False, pragmas=()):
+        if size < 1:
+            raise ValueError('The pool needs at least one connection')
+
+        self.uri = uri
+        self.size = size
+        self.timeout = timeout
+        self.read_only = read_only
+        self.pragmas = pragmas
+        self._idle = []
+        self._owners = {}
+        self._opened = 0
+        self._closed = False
+        self._local = threading.local()
+        self._condition = threading.Condition()
+
+    def connection(self):
+        """Return the connection of the current thread."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._checkout()
+            self._local.connection = connection
+        return connection
+
+    def release(self):
+        """Return the connection of the current thread to the pool. An
+        unfinished transaction is rolled back."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            return
+
+        del self._local.connection
+        self._rollback(connection, threading.current_thread())
+        with self._condition:
+            self._checkin(connection)
+
+    def checked_out(self):
+        """Return the number of connections which are in use."""
+        with self._condition:
+            return len(self._owners)
+
+    def close(self):
+        """Close all connections of the pool."""
+        with self._condition:
+            self._closed = True
+            for connection in self._idle + list(self._owners):
+                connection.close()
+            self._idle = []
+            self._owners = {}
+            self._condition.notify_all()
+
+    def _checkout(self):
+        deadline = None
+        if self.timeout is not None:
+            deadline = time.monotonic() + self.timeout
+
+        with self._condition:
+            while True:
+                if self._closed:
+                    raise exc.DatabaseUnavailable()
+
+                if self._idle:
+                    connection = self._idle.pop()
+                    break
+
+                if self._opened < self.size:
+                    connection = connect(self.uri, self.read_only,
+                                         self.pragmas)
+                    self._opened += 1
+                    break
+
+                if self._reclaim_leaks():
+                    continue
+
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise exc.DatabaseUnavailable()
+
+                self._condition.wait(remaining)
+
+            self._owners[connection] = threading.current_thread()
+            return connection
+
+    def _checkin(self, connection):
+        if self._owners.pop(connection, None) is None:
+            return
+        self._idle.append(connection)
+        self._condition.notify()
+
+    def _reclaim_leaks(self):
+        leaks = [(connection, owner)
+                 for connection, owner in self._owners.items()
+                 if not owner.is_alive()]
+
+        for connection, owner in leaks:
+            logger.warning('Thread %s ended without releasing its database '
+                           'connection', owner.name)
+            self._rollback(connection, owner)
+            self._checkin(connection)
+
+        return len(leaks) > 0
+
+    def _rollback(self, connection, owner):
+        if connection.in_transaction:
+            logger.warning('Rolling back the unfinished transaction of '
+                           'thread %s', owner.name)
+            connection.rollback()
@@ -8,6 +8,54 @@ def fields(object):
     return object._validators.keys()
 
 
+def loader(cls, columns):
+    """Return a function that builds objects of a model from database rows
+    with the given columns. The rows come from our own database, so they are
+    trusted and not validated again."""
+    for column in columns:
+        if column not in cls._validators:
+            raise exc.UnknownField(column)
+
+    setters = tuple(getattr(cls, column).__set__ for column in columns)
+    new = cls.__new__
+
+    def load(row):
+        obj = new(cls)
+        for setter, value in zip(setters, row):
+            setter(obj, value)
+        return obj
+
+    return load
+
+
+def compile_validators(field, validators):
+    """Compile the validators of a field into a single check function. It
+    raises the same exceptions as calling validate() of each validator."""
+    env = {'exc': exc, 'field': field}
+    lines = []
+    for validator in validators:
+        lines.extend(_source(validator, env))
+
+    body = ''.join('    {}\n'.format(line) for line in lines) or '    pass\n'
+    exec('def check(value):\n' + body, env)
+    return env['check']
+
+
+def _source(validator, env):
+    """Return the source lines of a validator for compile_validators."""
+    if hasattr(validator, 'source'):
+        return validator.source(env)
+
+    return ['{}.validate(field, value)'.format(_constant(env, validator))]
+
+
+def _constant(env, value):
+    """Make a value available to a compiled check function."""
+    name = '_c{}'.format(len(env))
+    env[name] = value
+    return name
+
+
 def to_dict(object):
     d = {}
     for f in fields(object):
@@ -28,6 +76,12 @@ class LessThan(object):
         if value >= self.other:
             raise exc.MaximumValueExceeded(field, upper_bound=self.other)
 
+    def source(self, env):
+        other = _constant(env, self.other)
+        return ['if value >= {}:'.format(other),
+                '    raise exc.MaximumValueExceeded(field, '
+                'upper_bound={})'.format(other)]
+
 
 class LessOrEqual(object):
 
@@ -38,6 +92,12 @@ class LessOrEqual(object):
         if value > self.other:
             raise exc.MaximumValueExceeded(field, upper_bound=self.other)
 
+    def source(self, env):
+        other = _constant(env, self.other)
+        return ['if value > {}:'.format(other),
+                '    raise exc.MaximumValueExceeded(field, '
+                'upper_bound={})'.format(other)]
+
 
 class GreaterThan(object):
 
@@ -48,6 +108,12 @@ class GreaterThan(object):
         if value <= self.other:
             raise exc.MinimumValueUndershot(field, lower_bound=self.other)
 
+    def source(self, env):
+        other = _constant(env, self.other)
+        return ['if value <= {}:'.format(other),
+                '    raise exc.MinimumValueUndershot(field, '
+                'lower_bound={})'.format(other)]
+
 
 class GreaterOrEqual(object):
 
@@ -58,6 +124,12 @@ class GreaterOrEqual(object):
         if value < self.other:
             raise exc.MinimumValueUndershot(field, lower_bound=self.other)
 
+    def source(self, env):
+        other = _constant(env, self.other)
+        return ['if value < {}:'.format(other),
+                '    raise exc.MinimumValueUndershot(field, '
+                'lower_bound={})'.format(other)]
+
 
 class MaxLength(object):
 
@@ -68,6 +140,12 @@ class MaxLength(object):
         if len(value) > self.length:
             raise exc.MaxLengthExceeded(field, max_allowed_length=self.length)
 
+    def source(self, env):
+        length = _constant(env, self.length)
+        return ['if len(value) > {}:'.format(length),
+                '    raise exc.MaxLengthExceeded(field, '
+                'max_allowed_length={})'.format(length)]
+
 
 class MinLength(object):
 
@@ -78,6 +156,12 @@ class MinLength(object):
         if len(value) < self.length:
             raise exc.MinLengthUndershot(field, min_allowed_length=self.length)
 
+    def source(self, env):
+        length = _constant(env, self.length)
+        return ['if len(value) < {}:'.format(length),
+                '    raise exc.MinLengthUndershot(field, '
+                'min_allowed_length={})'.format(length)]
+
 
 class Type(object):
 
@@ -88,6 +172,13 @@ class Type(object):
         if type(value) is not self.type:
             raise exc.WrongType(field, expected_type=self.type.__name__)
 
+    def source(self, env):
+        _type = _constant(env, self.type)
+        name = _constant(env, self.type.__name__)
+        return ['if type(value) is not {}:'.format(_type),
+                '    raise exc.WrongType(field, '
+                'expected_type={})'.format(name)]
+
 
 class SkipIfNone(object):
 
@@ -101,35 +192,73 @@ class SkipIfNone(object):
         for v in self.subvalidators:
             v.validate(field, value)
 
+    def source(self, env):
+        lines = []
+        for v in self.subvalidators:
+            lines.extend('    ' + line for line in _source(v, env))
+
+        if not lines:
+            return []
 
-class ValidatableObject(object):
+        return ['if value is not None:'] + lines
 
-    def __init__(self, **kwargs):
-        self._data = {}
 
+class ValidatableMeta(type):
+    """Gives each model a compact __slots__ layout which is generated from
+    its _validators, so that the instances need no __dict__, and compiles
+    the validators of each field into a single check function."""
+
+    def __new__(mcs, name, bases, namespace):
+        if '__slots__' not in namespace:
+            namespace['__slots__'] = tuple(namespace.get('_validators', ()))
+        cls = type.__new__(mcs, name, bases, namespace)
+        if '_validators' in namespace:
+            cls._checks = {field: compile_validators(field, validators)
+                           for field, validators in cls._validators.items()}
+        return cls
+
+
+class ValidatableObject(object, metaclass=ValidatableMeta):
+    __slots__ = ()
+    _validators = {}
+
+    def __init__(self, **kwargs):
+        checks = self._checks
         for k, v in kwargs.items():
-            setattr(self, k, v)
+            check = checks.get(k, None)
 
-    def __setattr__(self, field_name, field_value):
-        if field_name in ['_data', '_validators']:
-            self.__dict__[field_name] = field_value
-            return
+            if check is None:
+                raise exc.UnknownField(k)
 
-        field_validators = self._validators.get(field_name, None)
+            check(v)
+            object.__setattr__(self, k, v)
 
-        if field_validators is None:
-            raise exc.UnknownField(field_name)
+    def __setattr__(self, field_name, field_value):
+        check = self._checks.get(field_name, None)
 
-        for v in field_validators:
-            v.validate(field_name, field_value)
+        if check is None:
+            raise exc.UnknownField(field_name)
 
-        self._data[field_name] = field_value
+        check(field_value)
+        object.__setattr__(self, field_name, field_value)
 
     def __getattr__(self, field_name):
+        # Only called for fields which have not been set yet.
         if field_name not in self._validators.keys():
             raise exc.UnknownField(field_name)
 
-        return self._data.get(field_name, None)
+        return None
+
+    @property
+    def _data(self):
+        """All fields which have been set."""
+        data = {}
+        for field_name in self._validators:
+            try:
+                data[field_name] = object.__getattribute__(self, field_name)
+            except AttributeError:
+                pass
+        return data
 
     def __repr__(self):
         keys = list(fields(self))
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import project.backend.exceptions as exc
+
+
+logger = logging.getLogger(__name__)
+
+
+class BatchConnection(object):
+    """The connection of the writer thread. All jobs of a batch share one
+    transaction and each job runs in a savepoint of its own. Therefore a
+    commit of a job does nothing, the writer commits the whole batch, and a
+    rollback only undoes the changes of the current job."""
+
+    def __init__(self, connection):
+        self._connection = connection
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        self._connection.execute('ROLLBACK TO job;')
+
+
+class Writer(object):
+    """Applies the writes of all threads one after another in a single
+    thread. A batch takes up to batch_size writes: all which are queued
+    while the previous batch is committed, and those which arrive within
+    delay seconds. Each batch is committed at once.
+
+    The result of a write is only returned after its batch has been
+    committed. If the batch can not be committed, all of its writes fail."""
+
+    def __init__(self, api, batch_size, delay):
+        self.api = api
+        self.batch_size = batch_size
+        self.delay = delay
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='writer',
+                                        daemon=True)
+        self._thread.start()
+
+    def submit(self, function, *args, **kwargs):
+        """Queue a write and return a future of its result."""
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise exc.DatabaseUnavailable()
+            self._queue.put((future, function, args, kwargs))
+        return future
+
+    def call(self, function, *args, **kwargs):
+        """Apply a write and return its result once it is committed."""
+        return self.submit(function, *args, **kwargs).result()
+
+    def close(self):
+        """Apply all queued writes and stop the writer thread."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+        self._thread.join()
+
+    def _next_batch(self):
+        """Return the next batch of jobs and whether the writer stops."""
+        job = self._queue.get()
+        if job is None:
+            return [], True
+
+        batch = [job]
+        deadline = time.monotonic() + self.delay
+        while len(batch) < self.batch_size:
+            # Writes which are already queued always join the batch
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    job = self._queue.get(timeout=remaining)
+                else:
+                    job = self._queue.get_nowait()
+            except queue.Empty:
+                break
+
+            if job is None:
+                return batch, True
+            batch.append(job)
+
+        return batch, False
+
+    def _run(self):
+        connection = self.api.pool.connection()
+        self.api.use_connection(BatchConnection(connection))
+        batch = []
+        try:
+            stop = False
+            while not stop:
+                batch, stop = self._next_batch()
+                if batch:
+                    self._apply(connection, batch)
+        finally:
+            # Nothing which is left has been committed
+            with self._lock:
+                self._closed = True
+            if connection.in_transaction:
+                connection.rollback()
+            while not self._queue.empty():
+                batch.append(self._queue.get())
+            for job in batch:
+                if job is not None and not job[0].done():
+                    job[0].set_exception(exc.DatabaseUnavailable())
+            self.api.use_connection(None)
+            self.api.pool.release()
+
+    def _apply(self, connection, batch):
+        results = []
+        try:
+            # Another process may write the database, too. A deferred
+            # transaction which has read could not be upgraded then
+            connection.execute('BEGIN IMMEDIATE;')
+            for future, function, args, kwargs in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+
+                connection.execute('SAVEPOINT job;')
+                try:
+                    result = function(*args, **kwargs)
+                except Exception as e:
+                    connection.execute('ROLLBACK TO job;')
+                    results.append((future, None, e))
+                else:
+                    results.append((future, result, None))
+                connection.execute('RELEASE job;')
+
+            connection.commit()
+        except Exception as e:
+            logger.exception('The batch of %d writes could not be committed',
+                             len(batch))
+            if connection.in_transaction:
+                connection.rollback()
+            for future, function, args, kwargs in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for future, result, error in results:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
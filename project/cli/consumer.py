@@ -13,7 +13,7 @@ consumerFields = {'name': {'mandatory': True, 'hidden': False},
                   }
 
 
-def _get_password(bcrypt):
+def _get_password(hasher):
     password = None
     rep_password = None
 
@@ -26,17 +26,17 @@ def _get_password(bcrypt):
             rep_password = None
             print('Passwords do not match! Please try again.\n')
 
-    return bcrypt.generate_password_hash(password)
+    return hasher.generate(password)
 
 def _get_consumer(api, name):
-    consumers = api.list_consumers()
+    consumers = api.list_consumers(with_password=True)
     for consumer in consumers:
         if consumer.name == name:
             return consumer
 
     sys.exit('There is no consumer with the name "{}"'.format(name))
 
-def _enter_login_data(consumer, api, bcrypt):
+def _enter_login_data(consumer, api, hasher):
     print('')
     print('The consumer has not stored any login data.')
     print('These must be entered first so that he/she can become')
@@ -49,7 +49,7 @@ def _enter_login_data(consumer, api, bcrypt):
         upConsumer.email = input('email: ')
 
     if consumer.password is None:
-        upConsumer.password = _get_password(bcrypt)
+        upConsumer.password = _get_password(hasher)
 
     print('')
 
@@ -60,11 +60,11 @@ def _enter_login_data(consumer, api, bcrypt):
 
     print('The login data have been successfully updated')
 
-def add_admin(api, bcrypt):
+def add_admin(api, hasher):
     print('Promote a user to the admin for one or more departments\n')
     consumer = _get_consumer(name=input('consumer name: '), api=api)
     if not all([consumer.password, consumer.email]):
-        _enter_login_data(consumer, api, bcrypt)
+        _enter_login_data(consumer, api, hasher)
 
     _departments = api.list_departments()
     _adminroles = api.getAdminroles(consumer)
@@ -100,7 +100,7 @@ def remove_admin(api):
                          'could not be revoked.'.format(dep.name))
 
 
-def add_consumer(api, bcrypt):
+def add_consumer(api, hasher):
     print('Please enter the data of the new consumer:')
 
     # Get name
@@ -131,7 +131,7 @@ def add_consumer(api, bcrypt):
                 rep_password = None
                 print('Passwords do not match! Please try again.\n')
 
-        consumer.password = bcrypt.generate_password_hash(password)
+        consumer.password = hasher.generate(password)
 
         try:
             studentnumber = input('Studentnumber: ')
@@ -142,7 +142,7 @@ def add_consumer(api, bcrypt):
 
     print('Please check if the following data is correct\n')
 
-    for key in consumer.__dict__['_data']:
+    for key in consumer._data:
         if consumerFields[key]['hidden']:
             print('{:20s} *********'.format(key + ':'))
         else:
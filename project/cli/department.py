@@ -25,7 +25,7 @@ def add_department(api):
 
     print('Please check if the following data is correct\n')
 
-    for key in department.__dict__['_data']:
+    for key in department._data:
         if departmentFields[key]['hidden']:
             print('{:20s} *********'.format(key + ':'))
         else:
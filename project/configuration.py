@@ -13,9 +13,58 @@ class BaseConfig(object):
     TEST = False
     DATABASE_URI = __path + '/shop.db'
     DATABASE_SCHEMA = __path + '/models.sql'
+    DATABASE_UPGRADE = __path + '/upgrade.sql'
+    DATABASE_POOL_SIZE = 8
+    DATABASE_POOL_TIMEOUT = 30
+    # With the write-ahead log, the readers work on a snapshot of the
+    # database while it is written, see https://www.sqlite.org/wal.html
+    DATABASE_JOURNAL_MODE = 'WAL'
+    DATABASE_WAL_AUTOCHECKPOINT = 1000
+    # Read-only connections for the GET routes, 0 uses the pool above
+    DATABASE_READ_POOL_SIZE = 8
+    # Apply the writes of the shop in one thread and commit them in batches
+    GROUP_COMMIT = False
+    GROUP_COMMIT_SIZE = 64
+    GROUP_COMMIT_DELAY = 0
     HOST = '0.0.0.0'
     PORT = 5000
     USE_KARMA = False
+    # The adminroles of the consumers, which are checked on every request.
+    # They are cached with the version of the adminroles table, unused
+    # entries expire after PRINCIPAL_CACHE_TTL seconds
+    PRINCIPAL_CACHE_SIZE = 1024
+    PRINCIPAL_CACHE_TTL = 60
+    # Tokens whose signature has been verified already
+    TOKEN_CACHE_SIZE = 4096
+    # Rows per chunk of the lists, which are streamed to the clients
+    STREAM_CHUNK_SIZE = 500
+    # Responses of at least COMPRESS_MIN_SIZE bytes are sent gzipped to the
+    # clients which accept it. The compressed bodies of tagged responses are
+    # cached, see webapi.versioned
+    COMPRESS_MIN_SIZE = 500
+    COMPRESS_LEVEL = 6
+    COMPRESS_CACHE_SIZE = 64
+    # shopdb.py --server async: the threads which run the requests and the
+    # seconds an idle or slow connection may take to send a request or to
+    # take a part of its response
+    ASYNC_WORKERS = 8
+    ASYNC_TIMEOUT = 30
+    # Requests with a longer body are refused with 413 before it is read
+    MAX_CONTENT_LENGTH = 1024 * 1024
+    # shopdb.py --server prefork: the worker processes, each of which serves
+    # like --server async, and the requests after which a worker is
+    # replaced, None keeps the workers. The adminroles and price categories,
+    # which a worker caches, are checked against their versions in the
+    # database, so that changes through another worker take effect at once
+    PREFORK_PROCESSES = os.cpu_count() or 1
+    PREFORK_MAX_REQUESTS = 10000
+    # Seconds after which a worker which is told to stop is killed
+    PREFORK_GRACEFUL_TIMEOUT = 60
+    # The work factor of the password hashes. The hash of a consumer with
+    # another work factor is replaced when the consumer logs in
+    BCRYPT_LOG_ROUNDS = 12
+    # The processes which compute the hashes, 0 uses the request threads
+    BCRYPT_PROCESSES = 2
 
 
 class DevelopmentConfig(BaseConfig):
@@ -24,5 +73,11 @@ class DevelopmentConfig(BaseConfig):
 
 
 class UnittestConfig(BaseConfig):
+    # Each connection to ':memory:' opens its own database
     DATABASE_URI = ':memory:'
+    DATABASE_POOL_SIZE = 1
+    DATABASE_JOURNAL_MODE = None
+    DATABASE_READ_POOL_SIZE = 0
     PRESERVE_CONTEXT_ON_EXCEPTION = False
+    BCRYPT_LOG_ROUNDS = 4
+    BCRYPT_PROCESSES = 0
@@ -178,9 +178,11 @@ CREATE TABLE activities (
 	date_created TIMESTAMP NOT NULL,
 	date_deadline TIMESTAMP NOT NULL,
 	date_event TIMESTAMP NOT NULL,
+	reviewed BOOLEAN NOT NULL,
 	PRIMARY KEY (id),
 	FOREIGN KEY (created_by) REFERENCES consumers (id),
-	FOREIGN KEY (workactivity_id) REFERENCES workactivities (id)
+	FOREIGN KEY (workactivity_id) REFERENCES workactivities (id),
+	CHECK (reviewed IN (0, 1))
 );
 
 CREATE TABLE activityfeedbacks (
@@ -0,0 +1,503 @@
+#!/usr/bin/env python3
+
+import asyncio
+import io
+import logging
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import unquote
+
+
+logger = logging.getLogger(__name__)
+
+
+class BadRequest(Exception):
+    pass
+
+
+class RequestTooLarge(Exception):
+    pass
+
+
+class AsyncServer(object):
+    """Serves a WSGI application from an asyncio event loop. The requests
+    are read and the responses are written by the loop, so slow clients and
+    idle keep-alive connections do not occupy a thread. Only the application
+    itself runs in a pool of at most workers threads, because the database
+    calls block.
+
+    Each request is handled by a single thread, because the application
+    keeps its database connections and request contexts per thread. A
+    response with a Content-Length is complete when the application returns
+    it, so the thread hands it to the loop and is free again at once. Only
+    for a streamed response, the thread waits while the client reads it,
+    until it has not taken a part for timeout seconds.
+
+    Instead of host and port, the server can accept the connections of a
+    listening socket, which it shares with other processes. After
+    max_requests requests, the server stops. A request whose body is longer
+    than max_content_length bytes is answered with 413 without reading the
+    body."""
+
+    def __init__(self, app, host, port, workers, timeout, sock=None,
+                 max_requests=None, max_content_length=None):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.sock = sock
+        self.max_requests = max_requests
+        self.max_content_length = max_content_length
+        self._requests = 0
+        self._executor = ThreadPoolExecutor(max_workers=workers,
+                                            thread_name_prefix='worker')
+        self._loop = None
+        self._stopped = None
+        self._ready = threading.Event()
+        self._idle = set()
+
+    def serve_forever(self):
+        """Serve requests until shutdown is called."""
+        asyncio.run(self._serve())
+
+    def wait_ready(self):
+        """Wait until the server accepts connections."""
+        self._ready.wait()
+
+    def shutdown(self):
+        """Stop serving, this can be called from any thread. The requests
+        which are being handled are finished first."""
+        self._ready.wait()
+        self._loop.call_soon_threadsafe(self._stopped.set)
+
+    async def _serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        server = await asyncio.start_server(self._handle, self.host,
+                                            self.port, sock=self.sock)
+        self.port = server.sockets[0].getsockname()[1]
+        if threading.current_thread() is threading.main_thread():
+            # e.g. systemd stops the service with SIGTERM
+            self._loop.add_signal_handler(signal.SIGTERM, self._stopped.set)
+        self._ready.set()
+        try:
+            await self._stopped.wait()
+        finally:
+            server.close()
+            for writer in self._idle:
+                writer.close()
+            # Connections which have just been accepted are still served
+            while True:
+                tasks = asyncio.all_tasks() - {asyncio.current_task()}
+                if not tasks:
+                    break
+                await asyncio.wait(tasks)
+            self._executor.shutdown()
+
+    async def _handle(self, reader, writer):
+        idle = False
+        try:
+            while True:
+                # Waiting for the next request of a keep-alive connection
+                if idle:
+                    self._idle.add(writer)
+                try:
+                    environ = await asyncio.wait_for(
+                        self._read_request(reader, writer), self.timeout)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError,
+                        ConnectionError):
+                    break
+                except (BadRequest, asyncio.LimitOverrunError, ValueError):
+                    writer.write(b'HTTP/1.1 400 Bad Request\r\n'
+                                 b'Content-Length: 0\r\n'
+                                 b'Connection: close\r\n\r\n')
+                    break
+                except RequestTooLarge:
+                    writer.write(b'HTTP/1.1 413 Payload Too Large\r\n'
+                                 b'Content-Length: 0\r\n'
+                                 b'Connection: close\r\n\r\n')
+                    break
+                finally:
+                    self._idle.discard(writer)
+                if environ is None:
+                    break
+
+                self._requests += 1
+                if self._requests == self.max_requests:
+                    self._stopped.set()
+                keep_alive = await self._loop.run_in_executor(
+                    self._executor, self._respond, environ, writer)
+                # The loop sends the rest of the response without a thread
+                try:
+                    await asyncio.wait_for(writer.drain(), self.timeout)
+                except asyncio.TimeoutError:
+                    writer.transport.abort()
+                    break
+                except ConnectionError:
+                    break
+                if not keep_alive or self._stopped.is_set():
+                    break
+                idle = True
+        finally:
+            try:
+                writer.close()
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _read_request(self, reader, writer):
+        """Read a request and return its WSGI environ, None at the end of
+        the connection."""
+        try:
+            head = await reader.readuntil(b'\r\n\r\n')
+        except asyncio.IncompleteReadError as e:
+            if e.partial.strip():
+                raise
+            return None
+
+        lines = head.decode('latin-1').split('\r\n')
+        try:
+            method, target, version = lines[0].split(' ')
+        except ValueError:
+            raise BadRequest()
+        if not version.startswith('HTTP/1.'):
+            raise BadRequest()
+
+        headers = {}
+        for line in lines[1:]:
+            if not line:
+                continue
+            name, separator, value = line.partition(':')
+            if not separator:
+                raise BadRequest()
+            name = name.strip().upper().replace('-', '_')
+            value = value.strip()
+            if name in headers:
+                value = headers[name] + ',' + value
+            headers[name] = value
+
+        if 'TRANSFER_ENCODING' in headers:
+            raise BadRequest()
+        length = int(headers.get('CONTENT_LENGTH', 0))
+        if length < 0:
+            raise BadRequest()
+        if (self.max_content_length is not None and
+                length > self.max_content_length):
+            raise RequestTooLarge()
+        if length and headers.get('EXPECT', '').lower() == '100-continue':
+            writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+        body = await reader.readexactly(length) if length else b''
+
+        path, _, query = target.partition('?')
+        host, port = writer.get_extra_info('sockname')[:2]
+        peer = writer.get_extra_info('peername') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': method,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': unquote(path, 'latin-1'),
+            'QUERY_STRING': query,
+            'SERVER_NAME': host,
+            'SERVER_PORT': str(port),
+            'SERVER_PROTOCOL': version,
+            'REMOTE_ADDR': peer[0],
+            'REMOTE_PORT': str(peer[1]),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False
+        }
+        for name, value in headers.items():
+            if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                environ[name] = value
+            else:
+                environ['HTTP_' + name] = value
+        return environ
+
+    def _respond(self, environ, writer):
+        """Run the application for a request in a worker thread and send
+        its response. Return whether the connection can be kept open."""
+        response = Response(environ, writer, self._loop, self.timeout)
+        if self._stopped.is_set():
+            response.keep_alive = False
+        result = None
+        try:
+            result = self.app(environ, response.start)
+            for data in result:
+                response.write(data)
+            response.finish()
+        except ConnectionError:
+            return False
+        except Exception:
+            # The application itself answers its errors with 500
+            logger.exception('The response to %s %s failed',
+                             environ['REQUEST_METHOD'], environ['PATH_INFO'])
+            if response.head_sent:
+                return False
+            response.fail()
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        return response.keep_alive
+
+
+class PreforkServer(object):
+    """Serves a WSGI application from several worker processes, which
+    accept the connections of a shared listening socket, so that the
+    requests use more than one core. Each worker serves with an AsyncServer
+    and creates the application by calling setup after it has been forked,
+    so that it opens its own database connections. The server process
+    itself never opens the database.
+
+    After a worker has stopped, it calls teardown, e.g. to stop the
+    processes it has started itself.
+
+    SIGHUP restarts the workers gracefully: new workers are started, while
+    the old ones finish the requests they are handling. A worker which has
+    handled max_requests requests is replaced the same way. SIGTERM and
+    SIGINT stop the workers gracefully and return from serve_forever. A
+    worker which has not stopped graceful_timeout seconds after it has been
+    told to is killed.
+
+    The new workers are forked from the server process, so they run the
+    code and configuration it has loaded. A restart of the server process
+    is needed to update them."""
+
+    signals = {signal.SIGCHLD, signal.SIGHUP, signal.SIGTERM, signal.SIGINT}
+    # The exit status of a worker whose application could not be created
+    BOOT_ERROR = 3
+
+    def __init__(self, setup, host, port, processes, max_requests=None,
+                 workers=8, timeout=30, teardown=None,
+                 graceful_timeout=60, max_content_length=None):
+        self.setup = setup
+        self.teardown = teardown
+        self.processes = processes
+        self.max_requests = max_requests
+        self.workers = workers
+        self.timeout = timeout
+        self.graceful_timeout = graceful_timeout
+        self.max_content_length = max_content_length
+        self.socket = socket.create_server((host, port), backlog=128)
+        self.port = self.socket.getsockname()[1]
+        self._workers = set()
+        # The deadlines of the workers which have been told to stop
+        self._retired = {}
+
+    def serve_forever(self):
+        """Serve requests until SIGTERM or SIGINT is received."""
+        signal.pthread_sigmask(signal.SIG_BLOCK, self.signals)
+        try:
+            for i in range(0, self.processes):
+                self._spawn()
+            self._run()
+        finally:
+            self._retire(self._workers)
+            while True:
+                self._reap()
+                self._kill_overdue()
+                if not self._retired:
+                    break
+                signal.sigtimedwait({signal.SIGCHLD}, 1)
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, self.signals)
+            self.socket.close()
+
+    def _run(self):
+        while True:
+            info = signal.sigtimedwait(self.signals, 1)
+            self._kill_overdue()
+            if info is None:
+                continue
+            signum = info.si_signo
+            if signum == signal.SIGCHLD:
+                self._reap()
+            elif signum == signal.SIGHUP:
+                logger.info('Restarting the workers')
+                workers = set(self._workers)
+                for pid in workers:
+                    self._spawn()
+                self._retire(workers)
+            else:
+                return
+
+    def _reap(self):
+        """Collect the workers which have exited and replace those which
+        have not been retired."""
+        while self._workers or self._retired:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if not pid:
+                return
+            status = os.waitstatus_to_exitcode(status)
+            if pid in self._retired:
+                del self._retired[pid]
+                continue
+
+            self._workers.discard(pid)
+            if status == self.BOOT_ERROR:
+                raise RuntimeError('The worker {} could not be started'
+                                   .format(pid))
+            if status != 0:
+                logger.error('The worker %d exited with %d', pid, status)
+            else:
+                logger.info('The worker %d has handled its requests', pid)
+            self._spawn()
+
+    def _retire(self, pids):
+        deadline = time.monotonic() + self.graceful_timeout
+        for pid in list(pids):
+            self._workers.discard(pid)
+            self._retired[pid] = deadline
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def _kill_overdue(self):
+        now = time.monotonic()
+        for pid, deadline in self._retired.items():
+            if deadline <= now:
+                logger.error('The worker %d has not stopped in time', pid)
+                self._retired[pid] = float('inf')
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+
+    def _spawn(self):
+        pid = os.fork()
+        if pid:
+            self._workers.add(pid)
+            return
+
+        status = 1
+        try:
+            # The server process stops the workers with SIGTERM, also when
+            # SIGINT is sent to the whole process group from a terminal
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGHUP, signal.SIG_IGN)
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, self.signals)
+            try:
+                app = self.setup()
+            except Exception:
+                logger.exception('The application could not be created')
+                status = self.BOOT_ERROR
+                return
+
+            server = AsyncServer(app, None, None, self.workers, self.timeout,
+                                 sock=self.socket,
+                                 max_requests=self.max_requests,
+                                 max_content_length=self.max_content_length)
+            try:
+                server.serve_forever()
+            finally:
+                if self.teardown is not None:
+                    self.teardown()
+            status = 0
+        except BaseException:
+            logger.exception('The worker failed')
+        finally:
+            os._exit(status)
+
+
+class Response(object):
+    """The response to a single request, which is written from a worker
+    thread to the connection of the event loop. A body with a length is
+    handed to the loop without waiting for the client. A body without
+    length is streamed: it is sent in chunks to HTTP/1.1 clients and closes
+    the connection of HTTP/1.0 clients, and the thread waits for the client
+    to take each part. A client which does not take a part within timeout
+    seconds is disconnected, so that it does not hold the thread, its
+    database connection and its snapshot any longer."""
+
+    def __init__(self, environ, writer, loop, timeout):
+        self.writer = writer
+        self.loop = loop
+        self.timeout = timeout
+        self.head_sent = False
+        self.status = None
+        self.headers = None
+        self.version = environ['SERVER_PROTOCOL']
+        self.method = environ['REQUEST_METHOD']
+        connection = environ.get('HTTP_CONNECTION', '').lower()
+        if self.version == 'HTTP/1.0':
+            self.keep_alive = connection == 'keep-alive'
+        else:
+            self.keep_alive = connection != 'close'
+        self.chunked = False
+        self.streamed = True
+
+    def start(self, status, headers, exc_info=None):
+        if exc_info and self.head_sent:
+            raise exc_info[1].with_traceback(exc_info[2])
+        self.status = status
+        self.headers = headers
+        return self.write
+
+    def write(self, data):
+        if not self.head_sent:
+            self._send_head()
+        if data and self._has_body():
+            if self.chunked:
+                data = b'%x\r\n%s\r\n' % (len(data), data)
+            self._send(data)
+
+    def finish(self):
+        if not self.head_sent:
+            self._send_head()
+        if self.chunked:
+            self._send(b'0\r\n\r\n')
+
+    def fail(self):
+        self.keep_alive = False
+        self._send(b'HTTP/1.1 500 Internal Server Error\r\n'
+                   b'Content-Length: 0\r\nConnection: close\r\n\r\n')
+
+    def _has_body(self):
+        code = int(self.status.split(' ', 1)[0])
+        return (self.method != 'HEAD' and code >= 200 and
+                code not in (HTTPStatus.NO_CONTENT, HTTPStatus.NOT_MODIFIED))
+
+    def _send_head(self):
+        names = set(name.lower() for name, value in self.headers)
+        headers = [(name, value) for name, value in self.headers
+                   if name.lower() != 'connection']
+        self.streamed = 'content-length' not in names and self._has_body()
+        if self.streamed:
+            if self.version == 'HTTP/1.1':
+                self.chunked = True
+                headers.append(('Transfer-Encoding', 'chunked'))
+            else:
+                self.keep_alive = False
+        headers.append(('Connection',
+                        'keep-alive' if self.keep_alive else 'close'))
+
+        lines = ['HTTP/1.1 {}'.format(self.status)]
+        lines += ['{}: {}'.format(name, value) for name, value in headers]
+        self.head_sent = True
+        self._send(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+
+    def _send(self, data):
+        if not self.streamed:
+            self.loop.call_soon_threadsafe(self.writer.write, data)
+            return
+        # Waits for slow clients once the send buffer is full
+        asyncio.run_coroutine_threadsafe(self._write(data), self.loop).result()
+
+    async def _write(self, data):
+        self.writer.write(data)
+        try:
+            await asyncio.wait_for(self.writer.drain(), self.timeout)
+        except asyncio.TimeoutError:
+            self.writer.transport.abort()
+            raise ConnectionError('The client does not read the response')
@@ -0,0 +1,128 @@
+-- The changes of the schema since models.sql has been released first. Every
+-- statement can be repeated, so that the script brings the databases of all
+-- older schemas up to date, see DatabaseApi.upgrade_tables.
+
+CREATE INDEX IF NOT EXISTS purchases_consumer_id
+	ON purchases (consumer_id, id);
+
+CREATE INDEX IF NOT EXISTS departmentpurchases_collection_id
+	ON departmentpurchases (collection_id);
+
+CREATE INDEX IF NOT EXISTS dpcollrevokes_dpcoll_id
+	ON dpcollrevokes (dpcoll_id, id);
+
+CREATE INDEX IF NOT EXISTS deposits_consumer_id
+	ON deposits (consumer_id, id);
+
+CREATE INDEX IF NOT EXISTS depositrevokes_deposit_id
+	ON depositrevokes (deposit_id, id);
+
+CREATE INDEX IF NOT EXISTS adminroles_consumer_id ON adminroles (consumer_id);
+
+CREATE INDEX IF NOT EXISTS activityfeedbacks_activity_id
+	ON activityfeedbacks (activity_id, consumer_id, id);
+
+-- The version of a table is increased by every change of it. The lists of
+-- these tables are only sent again if their version has changed.
+CREATE TABLE IF NOT EXISTS versions (
+	tablename VARCHAR(32) NOT NULL,
+	version INTEGER NOT NULL,
+	PRIMARY KEY (tablename)
+);
+
+CREATE TRIGGER IF NOT EXISTS consumers_insert_version AFTER INSERT ON consumers
+BEGIN
+	UPDATE versions SET version = version + 1 WHERE tablename = 'consumers';
+END;
+
+CREATE TRIGGER IF NOT EXISTS consumers_update_version AFTER UPDATE ON consumers
+BEGIN
+	UPDATE versions SET version = version + 1 WHERE tablename = 'consumers';
+END;
+
+CREATE TRIGGER IF NOT EXISTS consumers_delete_version AFTER DELETE ON consumers
+BEGIN
+	UPDATE versions SET version = version + 1 WHERE tablename = 'consumers';
+END;
+
+CREATE TRIGGER IF NOT EXISTS departments_insert_version AFTER INSERT ON departments
+BEGIN
+	UPDATE versions SET version = version + 1 WHERE tablename = 'departments';
+END;
+
+CREATE TRIGGER IF NOT EXISTS departments_update_version AFTER UPDATE ON departments
+BEGIN
+	UPDATE versions SET version = version + 1 WHERE tablename = 'departments';
+END;
+
+CREATE TRIGGER IF NOT EXISTS departments_delete_version AFTER DELETE ON departments
+BEGIN
+	UPDATE versions SET version = version + 1 WHERE tablename = 'departments';
+END;
+
+CREATE TRIGGER IF NOT EXISTS products_insert_version AFTER INSERT ON products
+BEGIN
+	UPDATE versions SET version = version + 1 WHERE tablename = 'products';
+END;
+
+CREATE TRIGGER IF NOT EXISTS products_update_version AFTER UPDATE ON products
+BEGIN
+	UPDATE versions SET version = version + 1 WHERE tablename = 'products';
+END;
+
+CREATE TRIGGER IF NOT EXISTS products_delete_version AFTER DELETE ON products
+BEGIN
+	UPDATE versions SET version = version + 1 WHERE tablename = 'products';
+END;
+
+CREATE TRIGGER IF NOT EXISTS adminroles_insert_version AFTER INSERT ON adminroles
+BEGIN
+	UPDATE versions SET version = version + 1 WHERE tablename = 'adminroles';
+END;
+
+CREATE TRIGGER IF NOT EXISTS adminroles_update_version AFTER UPDATE ON adminroles
+BEGIN
+	UPDATE versions SET version = version + 1 WHERE tablename = 'adminroles';
+END;
+
+CREATE TRIGGER IF NOT EXISTS adminroles_delete_version AFTER DELETE ON adminroles
+BEGIN
+	UPDATE versions SET version = version + 1 WHERE tablename = 'adminroles';
+END;
+
+CREATE TRIGGER IF NOT EXISTS workactivities_insert_version AFTER INSERT ON workactivities
+BEGIN
+	UPDATE versions SET version = version + 1 WHERE tablename = 'workactivities';
+END;
+
+CREATE TRIGGER IF NOT EXISTS workactivities_update_version AFTER UPDATE ON workactivities
+BEGIN
+	UPDATE versions SET version = version + 1 WHERE tablename = 'workactivities';
+END;
+
+CREATE TRIGGER IF NOT EXISTS workactivities_delete_version AFTER DELETE ON workactivities
+BEGIN
+	UPDATE versions SET version = version + 1 WHERE tablename = 'workactivities';
+END;
+
+CREATE TRIGGER IF NOT EXISTS pricecategories_insert_version AFTER INSERT ON pricecategories
+BEGIN
+	UPDATE versions SET version = version + 1 WHERE tablename = 'pricecategories';
+END;
+
+CREATE TRIGGER IF NOT EXISTS pricecategories_update_version AFTER UPDATE ON pricecategories
+BEGIN
+	UPDATE versions SET version = version + 1 WHERE tablename = 'pricecategories';
+END;
+
+CREATE TRIGGER IF NOT EXISTS pricecategories_delete_version AFTER DELETE ON pricecategories
+BEGIN
+	UPDATE versions SET version = version + 1 WHERE tablename = 'pricecategories';
+END;
+
+INSERT OR IGNORE INTO versions (tablename, version) VALUES ('consumers', 0);
+INSERT OR IGNORE INTO versions (tablename, version) VALUES ('departments', 0);
+INSERT OR IGNORE INTO versions (tablename, version) VALUES ('products', 0);
+INSERT OR IGNORE INTO versions (tablename, version) VALUES ('adminroles', 0);
+INSERT OR IGNORE INTO versions (tablename, version) VALUES ('workactivities', 0);
+INSERT OR IGNORE INTO versions (tablename, version) VALUES ('pricecategories', 0);
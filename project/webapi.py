@@ -1,15 +1,16 @@
 #!/usr/bin/env python3
-import json
 import pdb
-import sqlite3
 import datetime
 import argparse
+import gzip
+import time
+import zlib
 
-from flask import (Flask, Request, g, jsonify, request,
-                   make_response, send_from_directory)
-from flask_bcrypt import Bcrypt
+from flask import (Flask, Request, g, json, jsonify, request,
+                   make_response, send_from_directory, stream_with_context)
 from flask_cors import CORS
 from functools import wraps
+from urllib.parse import urlencode
 
 import jwt
 
@@ -18,31 +19,163 @@ from werkzeug.utils import secure_filename
 
 import project.configuration as config
 import project.backend.db_api as db_api
+import project.backend.pool as pool
+import project.backend.writer as writers
+import project.backend.hasher as hashers
 import project.backend.models as models
 import project.backend.validation as validation
 import project.backend.exceptions as exc
+from project.backend.cache import TTLCache
 
 app = Flask(__name__)
-CORS(app)
-bcrypt = Bcrypt(app)
+CORS(app, expose_headers=['Link', 'ETag'])
 api = None
+writer = None
+readers = None
+hasher = None
+tokens = None
+compressed = None
 
 
 def set_app(configuration):
-    global api
+    global api, writer, readers, hasher, tokens, compressed
     app.config.from_object(configuration)
-    connection = sqlite3.connect(app.config['DATABASE_URI'],
-                                 detect_types=sqlite3.PARSE_DECLTYPES,
-                                 check_same_thread=False)
-    api = db_api.DatabaseApi(connection, app.config)
+    # The entries expire together with their tokens
+    tokens = TTLCache(app.config['TOKEN_CACHE_SIZE'], ttl=0)
+    # The tags change with the bodies, so the entries never become stale
+    compressed = TTLCache(app.config['COMPRESS_CACHE_SIZE'],
+                          ttl=float('inf'))
+    close_app()
+
+    pragmas = []
+    if app.config['DATABASE_JOURNAL_MODE'] is not None:
+        pragmas.append('journal_mode = {}'
+                       .format(app.config['DATABASE_JOURNAL_MODE']))
+    if app.config['DATABASE_WAL_AUTOCHECKPOINT'] is not None:
+        pragmas.append('wal_autocheckpoint = {}'
+                       .format(app.config['DATABASE_WAL_AUTOCHECKPOINT']))
+
+    connections = pool.ConnectionPool(app.config['DATABASE_URI'],
+                                      app.config['DATABASE_POOL_SIZE'],
+                                      app.config['DATABASE_POOL_TIMEOUT'],
+                                      pragmas=pragmas)
+    api = db_api.DatabaseApi(connections, app.config)
+    # Databases of older schemas get what they lack before the first request
+    api.upgrade_tables()
+    api.pool.release()
+    if app.config['DATABASE_READ_POOL_SIZE'] > 0:
+        readers = pool.ConnectionPool(app.config['DATABASE_URI'],
+                                      app.config['DATABASE_READ_POOL_SIZE'],
+                                      app.config['DATABASE_POOL_TIMEOUT'],
+                                      read_only=True)
+    if app.config['GROUP_COMMIT']:
+        writer = writers.Writer(api, app.config['GROUP_COMMIT_SIZE'],
+                                app.config['GROUP_COMMIT_DELAY'])
+    hasher = hashers.PasswordHasher(app.config['BCRYPT_LOG_ROUNDS'],
+                                    app.config['BCRYPT_PROCESSES'])
     return app, api
 
 
+def close_app():
+    """Stop the writer and the password hasher and close the database
+    connections, e.g. before the process exits."""
+    global writer, readers, hasher
+    if writer is not None:
+        writer.close()
+        writer = None
+    if readers is not None:
+        readers.close()
+        readers = None
+    if hasher is not None:
+        hasher.close()
+        hasher = None
+    if api is not None:
+        api.pool.close()
+
+
+def write(function, *args):
+    """Apply a write to the database. With GROUP_COMMIT, the write is done
+    by the writer thread, which commits it together with others. Every
+    route which changes the database writes through here, so that no
+    request commits in competition with the batches of the writer."""
+    if writer is None:
+        return function(*args)
+    return writer.call(function, *args)
+
+
+@app.before_request
+def read_only_connection():
+    # GET routes read a consistent snapshot of the database on a read-only
+    # connection, so they neither wait for nor block the writes
+    if readers is not None and request.method == 'GET':
+        connection = readers.connection()
+        connection.execute('BEGIN;')
+        api.use_connection(connection)
+        g.read_only_connection = connection
+
+
+@app.teardown_request
+def teardown_read_only_connection(exception):
+    connection = g.pop('read_only_connection', None)
+    if connection is not None:
+        connection.rollback()
+        api.use_connection(None)
+        readers.release()
+
+
 @app.teardown_appcontext
 def teardown_db(exception):
-    db = getattr(g, '_database', None)
-    if db is not None:
-        db.close()
+    # Every request returns the connection it has checked out
+    if api is not None:
+        api.pool.release()
+
+
+@app.after_request
+def compress(response):
+    # The lists are repetitive and shrink to a fraction of their size
+    if (response.status_code != 200 or response.direct_passthrough or
+            'Content-Encoding' in response.headers):
+        return response
+    if (not response.is_streamed and
+            response.content_length < app.config['COMPRESS_MIN_SIZE']):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    if not request.accept_encodings['gzip']:
+        return response
+
+    level = app.config['COMPRESS_LEVEL']
+    if response.is_streamed:
+        response.response = gzip_chunks(response.response, level)
+    else:
+        etag = response.get_etag()[0]
+        key = (request.full_path, etag)
+        body = compressed.get(key) if etag else None
+        if body is None:
+            body = gzip.compress(response.get_data(), level, mtime=0)
+            if etag:
+                compressed.set(key, body)
+        response.set_data(body)
+
+    response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+
+def gzip_chunks(chunks, level):
+    """Compress a streamed body one chunk after another. The body is closed
+    like the response, so that its request is torn down."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
 
 
 Request.on_json_loading_failed = exc.InvalidJSON()
@@ -66,6 +199,61 @@ def json_body():
     return jb
 
 
+def decode_token(token):
+    """Return the claims of a token. The signatures of valid tokens are only
+    verified once and remembered until the tokens expire."""
+    claims = tokens.get(token)
+    if claims is None:
+        try:
+            claims = jwt.decode(token, app.config['SECRET_KEY'],
+                                algorithms=['HS256'])
+        except jwt.exceptions.InvalidTokenError:
+            raise exc.TokenInvalid
+
+        if 'exp' in claims:
+            tokens.set(token, claims, ttl=claims['exp'] - time.time())
+    return claims
+
+
+def page_args(limit=None):
+    """Return the limit and the before_id cursor of a paginated request. The
+    limit can also be given by the path of some routes."""
+    return (request.args.get('limit', limit, type=int),
+            request.args.get('before_id', type=int))
+
+
+def paginated(objects, limit):
+    """Return a page of objects. If the page is full, the Link header points
+    to the next page, whose rows are older than the last one. The offset of
+    the page has been applied already, so the next page has none."""
+    response = jsonify(list(map(validation.to_dict, objects)))
+    if limit and len(objects) == limit:
+        args = request.args.to_dict()
+        args.pop('offset', None)
+        args['limit'] = limit
+        args['before_id'] = objects[-1].id
+        response.headers['Link'] = '<{}?{}>; rel="next"'.format(
+            request.path, urlencode(args))
+    return response
+
+
+def streamed(chunks):
+    """Return a JSON list of the objects in chunks, which is serialized one
+    chunk at a time while it is sent. The memory of the response does not
+    grow with the length of the list."""
+    def generate():
+        separator = '['
+        for chunk in chunks:
+            if chunk:
+                yield separator + ','.join(
+                    json.dumps(validation.to_dict(o)) for o in chunk)
+                separator = ','
+        yield '[]' if separator == '[' else ']'
+
+    return app.response_class(stream_with_context(generate()),
+                              mimetype=app.config['JSONIFY_MIMETYPE'])
+
+
 def adminRequired(f):
     @wraps(f)
     def decorated(*args, **kwargs):
@@ -74,28 +262,15 @@ def adminRequired(f):
         except KeyError:
             raise exc.TokenMissing
 
+        data = decode_token(token)
         try:
-            data = jwt.decode(token, app.config['SECRET_KEY'])
-        except jwt.exceptions.DecodeError:
-            raise exc.TokenInvalid
-
-        try:
-            admin = data['admin']
-            admin = api.get_consumer(admin['id'])
-            adminroles = api.getAdminroles(admin)
+            admin = api.get_principal(data['admin']['id'])
         except KeyError:
             raise exc.NotAuthorized
 
-        if len(adminroles) == 0:
+        if len(admin['adminroles']) == 0:
             raise exc.NotAuthorized
 
-        admin = validation.to_dict(admin)
-        _adminroles = []
-        for a in adminroles:
-            _adminroles.append(a.department_id)
-
-        admin['adminroles'] = _adminroles
-
         return f(admin, *args, **kwargs)
     return decorated
 
@@ -111,14 +286,36 @@ def tokenOptional(f):
             return f(False, *args, **kwargs)
 
         try:
-            data = jwt.decode(token, app.config['SECRET_KEY'])
-        except:
+            decode_token(token)
+        except exc.TokenInvalid:
             return f(False, *args, **kwargs)
 
         return f(True, *args, **kwargs)
     return decorated
 
 
+def versioned(*tablenames):
+    """Tag the responses of a route with the versions of the tables it reads
+    and answer with 304, before the route runs, if the client has got the
+    current versions already. The arguments of the route, like whether a
+    valid token has been given, select the representation and are part of
+    the tag."""
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            parts = list(api.get_versions(tablenames)) + list(args)
+            parts += [kwargs[key] for key in sorted(kwargs)]
+            etag = '-'.join(map(str, parts))
+            if request.if_none_match.contains_weak(etag):
+                response = app.response_class(status=304)
+            else:
+                response = make_response(f(*args, **kwargs))
+            response.set_etag(etag, weak=True)
+            return response
+        return decorated
+    return decorator
+
+
 def convertMinimal(_list, _fields):
     out = []
     for item in _list:
@@ -173,25 +370,28 @@ def login():
     if not consumer['hasCredentials']:
         raise exc.ConsumerNeedsCredentials
 
-    if not bcrypt.check_password_hash(consumer['password'], password):
+    if not hasher.check(consumer['password'], password):
         raise exc.NotAuthorized
 
-    # Check if the consumer has administrator rights
-    adminroles = api.getAdminroles(api.get_consumer(consumer['id']))
-    if not adminroles:
+    # The hash is replaced, when the work factor has been changed
+    if hasher.needs_rehash(consumer['password']):
+        write(api.update_consumer, models.Consumer(
+            id=consumer['id'], password=hasher.generate(password)))
+
+    # Check if the consumer has administrator rights. The token only holds
+    # the id of the consumer and the department ids of its adminroles.
+    principal = api.get_principal(consumer['id'])
+    if not principal['adminroles']:
         _type = 'consumer'
+        del principal['adminroles']
     else:
         _type = 'admin'
-        consumer['adminroles'] = list(map(validation.to_dict, adminroles))
-        for role in consumer['adminroles']:
-            role['timestamp'] = str(role['timestamp'])
-
-    del consumer['password']
 
     # Define token
     exp = datetime.datetime.now() + datetime.timedelta(minutes=30)
 
-    token = jwt.encode({_type: consumer, 'exp': exp}, app.config['SECRET_KEY'])
+    token = jwt.encode({_type: principal, 'exp': exp},
+                       app.config['SECRET_KEY'])
 
     result = {}
     result['result'] = True
@@ -206,6 +406,7 @@ def login():
 # List departments
 @app.route('/departments', methods=['GET'])
 @tokenOptional
+@versioned('departments')
 def listDepartments(token):
     departments = api.list_departments()
     if token:
@@ -228,16 +429,17 @@ def getDepartmentStatistics(admin, id):
 # List consumers
 @app.route('/consumers', methods=['GET'])
 @tokenOptional
+@versioned('consumers', 'adminroles')
 def listConsumers(token):
     consumers = api.list_consumers()
 
     if token:
+        adminroles = api.list_adminroles()
         consumers = list(map(validation.to_dict, consumers))
         for consumer in consumers:
             del consumer['password']
-            cons = models.Consumer(id=consumer['id'])
-            adminroles = list(map(validation.to_dict, api.getAdminroles(cons)))
-            consumer['adminroles'] = adminroles
+            roles = adminroles.get(consumer['id'], [])
+            consumer['adminroles'] = list(map(validation.to_dict, roles))
 
         return jsonify(consumers)
 
@@ -250,7 +452,7 @@ def listConsumers(token):
 @adminRequired
 def insertConsumer(admin):
     c = models.Consumer(**json_body())
-    api.insert_consumer(c)
+    write(api.insert_consumer, c)
     return jsonify(result='created'), 201
 
 
@@ -290,7 +492,7 @@ def updateConsumer(admin, id):
         if not apiconsumer.email:
             if 'email' not in data:
                 raise exc.MissingData
-        _pwhash = bcrypt.generate_password_hash(data['password'])
+        _pwhash = hasher.generate(data['password'])
         del data['password']
         del data['repeatpassword']
         data['password'] = _pwhash
@@ -313,7 +515,8 @@ def updateConsumer(admin, id):
                     if data['adminroles'][dep_id]:
                         continue
             department = api.get_department(int(dep_id))
-            api.setAdmin(apiconsumer, department, data['adminroles'][dep_id])
+            write(api.setAdmin, apiconsumer, department,
+                  data['adminroles'][dep_id])
 
         del data['adminroles']
 
@@ -322,7 +525,7 @@ def updateConsumer(admin, id):
         setattr(updateconsumer, key, value)
 
     # Update consumer
-    api.update_consumer(updateconsumer)
+    write(api.update_consumer, updateconsumer)
 
     return jsonify(result=True), 200
 
@@ -336,15 +539,21 @@ def getConsumerFavorites(id):
 # Get consumer's purchases
 @app.route('/consumer/<int:id>/purchases', methods=['GET'])
 def getConsumerPurchases(id):
-    purchases = api.get_purchases_of_consumer(id)
-    return jsonify(list(map(validation.to_dict, purchases)))
+    limit, before_id = page_args()
+    purchases = api.get_purchases_of_consumer(
+        id, limit=limit, offset=request.args.get('offset', type=int),
+        before_id=before_id)
+    return paginated(purchases, limit)
 
 
 # Get consumer's deposits
 @app.route('/consumer/<int:id>/deposits', methods=['GET'])
 def getConsumerDeposits(id):
-    deposits = api.get_deposits_of_consumer(id)
-    return jsonify(list(map(validation.to_dict, deposits)))
+    limit, before_id = page_args()
+    deposits = api.get_deposits_of_consumer(
+        id, limit=limit, offset=request.args.get('offset', type=int),
+        before_id=before_id)
+    return paginated(deposits, limit)
 
 
 
@@ -353,6 +562,7 @@ def getConsumerDeposits(id):
 
 # List products
 @app.route('/products', methods=['GET'])
+@versioned('products')
 def listProducts():
     return jsonify(list(map(validation.to_dict, api.list_products())))
 
@@ -361,7 +571,7 @@ def listProducts():
 @app.route('/products', methods=['POST'])
 @adminRequired
 def insertProduct(admin):
-    api.insert_product(models.Product(**json_body()))
+    write(api.insert_product, models.Product(**json_body()))
     return jsonify(result='created'), 201
 
 
@@ -377,7 +587,7 @@ def getProduct(id):
 def updateProduct(admin, id):
     p = models.Product(**json_body())
     p.id = id
-    api.update_product(p)
+    write(api.update_product, p)
     return jsonify(result='updated'), 200
 
 
@@ -388,13 +598,40 @@ def updateProduct(admin, id):
 @app.route('/purchases', methods=['GET'])
 @app.route('/purchases/<int:limit>', methods=['GET'])
 def listPurchases(limit=None):
-    return jsonify(list(map(validation.to_dict, api.list_purchases(limit=limit))))
+    limit, before_id = page_args(limit)
+    if limit is None:
+        return streamed(api.iter_purchases(before_id=before_id))
+    return paginated(api.list_purchases(limit=limit, before_id=before_id),
+                     limit)
 
 
 # Insert purchase
 @app.route('/purchases', methods=['POST'])
 def insertPurchase():
-    api.insert_purchase(models.Purchase(**json_body()))
+    write(api.insert_purchase, models.Purchase(**json_body()))
+    return jsonify(result='created'), 201
+
+
+# Check out a cart of purchases
+@app.route('/cart', methods=['POST'])
+def insertCart():
+    data = json_body()
+    items = data.pop('items', None)
+    if not isinstance(items, list):
+        raise exc.MissingData()
+
+    purchases = []
+    for item in items:
+        if not isinstance(item, dict):
+            raise exc.WrongType('items', expected_type='dict')
+        # An item may have a comment of its own, but all of them are bought
+        # by the consumer of the cart
+        for key in item:
+            if key not in ['product_id', 'amount', 'comment']:
+                raise exc.ForbiddenField(key)
+        purchases.append(models.Purchase(**dict(data, **item)))
+
+    write(api.insert_purchases, purchases)
     return jsonify(result='created'), 201
 
 
@@ -409,7 +646,7 @@ def getPurchase(id):
 def updatePurchase(id):
     p = models.Purchase(**json_body())
     p.id = id
-    api.update_purchase(p)
+    write(api.update_purchase, p)
     return jsonify(result='updated'), 200
 
 
@@ -420,14 +657,18 @@ def updatePurchase(id):
 @app.route('/deposits', methods=['GET'])
 @app.route('/deposits/<int:limit>', methods=['GET'])
 def listDeposits(limit=None):
-    return jsonify(list(map(validation.to_dict, api.list_deposits(limit=limit))))
+    limit, before_id = page_args(limit)
+    if limit is None:
+        return streamed(api.iter_deposits(before_id=before_id))
+    return paginated(api.list_deposits(limit=limit, before_id=before_id),
+                     limit)
 
 
 # Insert deposit
 @app.route('/deposits', methods=['POST'])
 @adminRequired
 def insertDeposit(admin):
-    api.insert_deposit(models.Deposit(**json_body()))
+    write(api.insert_deposit, models.Deposit(**json_body()))
     return jsonify(result='created'), 201
 
 
@@ -437,7 +678,7 @@ def insertDeposit(admin):
 def update_deposit(admin, id):
     deposit = models.Deposit(**json_body())
     deposit.id = id
-    api.update_deposit(deposit, admin)
+    write(api.update_deposit, deposit, admin)
     return jsonify(result='updated'), 200
 
 
@@ -446,7 +687,11 @@ def update_deposit(admin, id):
 # List payoffs
 @app.route('/payoffs', methods=['GET'])
 def list_payoffs():
-    return jsonify(list(map(validation.to_dict, api.list_payoffs())))
+    limit, before_id = page_args()
+    if limit is None:
+        return streamed(api.iter_payoffs(before_id=before_id))
+    return paginated(api.list_payoffs(limit=limit, before_id=before_id),
+                     limit)
 
 
 # Insert payoff
@@ -454,7 +699,7 @@ def list_payoffs():
 @adminRequired
 def insertPayoff(admin):
     # TODO check responsible
-    api.insert_payoff(models.Payoff(**json_body()))
+    write(api.insert_payoff, models.Payoff(**json_body()))
     return jsonify(result='created'), 201
 
 
@@ -463,7 +708,7 @@ def insertPayoff(admin):
 def update_payoff(id):
     p = models.Payoff(**json_body())
     p.id = id
-    api.update_payoff(p)
+    write(api.update_payoff, p)
     return jsonify(result='updated'), 200
 
 
@@ -472,6 +717,7 @@ def update_payoff(id):
 
 # List workactivities
 @app.route('/workactivities', methods=['GET'])
+@versioned('workactivities')
 def listWorkactivities():
     return jsonify(list(map(validation.to_dict, api.list_workactivities())))
 
@@ -480,7 +726,7 @@ def listWorkactivities():
 @app.route('/workactivities', methods=['POST'])
 @adminRequired
 def insertWorkactivity(admin):
-    api.insert_workactivity(models.Workactivity(**json_body()))
+    write(api.insert_workactivity, models.Workactivity(**json_body()))
     return jsonify(result='created'), 201
 
 
@@ -499,7 +745,7 @@ def updateWorkactivity(admin, id):
     workactivity.id = id
     messages = []
     try:
-        api.update_workactivity(workactivity)
+        write(api.update_workactivity, workactivity)
     except:
         message = {
             'message': 'Error while updating workactivity!',
@@ -528,10 +774,10 @@ def updateWorkactivity(admin, id):
 def listActivities(token):
     activities = list(map(validation.to_dict, api.list_activities()))
     if token:
-        consumers = api.list_consumers()
-
+        matrix = api.get_activityfeedback_matrix(
+            [activity['id'] for activity in activities])
         for activity in activities:
-            activity['feedback'] = api.get_activityfeedback(activity_id=activity['id'])
+            activity['feedback'] = matrix[activity['id']]
 
     return jsonify(activities)
 
@@ -542,7 +788,7 @@ def listActivities(token):
 def insertActivity(admin):
     activity = models.Activity(**json_body())
     activity.created_by = admin.id
-    api.insert_activity(activity)
+    write(api.insert_activity, activity)
     return jsonify(result='created'), 201
 
 
@@ -558,7 +804,7 @@ def getActivity(id):
 def updateActivity(admin, id):
     activity = models.Activity(**json_body())
     activity.id = id
-    api.update_activity(p)
+    write(api.update_activity, p)
     return jsonify(result='updated'), 200
 
 
@@ -576,7 +822,8 @@ def getActivityfeedback(admin, id):
 # Insert activityfeedback
 @app.route('/activityfeedback', methods=['POST'])
 def insertActivityfeedback():
-    api.insert_activityfeedback(models.Activityfeedback(**json_body()))
+    write(api.insert_activityfeedback,
+          models.Activityfeedback(**json_body()))
     return jsonify(result='created'), 201
 
 
@@ -598,7 +845,7 @@ def list_departmentpurchasecollections(admin):
 def update_departmentpurchasecollections(admin, id):
     dpcollection = models.DepartmentpurchaseCollection(**json_body())
     dpcollection.id = id
-    api.update_departmentpurchasecollection(dpcollection, admin)
+    write(api.update_departmentpurchasecollection, dpcollection, admin)
     return jsonify(result='updated'), 200
 
 
@@ -629,15 +876,14 @@ def insert_departmentpurchase(admin):
         c = models.DepartmentpurchaseCollection(admin_id=a_ID,
                                                 department_id=d_ID,
                                                 comment=comment)
-        api.insert_departmentpurchasecollection(c)
-        last_collection = api.get_last_departmentpurchasecollection()
+        dpurchases = []
         for obj in data['dpurchases']:
-            dp = models.Departmentpurchase(collection_id=last_collection.id,
-                                           product_id=obj['product_id'],
+            dp = models.Departmentpurchase(product_id=obj['product_id'],
                                            amount=obj['amount'],
                                            total_price=obj['total_price'])
+            dpurchases.append(dp)
 
-            api.insert_departmentpurchase(dp)
+        write(api.insert_departmentpurchases, c, dpurchases)
 
         return jsonify(result='created'), 201
 
@@ -4,17 +4,52 @@ import argparse
 import sys
 from project.webapi import *
 import project.configuration as config
+from project.server import AsyncServer, PreforkServer
 
-parser = argparse.ArgumentParser(description='Webapi for shop.db')
-parser.add_argument('--mode', default='productive',
-                    choices=['productive', 'debug'])
-args = parser.parse_args()
 
-if args.mode == 'productive':
-    set_app(config.BaseConfig)
-elif args.mode == 'debug':
-    set_app(config.DevelopmentConfig)
-else:
-    sys.exit('{}: invalid operating mode'.format(args.mode))
+def main():
+    parser = argparse.ArgumentParser(description='Webapi for shop.db')
+    parser.add_argument('--mode', default='productive',
+                        choices=['productive', 'debug'])
+    parser.add_argument('--server', default='threaded',
+                        choices=['threaded', 'async', 'prefork'])
+    args = parser.parse_args()
 
-app.run(host=app.config['HOST'], port=app.config['PORT'])
+    if args.mode == 'productive':
+        configuration = config.BaseConfig
+    elif args.mode == 'debug':
+        configuration = config.DevelopmentConfig
+    else:
+        sys.exit('{}: invalid operating mode'.format(args.mode))
+
+    if args.server == 'prefork':
+        # Each worker process sets up the app with its own database
+        # connections
+        server = PreforkServer(lambda: set_app(configuration)[0],
+                               configuration.HOST, configuration.PORT,
+                               configuration.PREFORK_PROCESSES,
+                               configuration.PREFORK_MAX_REQUESTS,
+                               configuration.ASYNC_WORKERS,
+                               configuration.ASYNC_TIMEOUT,
+                               teardown=close_app,
+                               graceful_timeout=(
+                                   configuration.PREFORK_GRACEFUL_TIMEOUT),
+                               max_content_length=(
+                                   configuration.MAX_CONTENT_LENGTH))
+        server.serve_forever()
+    elif args.server == 'async':
+        set_app(configuration)
+        server = AsyncServer(app, app.config['HOST'], app.config['PORT'],
+                             app.config['ASYNC_WORKERS'],
+                             app.config['ASYNC_TIMEOUT'],
+                             max_content_length=(
+                                 app.config['MAX_CONTENT_LENGTH']))
+        server.serve_forever()
+    else:
+        set_app(configuration)
+        app.run(host=app.config['HOST'], port=app.config['PORT'])
+
+
+# The processes of the password hasher import this module, too
+if __name__ == '__main__':
+    main()
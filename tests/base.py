@@ -1,9 +1,13 @@
 #!/usr/bin/env python3
 
+import os
+import tempfile
 from project.webapi import *
+from flask.testing import FlaskClient
 from flask_testing import TestCase
 import project.configuration as config
 import project.backend.models as models
+import project.webapi as webapi
 
 passwords = None
 
@@ -13,20 +17,32 @@ def generate_passwords(pwds):
     if passwords is None:
         passwords = [None] * len(pwds)
         for i in range(0, len(pwds)):
-            passwords[i] = bcrypt.generate_password_hash(pwds[i])
+            passwords[i] = webapi.hasher.generate(pwds[i])
     return passwords
 
 
+class BufferedClient(FlaskClient):
+    """Reads and closes streamed responses at once, like a server, so that
+    their requests are torn down before the next one."""
+
+    def open(self, *args, **kwargs):
+        kwargs.setdefault('buffered', True)
+        return super().open(*args, **kwargs)
+
+
 class BaseTestCase(TestCase):
+    configuration = config.UnittestConfig
+
     def create_app(self):
+        app.test_client_class = BufferedClient
         return app
 
     def setUp(self):
-        app, api = set_app(config.UnittestConfig)
+        app, api = set_app(self.configuration)
         self.client = self.app.test_client()
         api.create_tables()
         self.api = api
-        self.bcrypt = bcrypt
+        self.hasher = webapi.hasher
 
         # Create default consumers
         names = ['William Jones', 'Mary Smith', 'Bryce Jones', 'Daniel Lee']
@@ -71,6 +87,16 @@ class BaseTestCase(TestCase):
         department = self.api.get_department(id=1)
         self.api.setAdmin(consumer, department, True)
 
+    def count_queries(self, function, *args, **kwargs):
+        """Count the SQL statements executed by a function call."""
+        statements = []
+        self.api.con.set_trace_callback(statements.append)
+        try:
+            function(*args, **kwargs)
+        finally:
+            self.api.con.set_trace_callback(None)
+        return len(statements)
+
     def test_default_elements(self):
         # Check if all consumers have been entered correctly
         names = ['William Jones', 'Mary Smith', 'Bryce Jones', 'Daniel Lee']
@@ -105,3 +131,25 @@ class BaseTestCase(TestCase):
 
     def tearDown(self):
         self.assertFalse(self.api.con.in_transaction)
+
+
+class FileDatabaseTestCase(BaseTestCase):
+    """Runs the tests on a database file instead of ':memory:', so that
+    several connections can share the database."""
+    options = {}
+
+    def setUp(self):
+        fd, self.database = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        os.remove(self.database)
+        options = dict(self.options, DATABASE_URI=self.database)
+        self.configuration = type('FileDatabaseConfig',
+                                  (config.UnittestConfig, ), options)
+        super().setUp()
+
+    def tearDown(self):
+        super().tearDown()
+        set_app(config.UnittestConfig)
+        for suffix in ['', '-wal', '-shm']:
+            if os.path.exists(self.database + suffix):
+                os.remove(self.database + suffix)
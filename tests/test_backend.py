@@ -1,9 +1,11 @@
 #!/usr/bin/env python3
 
 import time
+from unittest import mock
 from base import BaseTestCase
 from project.backend.db_api import *
 from project.backend.validation import *
+import project.backend.pool as pool
 import project.backend.models as models
 
 
@@ -245,6 +247,111 @@ class BackendTestCase(BaseTestCase):
         dpcollections = self.api.list_departmentpurchasecollections()
         self.assertEqual(len(dpcollections), 1)
 
+    def test_insert_departmentpurchases(self):
+        stocks = [self.api.get_product(id=i).stock for i in [1, 2]]
+        dpcollection = models.DepartmentpurchaseCollection(
+            admin_id=1, department_id=2, comment='bulk collection')
+        dpurchases = [
+            models.Departmentpurchase(product_id=1, amount=5, total_price=50),
+            models.Departmentpurchase(product_id=2, amount=2, total_price=80),
+            models.Departmentpurchase(product_id=1, amount=3, total_price=30)
+        ]
+        statements = []
+        self.api.con.set_trace_callback(statements.append)
+        try:
+            collection_id = self.api.insert_departmentpurchases(dpcollection,
+                                                                dpurchases)
+        finally:
+            self.api.con.set_trace_callback(None)
+
+        # the collection and its purchases are committed at once
+        self.assertEqual(statements.count('COMMIT'), 1)
+        dpcollection = self.api.get_departmentpurchasecollection(
+            id=collection_id)
+        self.assertEqual(dpcollection.sum_price, 160)
+        self.assertEqual(dpcollection.comment, 'bulk collection')
+        dpurchases = self.api.list_departmentpurchases(
+            collection_id=collection_id)
+        self.assertEqual([d.amount for d in dpurchases], [5, 2, 3])
+        self.assertEqual(self.api.get_department(id=2).expenses, 160)
+        self.assertEqual([self.api.get_product(id=i).stock for i in [1, 2]],
+                         [stocks[0] + 8, stocks[1] + 2])
+        self.assertEqual(
+            self.api.get_last_departmentpurchasecollection().id,
+            collection_id)
+
+        # nothing of an invalid collection is inserted
+        dpcollection = models.DepartmentpurchaseCollection(admin_id=1,
+                                                           department_id=2)
+        dpurchases = [
+            models.Departmentpurchase(product_id=1, amount=1, total_price=1),
+            models.Departmentpurchase(product_id=42, amount=1, total_price=1)
+        ]
+        with self.assertRaises(exc.ForeignKeyNotExisting):
+            self.api.insert_departmentpurchases(dpcollection, dpurchases)
+        with self.assertRaises(exc.MissingData):
+            self.api.insert_departmentpurchases(dpcollection, [])
+        self.assertEqual(
+            len(self.api.list_departmentpurchasecollections()), 1)
+        self.assertEqual(self.api.get_department(id=2).expenses, 160)
+
+    def test_list_revokables_query_count(self):
+        admin = self.api.get_consumer(id=1)
+
+        def insert(count):
+            for i in range(0, count):
+                dep = models.Deposit(consumer_id=2, amount=100,
+                                     comment="testcomment")
+                self.api.insert_deposit(dep)
+                dpc = models.DepartmentpurchaseCollection(admin_id=1,
+                                                          department_id=1)
+                self.api.insert_departmentpurchasecollection(dpc)
+                dpc_id = self.api.get_last_departmentpurchasecollection().id
+                dp = models.Departmentpurchase(collection_id=dpc_id,
+                                               product_id=1, amount=1,
+                                               total_price=10)
+                self.api.insert_departmentpurchase(dp)
+
+            # revoke every second deposit and collection
+            for deposit in self.api.list_deposits()[::2]:
+                if not deposit.revoked:
+                    dep = models.Deposit(id=deposit.id, revoked=True)
+                    self.api.update_deposit(dep, admin)
+            for dpc in self.api.list_departmentpurchasecollections()[::2]:
+                if not dpc.revoked:
+                    dpc = models.DepartmentpurchaseCollection(id=dpc.id,
+                                                              revoked=True)
+                    self.api.update_departmentpurchasecollection(dpc, admin)
+
+        insert(2)
+        deposit_queries = self.count_queries(self.api.list_deposits)
+        dpc_queries = self.count_queries(
+            self.api.list_departmentpurchasecollections)
+
+        insert(20)
+        self.assertEqual(self.count_queries(self.api.list_deposits),
+                         deposit_queries)
+        self.assertEqual(self.count_queries(
+            self.api.list_departmentpurchasecollections), dpc_queries)
+
+        # The revoke states must match the revoke history
+        deposits = self.api.list_deposits()
+        self.assertEqual(len(deposits), 22)
+        for index, deposit in enumerate(deposits):
+            self.assertEqual(deposit.revoked, index % 2 == 0)
+            if deposit.revoked:
+                self.assertEqual(len(deposit.revoke_history), 1)
+                self.assertEqual(deposit.revoke_history[0].deposit_id,
+                                 deposit.id)
+            else:
+                self.assertIsNone(deposit.revoke_history)
+
+        dpcollections = self.api.list_departmentpurchasecollections()
+        self.assertEqual(len(dpcollections), 22)
+        for index, dpc in enumerate(dpcollections):
+            self.assertEqual(dpc.sum_price, 10)
+            self.assertEqual(dpc.revoked, index % 2 == 0)
+
     def test_insert_departments(self):
         d = models.Department(name="Test 1", budget=20000)
         self.api.insert_department(d)
@@ -355,6 +462,30 @@ class BackendTestCase(BaseTestCase):
         adminroles = self.api.getAdminroles(consumer)
         self.assertEqual(len(adminroles), 0)
 
+    def test_list_consumers(self):
+        consumers = self.api.list_consumers()
+        self.assertEqual(len(consumers), 4)
+        self.assertEqual([c.isAdmin for c in consumers],
+                         [True, False, False, False])
+        self.assertEqual([c.hasCredentials for c in consumers],
+                         [True, True, False, False])
+
+        # The password hashes are only loaded on request
+        for consumer in consumers:
+            self.assertIsNone(consumer.password)
+        consumers = self.api.list_consumers(with_password=True)
+        self.assertIsNotNone(consumers[0].password)
+        self.assertIsNone(consumers[3].password)
+
+        # The consumers are listed with one query
+        self.assertEqual(self.count_queries(self.api.list_consumers), 1)
+
+        # Check the adminroles of all consumers
+        adminroles = self.api.list_adminroles()
+        self.assertEqual(len(adminroles[1]), 1)
+        self.assertEqual(adminroles[1][0].department_id, 1)
+        self.assertNotIn(2, adminroles)
+
     def test_get_product_by_id(self):
         product = self.api.get_product(id=1)
         self.assertEqual(product.name, 'Coffee')
@@ -559,6 +690,172 @@ class BackendTestCase(BaseTestCase):
         with self.assertRaises(exc.ForbiddenField):
             self.api.insert_deposit(dep)
 
+    def test_verify_consumer_credit(self):
+        # Consumer 1 is administrator
+        admin = self.api.get_consumer(id=1)
+
+        # Buy, deposit and revoke to touch every credit changing operation
+        dep = models.Deposit(consumer_id=2, amount=500, comment="testcomment")
+        self.api.insert_deposit(dep)
+        for amount in [1, 2, 3]:
+            pur = models.Purchase(consumer_id=2, product_id=1, amount=amount,
+                                  comment="purchase done by unittest")
+            self.api.insert_purchase(pur)
+
+        self.api.update_purchase(models.Purchase(id=2, revoked=True))
+        self.api.update_deposit(models.Deposit(id=1, revoked=True), admin)
+
+        consumer = self.api.get_consumer(id=2)
+        self.assertEqual(consumer.credit, -100)
+        for consumer in self.api.list_consumers():
+            self.assertTrue(self.api.verify_consumer_credit(consumer.id))
+
+        # Manipulate the stored credit, the verification has to fail
+        self.api.con.execute('UPDATE consumers SET credit=42 WHERE id=2;')
+        self.api.con.commit()
+        self.assertFalse(self.api.verify_consumer_credit(2))
+        self.assertEqual(self.api.get_consumer(id=2).credit, 42)
+
+    def test_get_versions(self):
+        tables = ('products', 'consumers', 'adminroles')
+        versions = self.api.get_versions(tables)
+
+        # the versions are increased by every change of their table
+        self.api.update_product(models.Product(id=1, price=30))
+        pur = models.Purchase(consumer_id=2, product_id=1, amount=1,
+                              comment="purchase")
+        self.api.insert_purchase(pur)
+        changed = self.api.get_versions(tables)
+        self.assertGreater(changed[0], versions[0])
+        self.assertGreater(changed[1], versions[1])
+        self.assertEqual(changed[2], versions[2])
+
+        # reading does not change them
+        self.api.list_products()
+        self.assertEqual(self.api.get_versions(tables), changed)
+
+    def test_upgrade_tables(self):
+        # A database of the first schema lacks the reviewed column of the
+        # activities, the versions and the indexes
+        with open(self.app.config['DATABASE_SCHEMA']) as schema_file:
+            schema = schema_file.read()
+        schema = (schema.replace('\treviewed BOOLEAN NOT NULL,\n', '')
+                  .replace(',\n\tCHECK (reviewed IN (0, 1))', ''))
+        api = DatabaseApi(pool.ConnectionPool(':memory:', 1), self.app.config)
+        api.con.executescript(schema)
+        api.insert_department(models.Department(name='Drinks', budget=20000))
+        api.insert_product(models.Product(name='Coffee', countable=True,
+                                          price=25, revocable=True,
+                                          department_id=1))
+
+        # The upgrade can be repeated
+        api.upgrade_tables()
+        api.upgrade_tables()
+        columns = [row[1] for row in
+                   api.con.execute('PRAGMA table_info(activities);')]
+        self.assertIn('reviewed', columns)
+        indexes = [row[0] for row in api.con.execute(
+            "SELECT name FROM sqlite_master WHERE type='index';")]
+        self.assertIn('purchases_consumer_id', indexes)
+        self.assertIn('activityfeedbacks_activity_id', indexes)
+
+        versions = api.get_versions(('products', 'consumers'))
+        self.assertEqual(versions, (0, 0))
+        api.update_product(models.Product(id=1, price=30))
+        self.assertGreater(api.get_versions(('products', ))[0], 0)
+        api.pool.close()
+
+    def test_get_principal(self):
+        principal = self.api.get_principal(1)
+        self.assertEqual(principal, {'id': 1, 'adminroles': [1]})
+        self.assertEqual(self.api.get_principal(2),
+                         {'id': 2, 'adminroles': []})
+
+        # The principal is cached and can not be changed from outside. Only
+        # the version of the adminroles is read again.
+        principal['adminroles'].append(3)
+        self.assertEqual(self.count_queries(self.api.get_principal, 1), 1)
+        self.assertEqual(self.api.get_principal(1)['adminroles'], [1])
+
+        # Changes of the adminroles invalidate the principal
+        consumer = self.api.get_consumer(id=1)
+        department = self.api.get_department(id=2)
+        self.api.setAdmin(consumer, department, True)
+        self.assertEqual(self.api.get_principal(1)['adminroles'], [1, 2])
+        self.api.setAdmin(consumer, department, False)
+        self.assertEqual(self.api.get_principal(1)['adminroles'], [1])
+
+        # And so do changes, which are not made through this api, like those
+        # of another worker process
+        self.api.con.execute('DELETE FROM adminroles WHERE consumer_id=1;')
+        self.api.con.commit()
+        self.assertEqual(self.api.get_principal(1)['adminroles'], [])
+
+        # Changes of other tables keep the principals
+        self.api.get_principal(2)
+        self.api.update_consumer(models.Consumer(id=1, karma=5))
+        self.assertEqual(self.count_queries(self.api.get_principal, 2), 1)
+
+    def test_calculate_product_price(self):
+        def expected(base_price, karma):
+            percent = 0
+            for scale in sorted(self.api.list_pricecategories(),
+                                key=lambda s: s.price_lower_bound):
+                if base_price >= scale.price_lower_bound:
+                    percent = scale.additional_percent
+            return floor(base_price * (1 + percent * (-karma + 10) / 2000))
+
+        def check_prices():
+            version = self.api.get_versions(('pricecategories', ))[0]
+            for base_price in range(0, 300):
+                for karma in range(-10, 11):
+                    self.assertEqual(
+                        self.api._calculate_product_price(base_price, karma,
+                                                          version),
+                        expected(base_price, karma))
+            return version
+
+        version = check_prices()
+
+        # The table holds the prices of all products and is only built once
+        self.assertEqual(self.count_queries(
+            self.api._calculate_product_price, 400, 0, version), 0)
+        self.api._price_table = None
+        self.api._calculate_product_price(25, 0, version)
+        for price in [25, 100, 400]:
+            self.assertIn(price, self.api._price_table[3])
+
+        # A change of the price categories, also by another process, has to
+        # invalidate the cached prices
+        self.api.con.execute('INSERT INTO pricecategories '
+                             '(price_lower_bound, additional_percent) '
+                             'VALUES (150, 90);')
+        self.api.con.commit()
+        version = check_prices()
+        self.assertEqual(
+            self.api._calculate_product_price(150, -10, version), 285)
+
+        self.api.con.execute('UPDATE pricecategories SET '
+                             'additional_percent=10 WHERE '
+                             'price_lower_bound=150;')
+        self.api.con.commit()
+        version = check_prices()
+        self.assertEqual(
+            self.api._calculate_product_price(150, -10, version), 165)
+
+        # The checkout reads the version with its products, so that the
+        # karma prices need no query of their own
+        def purchase():
+            self.api.insert_purchase(models.Purchase(
+                consumer_id=1, product_id=2, amount=1,
+                comment='priced purchase'))
+
+        self.api.configuration['USE_KARMA'] = True
+        purchase()
+        karma_queries = self.count_queries(purchase)
+        self.api.configuration['USE_KARMA'] = False
+        self.assertEqual(self.count_queries(purchase), karma_queries)
+
     def test_insert_purchase(self):
         department = self.api.get_department(id=1)
         self.assertEqual(department.id, 1)
@@ -716,6 +1013,53 @@ class BackendTestCase(BaseTestCase):
         with self.assertRaises(exc.ForbiddenField):
             self.api.insert_purchase(pur9)
 
+    def test_insert_purchases(self):
+        stocks = [self.api.get_product(id=i).stock for i in [1, 2]]
+        cart = [models.Purchase(consumer_id=2, product_id=1, amount=2,
+                                comment="cart purchase"),
+                models.Purchase(consumer_id=2, product_id=2, amount=1,
+                                comment="cart purchase"),
+                models.Purchase(consumer_id=2, product_id=1, amount=1,
+                                comment="cart purchase")]
+        statements = []
+        self.api.con.set_trace_callback(statements.append)
+        try:
+            self.api.insert_purchases(cart)
+        finally:
+            self.api.con.set_trace_callback(None)
+
+        # the whole cart is committed at once
+        self.assertEqual(statements.count('COMMIT'), 1)
+        purchases = self.api.list_purchases()
+        self.assertEqual([p.amount for p in purchases], [2, 1, 1])
+        self.assertEqual(len(set(p.timestamp for p in purchases)), 1)
+        self.assertEqual(self.api.get_consumer(id=2).credit, -175)
+        self.assertEqual(self.api.get_department(id=1).income_base, 75)
+        self.assertEqual(self.api.get_department(id=2).income_base, 100)
+        self.assertEqual([self.api.get_product(id=i).stock for i in [1, 2]],
+                         [stocks[0] - 3, stocks[1] - 1])
+        self.assertTrue(self.api.verify_consumer_credit(2))
+
+        # a single invalid purchase fails the whole cart
+        cart = [models.Purchase(consumer_id=3, product_id=1, amount=1,
+                                comment="cart purchase"),
+                models.Purchase(consumer_id=3, product_id=42, amount=1,
+                                comment="cart purchase")]
+        with self.assertRaises(exc.ForeignKeyNotExisting):
+            self.api.insert_purchases(cart)
+        with self.assertRaises(exc.MissingData):
+            self.api.insert_purchases([])
+
+        # a cart belongs to a single consumer
+        cart = [models.Purchase(consumer_id=3, product_id=1, amount=1,
+                                comment="cart purchase"),
+                models.Purchase(consumer_id=4, product_id=1, amount=1,
+                                comment="cart purchase")]
+        with self.assertRaises(exc.ForbiddenField):
+            self.api.insert_purchases(cart)
+        self.assertEqual(len(self.api.list_purchases()), 3)
+        self.assertEqual(self.api.get_consumer(id=3).credit, 0)
+
     def test_inventory_system(self):
         p = models.Product(id=1, stock=10)
         self.api.update_product(p)
@@ -790,6 +1134,139 @@ class BackendTestCase(BaseTestCase):
         self.assertEqual(purchases[0].amount, 4)
         self.assertEqual(purchases[1].amount, 3)
 
+    def test_get_purchases_of_consumer(self):
+        for i in range(1, 6):
+            comment = "purchase #{}".format(i)
+            for consumer_id in [1, 2]:
+                pur = models.Purchase(consumer_id=consumer_id, product_id=1,
+                                      amount=i, comment=comment)
+                self.api.insert_purchase(pur)
+
+        # get all purchases of consumer 2 in ascending order
+        purchases = self.api.get_purchases_of_consumer(id=2)
+        self.assertEqual(len(purchases), 5)
+        self.assertEqual([p.amount for p in purchases], [1, 2, 3, 4, 5])
+        for purchase in purchases:
+            self.assertEqual(purchase.consumer_id, 2)
+
+        # get the last purchases of consumer 2
+        purchases = self.api.get_purchases_of_consumer(id=2, limit=2)
+        self.assertEqual([p.amount for p in purchases], [5, 4])
+        purchases = self.api.get_purchases_of_consumer(id=2, limit=2,
+                                                       offset=2)
+        self.assertEqual([p.amount for p in purchases], [3, 2])
+        # without limit, the offset skips the oldest purchases
+        purchases = self.api.get_purchases_of_consumer(id=2, offset=2)
+        self.assertEqual([p.amount for p in purchases], [3, 4, 5])
+
+        # consumers without purchases
+        self.assertEqual(self.api.get_purchases_of_consumer(id=3), [])
+
+        # the queries have to use the consumer index
+        for table, index in [('purchases', 'purchases_consumer_id'),
+                             ('deposits', 'deposits_consumer_id')]:
+            plan = self.api.con.execute(
+                'EXPLAIN QUERY PLAN SELECT * FROM {} WHERE consumer_id=? '
+                'ORDER BY id DESC LIMIT ?;'.format(table), (2, 5)).fetchall()
+            self.assertIn(index, ' '.join(str(row[-1]) for row in plan))
+
+    def test_get_deposits_of_consumer(self):
+        admin = self.api.get_consumer(id=1)
+        for i in range(1, 4):
+            dep = models.Deposit(consumer_id=2, amount=i * 100,
+                                 comment="testcomment")
+            self.api.insert_deposit(dep)
+
+        self.api.update_deposit(models.Deposit(id=2, revoked=True), admin)
+        deposits = self.api.get_deposits_of_consumer(id=2)
+        self.assertEqual([d.amount for d in deposits], [100, 200, 300])
+        self.assertEqual([d.revoked for d in deposits], [False, True, False])
+        self.assertIsNone(deposits[0].revoke_history)
+        self.assertEqual(len(deposits[1].revoke_history), 1)
+
+        deposits = self.api.get_deposits_of_consumer(id=2, limit=1)
+        self.assertEqual([d.amount for d in deposits], [300])
+        self.assertEqual(self.api.get_deposits_of_consumer(id=1), [])
+
+        # the revokes are selected by their deposit ids in several chunks
+        with mock.patch('project.backend.db_api.MAX_VARIABLES', 2):
+            deposits = self.api.get_deposits_of_consumer(id=2)
+        self.assertEqual([d.revoked for d in deposits], [False, True, False])
+        revokes = self.api._get_revokes(model=models.DepositRevoke,
+                                        parent_field='deposit_id',
+                                        ids=[1, 3])
+        self.assertEqual(dict(revokes), {})
+
+    def test_page_before_id(self):
+        for i in range(1, 8):
+            pur = models.Purchase(consumer_id=i % 2 + 1, product_id=1,
+                                  amount=i, comment="purchase #{}".format(i))
+            self.api.insert_purchase(pur)
+            dep = models.Deposit(consumer_id=i % 2 + 1, amount=i * 100,
+                                 comment="deposit #{}".format(i))
+            self.api.insert_deposit(dep)
+            pay = models.Payoff(department_id=1, admin_id=1, amount=i,
+                                comment="payoff #{}".format(i))
+            self.api.insert_payoff(pay)
+
+        # walk through all purchases, three at a time
+        pages = []
+        before_id = None
+        while True:
+            page = self.api.list_purchases(limit=3, before_id=before_id)
+            if not page:
+                break
+            pages.append([p.amount for p in page])
+            before_id = page[-1].id
+        self.assertEqual(pages, [[7, 6, 5], [4, 3, 2], [1]])
+
+        # a cursor without limit returns all older rows
+        deposits = self.api.list_deposits(before_id=4)
+        self.assertEqual([d.amount for d in deposits], [300, 200, 100])
+        payoffs = self.api.list_payoffs(limit=2, before_id=7)
+        self.assertEqual([p.amount for p in payoffs], [6, 5])
+
+        # the purchases and deposits of a single consumer
+        purchases = self.api.get_purchases_of_consumer(id=2, limit=2,
+                                                       before_id=5)
+        self.assertEqual([p.amount for p in purchases], [3, 1])
+        deposits = self.api.get_deposits_of_consumer(id=1, before_id=6)
+        self.assertEqual([d.amount for d in deposits], [400, 200])
+
+        # the pages are found by a range search on the primary key
+        plan = self.api.con.execute(
+            'EXPLAIN QUERY PLAN SELECT * FROM purchases WHERE id<? '
+            'ORDER BY id DESC LIMIT ?;', (5, 3)).fetchall()
+        self.assertIn('INTEGER PRIMARY KEY (rowid<?)',
+                      ' '.join(str(row[-1]) for row in plan))
+
+    def test_iter_lists(self):
+        self.api.configuration['STREAM_CHUNK_SIZE'] = 2
+        admin = self.api.get_consumer(id=1)
+        for i in range(1, 6):
+            pur = models.Purchase(consumer_id=1, product_id=1, amount=i,
+                                  comment="purchase #{}".format(i))
+            self.api.insert_purchase(pur)
+            dep = models.Deposit(consumer_id=2, amount=i * 100,
+                                 comment="deposit #{}".format(i))
+            self.api.insert_deposit(dep)
+        self.api.update_deposit(models.Deposit(id=3, revoked=True), admin)
+
+        # the rows are fetched in chunks
+        chunks = self.api.iter_purchases()
+        self.assertEqual([[p.amount for p in chunk] for chunk in chunks],
+                         [[1, 2], [3, 4], [5]])
+        chunks = self.api.iter_purchases(before_id=4)
+        self.assertEqual([[p.amount for p in chunk] for chunk in chunks],
+                         [[3, 2], [1]])
+
+        # each chunk of deposits gets its revoke history
+        deposits = [d for chunk in self.api.iter_deposits() for d in chunk]
+        self.assertEqual([d.revoked for d in deposits],
+                         [False, False, True, False, False])
+        self.assertEqual(len(deposits[2].revoke_history), 1)
+        self.assertEqual(list(self.api.iter_payoffs()), [])
+
     def test_update_purchase(self):
         # check, if the objects are correct
         consumer = self.api.get_consumer(id=1)
@@ -909,6 +1386,55 @@ class BackendTestCase(BaseTestCase):
         # this should still be the same as before
         check_product('Mars', -10, False, 10, 2)
 
+    def insert_activities(self, count):
+        self.api.insert_workactivity(models.Workactivity(name="Aufräumen"))
+        deadline = datetime.datetime.now() + datetime.timedelta(days=1)
+        event = deadline + datetime.timedelta(days=1)
+        for i in range(0, count):
+            activity = models.Activity(workactivity_id=1,
+                                       date_deadline=deadline,
+                                       date_event=event, created_by=1)
+            self.api.insert_activity(activity)
+
+    def test_activityfeedback_matrix(self):
+        self.insert_activities(3)
+        feedbacks = [(1, 1, True), (1, 2, True), (1, 1, False),
+                     (2, 3, False), (2, 3, True)]
+        for activity_id, consumer_id, feedback in feedbacks:
+            self.api.insert_activityfeedback(models.Activityfeedback(
+                activity_id=activity_id, consumer_id=consumer_id,
+                feedback=feedback))
+
+        # the latest feedback of every consumer counts
+        matrix = self.api.get_activityfeedback_matrix([1, 2, 3])
+        self.assertEqual(matrix, {
+            1: {1: False, 2: True, 3: None, 4: None},
+            2: {1: None, 2: None, 3: True, 4: None},
+            3: {1: None, 2: None, 3: None, 4: None}
+        })
+        self.assertEqual(self.api.get_activityfeedback_matrix([]), {})
+        self.assertEqual(self.api.get_activityfeedback(activity_id=2),
+                         matrix[2])
+
+        # the number of queries does not depend on the activities
+        self.assertEqual(self.count_queries(
+            self.api.get_activityfeedback_matrix, [1]), 2)
+        self.assertEqual(self.count_queries(
+            self.api.get_activityfeedback_matrix, [1, 2, 3]), 2)
+
+        # unless there are more than MAX_VARIABLES of them
+        with mock.patch('project.backend.db_api.MAX_VARIABLES', 2):
+            self.assertEqual(self.api.get_activityfeedback_matrix([1, 2, 3]),
+                             matrix)
+            self.assertEqual(self.count_queries(
+                self.api.get_activityfeedback_matrix, [1, 2, 3]), 3)
+        plan = self.api.con.execute(
+            'EXPLAIN QUERY PLAN SELECT activity_id, consumer_id, feedback, '
+            'MAX(id) FROM activityfeedbacks WHERE activity_id IN (?, ?) '
+            'GROUP BY activity_id, consumer_id;', (1, 2)).fetchall()
+        self.assertIn('activityfeedbacks_activity_id',
+                      ' '.join(str(row[-1]) for row in plan))
+
     def test_activities(self):
         # create and test workactivities
         workactivities = self.api.list_workactivities()
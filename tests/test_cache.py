@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+from base import BaseTestCase
+from project.backend.cache import TTLCache
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class CacheTestCase(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.clock = Clock()
+        self.cache = TTLCache(maxsize=3, ttl=10, timer=self.clock)
+
+    def test_expiry(self):
+        self.cache.set('a', 1)
+        self.cache.set('b', 2, ttl=20)
+        self.clock.now = 9
+        self.assertEqual(self.cache.get('a'), 1)
+
+        self.clock.now = 10
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.get('b'), 2)
+        self.assertEqual(len(self.cache), 1)
+
+        self.clock.now = 20
+        self.assertEqual(self.cache.get('b', 'expired'), 'expired')
+
+    def test_least_recently_used(self):
+        for key in ['a', 'b', 'c']:
+            self.cache.set(key, key)
+        self.cache.get('a')
+        self.cache.set('d', 'd')
+
+        # b has been used least recently
+        self.assertIsNone(self.cache.get('b'))
+        for key in ['a', 'c', 'd']:
+            self.assertEqual(self.cache.get(key), key)
+
+    def test_get_or_load(self):
+        loaded = []
+
+        def load(key):
+            loaded.append(key)
+            return key * 2
+
+        self.assertEqual(self.cache.get_or_load(2, load), 4)
+        self.assertEqual(self.cache.get_or_load(2, load), 4)
+        self.assertEqual(loaded, [2])
+
+        self.cache.invalidate(2)
+        self.assertEqual(self.cache.get_or_load(2, load), 4)
+        self.assertEqual(loaded, [2, 2])
+
+        self.cache.clear()
+        self.assertEqual(len(self.cache), 0)
+
+    def test_invalidate_while_loading(self):
+        # A value which has been invalidated while it was loaded is outdated
+        def load(key):
+            self.cache.invalidate(key)
+            return 'outdated'
+
+        self.assertEqual(self.cache.get_or_load('a', load), 'outdated')
+        self.assertIsNone(self.cache.get('a'))
+
+    def test_disabled(self):
+        cache = TTLCache(maxsize=0, ttl=10)
+        cache.set('a', 1)
+        self.assertIsNone(cache.get('a'))
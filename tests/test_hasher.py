@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+
+import flask_bcrypt
+from base import BaseTestCase
+from project.backend.hasher import PasswordHasher, log_rounds
+
+
+class PasswordHasherTestCase(BaseTestCase):
+
+    def test_generate_and_check(self):
+        hasher = PasswordHasher(log_rounds=4)
+        pwhash = hasher.generate('secret')
+        self.assertIsInstance(pwhash, bytes)
+        self.assertEqual(log_rounds(pwhash), 4)
+        self.assertTrue(hasher.check(pwhash, 'secret'))
+        self.assertFalse(hasher.check(pwhash, 'wrong secret'))
+
+    def test_process_pool(self):
+        hasher = PasswordHasher(log_rounds=5, processes=1)
+        self.addCleanup(hasher.close)
+        pwhash = hasher.generate('secret')
+        self.assertEqual(log_rounds(pwhash), 5)
+        self.assertTrue(hasher.check(pwhash, 'secret'))
+        self.assertFalse(hasher.check(pwhash, 'wrong secret'))
+
+    def test_needs_rehash(self):
+        hasher = PasswordHasher(log_rounds=5)
+        # The hashes which have been made with Flask-Bcrypt before
+        legacy = flask_bcrypt.generate_password_hash('secret', 4)
+        self.assertTrue(hasher.check(legacy, 'secret'))
+        self.assertTrue(hasher.needs_rehash(legacy))
+        self.assertTrue(hasher.needs_rehash(legacy.decode()))
+        self.assertFalse(hasher.needs_rehash(hasher.generate('secret')))
@@ -0,0 +1,556 @@
+#!/usr/bin/env python3
+
+import datetime
+import gc
+import http.client
+import jwt
+import os
+import socket
+import threading
+import time
+import tracemalloc
+import unittest
+from unittest import mock
+from flask import jsonify
+from werkzeug.serving import WSGIRequestHandler, make_server
+from base import BaseTestCase, FileDatabaseTestCase
+from project.server import AsyncServer
+from project.backend.db_api import factory
+import project.backend.exceptions as exc
+import project.backend.models as models
+import project.backend.validation as validation
+import project.webapi as webapi
+
+
+# The benchmarks compare timings, which depend on the load of the machine.
+# They only run on request, the other tests check the costs deterministically.
+benchmark = unittest.skipUnless(os.environ.get('SHOPDB_BENCHMARK'),
+                                'set SHOPDB_BENCHMARK=1 to run benchmarks')
+
+
+def failing_check(value):
+    raise AssertionError('The value has been validated')
+
+
+def validating_factory(cls):
+    """The former row factory, which validates every column of every row."""
+    def fun(cursor, row):
+        p = cls()
+        for idx, col in enumerate(cursor.description):
+            setattr(p, col[0], row[idx])
+        return p
+    return fun
+
+
+class DictBackedObject(object):
+    """The former model layout: an instance __dict__ plus a _data dict."""
+
+    def __init__(self, data):
+        self._data = data
+
+
+class InterpretedPurchase(models.Purchase):
+    """Purchase which runs its validator objects one after another, like the
+    former ValidatableObject."""
+    __slots__ = ()
+
+    def __init__(self, **kwargs):
+        for k, v in kwargs.items():
+            setattr(self, k, v)
+
+    def __setattr__(self, field_name, field_value):
+        field_validators = self._validators.get(field_name, None)
+
+        if field_validators is None:
+            raise exc.UnknownField(field_name)
+
+        for v in field_validators:
+            v.validate(field_name, field_value)
+
+        object.__setattr__(self, field_name, field_value)
+
+
+class PerformanceTestCase(BaseTestCase):
+
+    def best_of(self, function, repeat=20):
+        """Return the fastest of several runs of a function in seconds. Like
+        timeit, the garbage collector is disabled while timing."""
+        return self.best_of_each([function], repeat)[0]
+
+    def best_of_each(self, functions, repeat=20):
+        """Return the fastest run of each function. The runs of the functions
+        alternate, so that load on the machine affects all of them alike."""
+        timings = [[] for function in functions]
+        for i in range(0, repeat):
+            for function, timing in zip(functions, timings):
+                gc.disable()
+                try:
+                    start = time.perf_counter()
+                    function(i)
+                    timing.append(time.perf_counter() - start)
+                finally:
+                    gc.enable()
+        return [min(timing) for timing in timings]
+
+    def count_steps(self, function, *args):
+        """Count the instructions which sqlite executes for a function call.
+        Unlike the time it takes, they do not depend on the load of the
+        machine."""
+        steps = []
+        self.api.con.set_progress_handler(lambda: steps.append(1), 1)
+        try:
+            function(*args)
+        finally:
+            self.api.con.set_progress_handler(None, 0)
+        return len(steps)
+
+    def bulk_insert_deposits(self, count):
+        now = datetime.datetime.now()
+        self.api.con.executemany(
+            'INSERT INTO deposits (consumer_id, amount, comment, timestamp) '
+            'VALUES (?,?,?,?);',
+            [(i % 4 + 1, 100, 'bulk deposit', now) for i in range(0, count)])
+        self.api.con.execute('UPDATE consumers SET credit=credit+?;',
+                             (100 * count // 4, ))
+        self.api.con.commit()
+
+    def bulk_insert_purchases(self, count):
+        now = datetime.datetime.now()
+        self.api.con.executemany(
+            'INSERT INTO purchases (consumer_id, product_id, amount, comment, '
+            'revoked, timestamp, paid_base_price_per_product, '
+            'paid_karma_per_product) VALUES (?,?,?,?,?,?,?,?);',
+            [(i % 4 + 1, i % 3 + 1, 1, 'bulk purchase', False, now, 100, 0)
+             for i in range(0, count)])
+        self.api.con.commit()
+
+    def rows_per_second(self, row_factories, model, count):
+        def fetch(row_factory):
+            def fun(i):
+                cur = self.api.con.cursor()
+                cur.row_factory = row_factory(model)
+                cur.execute('SELECT * FROM {};'.format(model._tablename))
+                self.assertEqual(len(cur.fetchall()), count)
+            return fun
+        timings = self.best_of_each(list(map(fetch, row_factories)), repeat=10)
+        return [count / timing for timing in timings]
+
+    def test_row_factory(self):
+        self.bulk_insert_purchases(1000)
+
+        # The rows are not validated and the columns are only mapped once
+        checks = dict.fromkeys(models.Purchase._checks, failing_check)
+        with mock.patch.dict(models.Purchase._checks, checks), \
+                mock.patch.object(validation, 'loader',
+                                  wraps=validation.loader) as loader:
+            purchases = self.api.list_purchases()
+        self.assertEqual(len(purchases), 1000)
+        self.assertEqual(loader.call_count, 1)
+        self.assertEqual(purchases[0].comment, 'bulk purchase')
+
+    @benchmark
+    def test_row_factory_throughput(self):
+        self.bulk_insert_purchases(20000)
+        purchases, old_purchases = self.rows_per_second(
+            [factory, validating_factory], models.Purchase, 20000)
+        self.assertGreater(purchases, old_purchases * 1.3)
+
+        # consumers with email addresses and passwords
+        for i in range(0, 2000):
+            consumer = models.Consumer(name='Consumer {}'.format(i),
+                                       email='consumer{}@test.com'.format(i),
+                                       password=b'secretpassword')
+            self.api.insert_consumer(consumer)
+        consumers, old_consumers = self.rows_per_second(
+            [factory, validating_factory], models.Consumer, 2004)
+        self.assertGreater(consumers, old_consumers * 1.3)
+
+    def pages(self):
+        """Return functions, which read the newest page of purchases, an old
+        page by its before_id and the same page by an offset."""
+        def page(before_id):
+            def fun(i):
+                self.assertEqual(len(self.api.list_purchases(
+                    limit=50, before_id=before_id)), 50)
+            return fun
+
+        def offset_page(i):
+            cur = self.api.con.cursor()
+            cur.row_factory = factory(models.Purchase)
+            cur.execute('SELECT * FROM purchases ORDER BY id DESC '
+                        'LIMIT 50 OFFSET 99900;')
+            self.assertEqual(len(cur.fetchall()), 50)
+
+        return page(None), page(101), offset_page
+
+    def test_deep_page(self):
+        self.bulk_insert_purchases(100000)
+
+        # An old page costs as much as the newest one, unlike an offset
+        first, deep, offset = [self.count_steps(function, 0)
+                               for function in self.pages()]
+        self.assertLess(deep, first * 1.1)
+        self.assertGreater(offset, deep * 100)
+
+    @benchmark
+    def test_deep_page_latency(self):
+        self.bulk_insert_purchases(100000)
+
+        # An old page costs as much as the newest one, unlike an offset
+        first, deep, offset = self.best_of_each(list(self.pages()))
+        self.assertLess(deep, first * 3)
+        self.assertLess(deep * 2, offset)
+
+    def poll(self, headers):
+        def fun(i):
+            return self.client.get('/consumers', headers=headers)
+        return fun
+
+    def test_conditional_get(self):
+        etag = self.client.get('/consumers').headers['ETag']
+        unchanged = self.count_steps(self.poll({'If-None-Match': etag}), 0)
+        for i in range(0, 1000):
+            self.api.insert_consumer(models.Consumer(
+                name='Consumer {}'.format(i)))
+        res = self.client.get('/consumers')
+        etag = res.headers['ETag']
+        self.assertEqual(len(res.json), 1004)
+
+        # Polling an unchanged list only reads the version of the consumers,
+        # however long the list is
+        poll = self.poll({'If-None-Match': etag})
+        self.assertEqual(poll(0).status_code, 304)
+        self.assertEqual(poll(0).data, b'')
+        self.assertEqual(self.count_queries(poll, 0), 1)
+        self.assertEqual(self.count_steps(poll, 0), unchanged)
+        self.assertLess(self.count_steps(poll, 0) * 100,
+                        self.count_steps(self.poll({}), 0))
+
+    @benchmark
+    def test_conditional_get_latency(self):
+        for i in range(0, 1000):
+            self.api.insert_consumer(models.Consumer(
+                name='Consumer {}'.format(i)))
+        etag = self.client.get('/consumers').headers['ETag']
+        poll = self.poll
+
+        # Polling an unchanged list costs a fraction of sending it
+        unchanged, full = self.best_of_each(
+            [poll({'If-None-Match': etag}), poll({})], repeat=10)
+        self.assertLess(unchanged, full / 5)
+
+    def peak_memory(self, function):
+        """Return the peak memory allocated during a function call."""
+        tracemalloc.start()
+        try:
+            function()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        return peak
+
+    def test_list_purchases_memory(self):
+        self.bulk_insert_purchases(20000)
+
+        def list_dict_backed():
+            cur = self.api.con.cursor()
+            cur.row_factory = lambda cursor, row: DictBackedObject(
+                dict(zip([col[0] for col in cursor.description], row)))
+            cur.execute('SELECT * FROM purchases;')
+            return cur.fetchall()
+
+        peak = self.peak_memory(self.api.list_purchases)
+        dict_backed_peak = self.peak_memory(list_dict_backed)
+        self.assertLess(peak, dict_backed_peak * 0.7)
+
+        purchase = self.api.list_purchases(limit=1)[0]
+        self.assertEqual(type(purchase).__dictoffset__, 0)
+        self.assertEqual(purchase.amount, 1)
+
+    def test_stream_purchases_memory(self):
+        def list_purchases():
+            # The former response: all objects, all dicts and the whole body
+            with self.app.test_request_context('/purchases'):
+                return jsonify(list(map(validation.to_dict,
+                                        self.api.list_purchases())))
+
+        def stream_purchases():
+            res = self.client.get('/purchases', buffered=False)
+            for chunk in res.response:
+                pass
+            res.close()
+
+        self.bulk_insert_purchases(2000)
+        small = self.peak_memory(stream_purchases)
+        self.bulk_insert_purchases(6000)
+        large = self.peak_memory(stream_purchases)
+
+        # The memory of a streamed list does not grow with its length
+        self.assertLess(large, small * 1.5)
+        self.assertLess(large, self.peak_memory(list_purchases) / 10)
+
+    def test_compiled_validators(self):
+        body = {'consumer_id': 1, 'product_id': 2, 'amount': 1,
+                'comment': 'Default comment'}
+
+        # A parsed request runs the generated check of each field once
+        checks = {field: mock.Mock(wraps=check)
+                  for field, check in models.Purchase._checks.items()}
+        with mock.patch.dict(models.Purchase._checks, checks):
+            models.Purchase(**body)
+        for field, check in checks.items():
+            self.assertEqual(check.call_count, 1 if field in body else 0)
+
+        # and raises the same exceptions as the validator objects
+        values = [None, 0, 1, -1, 2.5, True, '', 'short', 'x' * 100,
+                  b'bytes', datetime.datetime.now()]
+        for field in models.Purchase._validators:
+            for value in values:
+                try:
+                    InterpretedPurchase(**{field: value})
+                except exc.InputException as e:
+                    with self.assertRaises(type(e)) as cm:
+                        models.Purchase(**{field: value})
+                    self.assertEqual(cm.exception.info, e.info)
+                else:
+                    models.Purchase(**{field: value})
+
+    @benchmark
+    def test_compiled_validators_benchmark(self):
+        body = {'consumer_id': 1, 'product_id': 2, 'amount': 1,
+                'comment': 'Default comment'}
+
+        def parse(cls):
+            def fun(i):
+                for j in range(0, 2000):
+                    cls(**body)
+            return fun
+
+        compiled, interpreted = self.best_of_each(
+            [parse(models.Purchase), parse(InterpretedPurchase)])
+        self.assertLess(compiled, interpreted)
+
+    def deposit_revokes(self):
+        """Return functions, which revoke and unrevoke the i-th deposit."""
+        admin = self.api.get_consumer(id=1)
+
+        def revoke(i):
+            deposit = models.Deposit(id=i + 1, revoked=True)
+            self.api.update_deposit(deposit, admin)
+
+        def unrevoke(i):
+            deposit = models.Deposit(id=i + 1, revoked=False)
+            self.api.update_deposit(deposit, admin)
+
+        return revoke, unrevoke
+
+    def test_revoke_deposit(self):
+        revoke, unrevoke = self.deposit_revokes()
+
+        # The same revokes of a new deposit each
+        self.bulk_insert_deposits(100)
+        small_queries = self.count_queries(revoke, 0)
+        small = self.count_steps(unrevoke, 0) + self.count_steps(revoke, 0)
+
+        self.bulk_insert_deposits(20000)
+        large_queries = self.count_queries(revoke, 100)
+        large = (self.count_steps(unrevoke, 100) +
+                 self.count_steps(revoke, 100))
+
+        # Neither the number of queries nor the work of sqlite may depend on
+        # the number of deposits
+        self.assertEqual(small_queries, large_queries)
+        self.assertLess(large, small * 1.1)
+
+    @benchmark
+    def test_revoke_deposit_latency(self):
+        revoke, unrevoke = self.deposit_revokes()
+
+        self.bulk_insert_deposits(100)
+        small = self.best_of(revoke) + self.best_of(unrevoke)
+
+        self.bulk_insert_deposits(20000)
+        large = self.best_of(revoke) + self.best_of(unrevoke)
+
+        # The latency has to stay flat
+        self.assertLess(large, small * 3)
+
+    def percentile(self, function, percent, repeat=200):
+        """Return a percentile of the latencies of a function in seconds."""
+        timings = []
+        for i in range(0, repeat):
+            start = time.perf_counter()
+            function(i)
+            timings.append(time.perf_counter() - start)
+        timings.sort()
+        return timings[int(len(timings) * percent / 100)]
+
+    def purchase(self, i):
+        self.api.insert_purchase(models.Purchase(
+            consumer_id=i % 4 + 1, product_id=i % 3 + 1, amount=1,
+            comment='purchase'))
+
+    def test_insert_purchase(self):
+        self.api.configuration['USE_KARMA'] = True
+        self.purchase(0)
+        small_queries = self.count_queries(self.purchase, 0)
+        small = self.count_steps(self.purchase, 0)
+
+        self.bulk_insert_deposits(20000)
+        self.bulk_insert_purchases(100000)
+        large_queries = self.count_queries(self.purchase, 0)
+        large = self.count_steps(self.purchase, 0)
+
+        # Neither the number of queries nor the work of sqlite for a
+        # purchase may depend on the size of the tables
+        self.assertEqual(small_queries, large_queries)
+        self.assertLess(large, small * 1.1)
+
+    @benchmark
+    def test_insert_purchase_latency(self):
+        self.api.configuration['USE_KARMA'] = True
+        self.purchase(0)
+        small = min(self.percentile(self.purchase, 99) for i in range(0, 3))
+
+        self.bulk_insert_deposits(20000)
+        self.bulk_insert_purchases(100000)
+        large = min(self.percentile(self.purchase, 99) for i in range(0, 3))
+
+        # The p99 latency of a purchase must not depend on the size of the
+        # tables
+        self.assertLess(large, small * 3)
+
+    def auth(self):
+        """Check the costs of the compact and the former authentication of
+        an admin and return functions, which authenticate it 100 times."""
+        secret = self.app.config['SECRET_KEY']
+        exp = datetime.datetime.now() + datetime.timedelta(minutes=30)
+
+        # The former token held the whole consumer and its adminroles
+        consumer = validation.to_dict(self.api.get_consumer(id=1))
+        del consumer['password']
+        consumer['adminroles'] = list(map(validation.to_dict,
+                                          self.api.getAdminroles(
+                                              self.api.get_consumer(id=1))))
+        for role in consumer['adminroles']:
+            role['timestamp'] = str(role['timestamp'])
+        legacy = jwt.encode({'admin': consumer, 'exp': exp}, secret)
+        compact = jwt.encode({'admin': self.api.get_principal(1),
+                              'exp': exp}, secret)
+        self.assertLess(len(compact), len(legacy) / 2)
+
+        def legacy_auth(i):
+            for j in range(0, 100):
+                data = jwt.decode(legacy, secret, algorithms=['HS256'])
+                admin = self.api.get_consumer(data['admin']['id'])
+                adminroles = self.api.getAdminroles(admin)
+                admin = validation.to_dict(admin)
+                admin['adminroles'] = [a.department_id for a in adminroles]
+
+        def compact_auth(i):
+            for j in range(0, 100):
+                data = webapi.decode_token(compact)
+                self.api.get_principal(data['admin']['id'])
+
+        # The signature of a token is only verified once and an admin costs
+        # a single query by primary key
+        compact_auth(0)
+        with mock.patch.object(jwt, 'decode', wraps=jwt.decode) as decode:
+            self.assertEqual(self.count_queries(compact_auth, 0), 100)
+        self.assertEqual(decode.call_count, 0)
+        self.assertGreaterEqual(self.count_queries(legacy_auth, 0), 300)
+        return compact_auth, legacy_auth
+
+    def test_auth_overhead(self):
+        self.auth()
+
+    @benchmark
+    def test_auth_overhead_benchmark(self):
+        compact_auth, legacy_auth = self.auth()
+        compact_time, legacy_time = self.best_of_each([compact_auth,
+                                                       legacy_auth])
+        self.assertLess(compact_time, legacy_time / 5)
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class ServerPerformanceTestCase(FileDatabaseTestCase):
+    options = {
+        'DATABASE_POOL_TIMEOUT': 30
+    }
+
+    def load(self, port, slow_clients=50, clients=4, requests=50):
+        """Send requests from several keep-alive clients, while other clients
+        hold their connections without finishing a request. Return the
+        requests per second and the most threads alive meanwhile."""
+        sockets = []
+        for i in range(0, slow_clients):
+            sock = socket.create_connection(('127.0.0.1', port))
+            sock.sendall(b'GET /products HTTP/1.1\r\n')
+            sockets.append(sock)
+        time.sleep(0.2)
+        threads = [threading.active_count()]
+        errors = []
+
+        def client():
+            connection = http.client.HTTPConnection('127.0.0.1', port,
+                                                    timeout=30)
+            for i in range(0, requests):
+                connection.request('GET', '/products')
+                res = connection.getresponse()
+                res.read()
+                if res.status != 200:
+                    errors.append(res.status)
+                threads.append(threading.active_count())
+            connection.close()
+
+        start = time.perf_counter()
+        clients = [threading.Thread(target=client) for i in range(clients)]
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        for sock in sockets:
+            sock.close()
+        self.assertEqual(errors, [])
+        return len(clients) * requests / elapsed, max(threads)
+
+    def serve(self, server, port):
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            return self.load(port())
+        finally:
+            server.shutdown()
+            thread.join()
+
+    def serve_async(self):
+        server = AsyncServer(webapi.app, '127.0.0.1', 0, workers=8,
+                             timeout=30)
+        return self.serve(server, lambda: server.wait_ready() or server.port)
+
+    def serve_threaded(self):
+        server = make_server('127.0.0.1', 0, webapi.app, threaded=True,
+                             request_handler=QuietRequestHandler)
+        return self.serve(server, lambda: server.server_port)
+
+    def test_async_server_threads(self):
+        self.api.pool.release()
+        threads = threading.active_count()
+        async_rate, async_threads = self.serve_async()
+        threaded_rate, threaded_threads = self.serve_threaded()
+
+        # The slow clients occupy a thread each of the threaded server only
+        self.assertGreaterEqual(threaded_threads, threads + 50)
+        self.assertLessEqual(async_threads, threads + 4 + 8 + 1)
+
+    @benchmark
+    def test_async_server_load(self):
+        self.api.pool.release()
+        async_rate, async_threads = self.serve_async()
+        threaded_rate, threaded_threads = self.serve_threaded()
+        self.assertGreater(async_rate, threaded_rate / 2)
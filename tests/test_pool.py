@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+
+import os
+import tempfile
+import threading
+from base import BaseTestCase
+from project.backend.pool import ConnectionPool
+import project.backend.exceptions as exc
+
+
+class PoolTestCase(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        fd, self.database = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self.pool = ConnectionPool(self.database, size=2, timeout=0.1)
+        self.pool.connection().executescript(
+            'CREATE TABLE numbers (number INTEGER NOT NULL);')
+        self.pool.release()
+
+    def tearDown(self):
+        self.pool.close()
+        os.remove(self.database)
+        super().tearDown()
+
+    def in_thread(self, function):
+        thread = threading.Thread(target=function)
+        thread.start()
+        thread.join()
+
+    def test_connection_per_thread(self):
+        connection = self.pool.connection()
+        self.assertIs(self.pool.connection(), connection)
+
+        other = []
+        self.in_thread(lambda: other.append(self.pool.connection()))
+        self.assertIsNot(other[0], connection)
+
+        # The connection of the thread has to be released
+        self.assertEqual(self.pool.checked_out(), 2)
+        self.pool.release()
+        self.assertEqual(self.pool.checked_out(), 1)
+
+    def test_release_rolls_back(self):
+        self.pool.connection().execute('INSERT INTO numbers VALUES (1);')
+        self.pool.release()
+
+        res = self.pool.connection().execute('SELECT * FROM numbers;')
+        self.assertEqual(res.fetchall(), [])
+
+    def test_pool_exhausted(self):
+        def hold():
+            self.pool.connection()
+            checked_out.set()
+            done.wait()
+            self.pool.release()
+
+        def checkout():
+            try:
+                self.pool.connection()
+            except exc.DatabaseUnavailable as e:
+                errors.append(e)
+
+        checked_out = threading.Event()
+        done = threading.Event()
+        errors = []
+        thread = threading.Thread(target=hold)
+        thread.start()
+        checked_out.wait()
+        self.pool.connection()
+
+        # Both connections are in use by living threads
+        self.in_thread(checkout)
+        self.assertEqual(len(errors), 1)
+
+        # A released connection can be checked out again
+        done.set()
+        thread.join()
+        self.in_thread(checkout)
+        self.assertEqual(len(errors), 1)
+
+    def test_reclaim_leaked_connection(self):
+        def leak():
+            self.pool.connection()
+
+        def leak_transaction():
+            connection = self.pool.connection()
+            connection.execute('INSERT INTO numbers VALUES (1);')
+
+        self.in_thread(leak)
+        self.in_thread(leak_transaction)
+        self.assertEqual(self.pool.checked_out(), 2)
+
+        # The connections of both finished threads are taken back and the
+        # unfinished transaction is rolled back
+        with self.assertLogs('project.backend.pool', 'WARNING') as cm:
+            connection = self.pool.connection()
+        self.assertEqual(len(cm.output), 3)
+        self.assertEqual(self.pool.checked_out(), 1)
+        res = connection.execute('SELECT * FROM numbers;')
+        self.assertEqual(res.fetchall(), [])
+
+    def test_concurrent_writes(self):
+        # The threads have to wait for each other
+        self.pool.timeout = 30
+
+        def insert():
+            for i in range(0, 50):
+                connection = self.pool.connection()
+                connection.execute('INSERT INTO numbers VALUES (?);', (i, ))
+                connection.commit()
+                self.pool.release()
+
+        threads = [threading.Thread(target=insert) for i in range(0, 4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        res = self.pool.connection().execute('SELECT COUNT(*) FROM numbers;')
+        self.assertEqual(res.fetchone()[0], 200)
+
+    def test_teardown_releases_connection(self):
+        self.assertEqual(self.api.pool.checked_out(), 1)
+        self.api.pool.release()
+
+        # Like in a threaded server, the request is handled by a thread of
+        # its own, which has to return its connection afterwards
+        responses = []
+        self.in_thread(lambda: responses.append(self.client.get('/products')))
+        self.assertEqual(responses[0].status_code, 200)
+        self.assertEqual(len(responses[0].json), 3)
+        self.assertEqual(self.api.pool.checked_out(), 0)
+
+        # The next use checks out a connection again
+        self.assertEqual(len(self.api.list_products()), 3)
+        self.assertEqual(self.api.pool.checked_out(), 1)
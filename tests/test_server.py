@@ -0,0 +1,428 @@
+#!/usr/bin/env python3
+
+import http.client
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from base import FileDatabaseTestCase
+from project.server import AsyncServer
+import project.webapi as webapi
+
+
+class AsyncServerTestCase(FileDatabaseTestCase):
+    options = {
+        'DATABASE_POOL_TIMEOUT': 5
+    }
+    workers = 2
+
+    def setUp(self):
+        super().setUp()
+        # The requests are served by the workers of the server
+        self.api.pool.release()
+        self.server = AsyncServer(webapi.app, '127.0.0.1', 0,
+                                  workers=self.workers, timeout=5)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.server.wait_ready()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.thread.join(10)
+        self.assertFalse(self.thread.is_alive())
+        super().tearDown()
+
+    def connect(self):
+        connection = http.client.HTTPConnection('127.0.0.1', self.server.port,
+                                                timeout=5)
+        self.addCleanup(connection.close)
+        return connection
+
+    def request(self, connection, method, url, data=None, headers={}):
+        body = json.dumps(data) if data is not None else None
+        headers = dict(headers)
+        if body is not None:
+            headers['Content-Type'] = 'application/json'
+        connection.request(method, url, body=body, headers=headers)
+        res = connection.getresponse()
+        return res, res.read()
+
+    def workers_alive(self):
+        return len([thread for thread in threading.enumerate()
+                    if thread.name.startswith('worker')])
+
+    def test_keep_alive(self):
+        connection = self.connect()
+        res, body = self.request(connection, 'GET', '/products')
+        self.assertEqual(res.status, 200)
+        self.assertEqual(len(json.loads(body)), 3)
+        sock = connection.sock
+
+        data = {'consumer_id': 1, 'product_id': 1, 'amount': 2,
+                'comment': 'purchase via the async server'}
+        res, body = self.request(connection, 'POST', '/purchases', data)
+        self.assertEqual(res.status, 201)
+        res, body = self.request(connection, 'GET', '/purchases')
+        self.assertEqual(len(json.loads(body)), 1)
+
+        # All requests have been sent over the same connection
+        self.assertIs(connection.sock, sock)
+
+    def test_streamed_response(self):
+        connection = self.connect()
+        res, body = self.request(connection, 'GET', '/purchases')
+        self.assertEqual(res.status, 200)
+        self.assertEqual(res.getheader('Transfer-Encoding'), 'chunked')
+        self.assertEqual(json.loads(body), [])
+
+        # A HTTP/1.0 client reads the body until the connection is closed
+        sock = socket.create_connection(('127.0.0.1', self.server.port))
+        sock.sendall(b'GET /purchases HTTP/1.0\r\n\r\n')
+        response = b''
+        while True:
+            data = sock.recv(4096)
+            if not data:
+                break
+            response += data
+        sock.close()
+        head, body = response.split(b'\r\n\r\n', 1)
+        self.assertIn(b'Connection: close', head)
+        self.assertEqual(json.loads(body.decode()), [])
+
+    def test_not_modified(self):
+        connection = self.connect()
+        res, body = self.request(connection, 'GET', '/products')
+        etag = res.getheader('ETag')
+        res, body = self.request(connection, 'GET', '/products',
+                                 headers={'If-None-Match': etag})
+        self.assertEqual(res.status, 304)
+        self.assertEqual(body, b'')
+
+        # The connection stays usable after the response without body
+        res, body = self.request(connection, 'GET', '/departments')
+        self.assertEqual(res.status, 200)
+        self.assertEqual(len(json.loads(body)), 3)
+
+    def test_bad_request(self):
+        sock = socket.create_connection(('127.0.0.1', self.server.port))
+        sock.sendall(b'GARBAGE\r\n\r\n')
+        response = sock.recv(4096)
+        sock.close()
+        self.assertTrue(response.startswith(b'HTTP/1.1 400 '))
+
+    def test_request_too_large(self):
+        self.server.max_content_length = 1024
+        connection = self.connect()
+        data = {'consumer_id': 1, 'product_id': 1, 'amount': 1,
+                'comment': 'x' * 1024}
+        res, body = self.request(connection, 'POST', '/purchases', data)
+        self.assertEqual(res.status, 413)
+        self.assertEqual(len(self.api.list_purchases()), 0)
+
+        # The body is not read, the client only sends its head
+        sock = socket.create_connection(('127.0.0.1', self.server.port))
+        sock.sendall(b'POST /purchases HTTP/1.1\r\n'
+                     b'Content-Length: 1073741824\r\n\r\n')
+        response = sock.recv(4096)
+        sock.close()
+        self.assertTrue(response.startswith(b'HTTP/1.1 413 '))
+
+    def test_idle_connections(self):
+        # Clients, which connect but do not send their requests
+        sockets = []
+        for i in range(0, 20):
+            sock = socket.create_connection(('127.0.0.1', self.server.port))
+            sock.sendall(b'GET /products HTTP/1.1\r\n')
+            sockets.append(sock)
+
+        # do not keep the requests of the other clients waiting
+        start = time.perf_counter()
+        res, body = self.request(self.connect(), 'GET', '/products')
+        self.assertEqual(res.status, 200)
+        self.assertLess(time.perf_counter() - start, 1)
+        self.assertLessEqual(self.workers_alive(), self.workers)
+
+        for sock in sockets:
+            sock.close()
+
+
+def large_app(environ, start_response):
+    """Streams 64 MiB on /large, answers /buffered with 64 MiB of known
+    length and everything else with a few bytes."""
+    if environ['PATH_INFO'] == '/large':
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return (b'x' * 1024 * 1024 for i in range(0, 64))
+    if environ['PATH_INFO'] == '/buffered':
+        start_response('200 OK', [('Content-Length', str(64 * 1024 * 1024))])
+        return [b'x' * 64 * 1024 * 1024]
+    start_response('200 OK', [('Content-Length', '5')])
+    return [b'small']
+
+
+class SlowClientTestCase(FileDatabaseTestCase):
+
+    def test_buffered_response(self):
+        server = AsyncServer(large_app, '127.0.0.1', 0, workers=1, timeout=5)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        server.wait_ready()
+
+        # The client does not read its response, which the loop holds
+        sock = socket.create_connection(('127.0.0.1', server.port))
+        sock.sendall(b'GET /buffered HTTP/1.1\r\n\r\n')
+        time.sleep(0.2)
+
+        # The only worker is free for other clients at once
+        start = time.perf_counter()
+        connection = http.client.HTTPConnection('127.0.0.1', server.port,
+                                                timeout=5)
+        self.addCleanup(connection.close)
+        connection.request('GET', '/small')
+        res = connection.getresponse()
+        self.assertEqual(res.read(), b'small')
+        self.assertLess(time.perf_counter() - start, 2)
+
+        # The response is complete, when the client reads it
+        sock.settimeout(5)
+        received = 0
+        while received < 64 * 1024 * 1024:
+            data = sock.recv(1024 * 1024)
+            if not data:
+                break
+            received += len(data)
+        sock.close()
+        self.assertGreater(received, 64 * 1024 * 1024)
+
+        server.shutdown()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+
+    def test_client_does_not_read(self):
+        server = AsyncServer(large_app, '127.0.0.1', 0, workers=1, timeout=1)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        server.wait_ready()
+
+        # The client takes the only worker, but never reads its response
+        sock = socket.create_connection(('127.0.0.1', server.port))
+        self.addCleanup(sock.close)
+        sock.sendall(b'GET /large HTTP/1.1\r\n\r\n')
+        time.sleep(0.2)
+
+        # It is disconnected, so that other clients are served again
+        connection = http.client.HTTPConnection('127.0.0.1', server.port,
+                                                timeout=5)
+        self.addCleanup(connection.close)
+        connection.request('GET', '/small')
+        res = connection.getresponse()
+        self.assertEqual(res.read(), b'small')
+
+        server.shutdown()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+
+
+# Runs the server process outside of the tests, which must not be forked
+PREFORK_SERVER = """
+import sys
+import project.configuration as config
+from project.server import PreforkServer
+from project.webapi import set_app
+
+configuration = type('PreforkConfig', (config.UnittestConfig, ), {
+    'DATABASE_URI': sys.argv[1],
+    'DATABASE_JOURNAL_MODE': 'WAL',
+    'DATABASE_READ_POOL_SIZE': 2,
+    'DATABASE_POOL_TIMEOUT': 5
+})
+server = PreforkServer(lambda: set_app(configuration)[0], '127.0.0.1', 0,
+                       processes=2, max_requests=int(sys.argv[2]) or None,
+                       workers=2, timeout=5, graceful_timeout=2)
+print(server.port, flush=True)
+server.serve_forever()
+"""
+
+
+class PreforkServerTestCase(FileDatabaseTestCase):
+    options = {
+        'DATABASE_JOURNAL_MODE': 'WAL'
+    }
+
+    def start(self, max_requests=0):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        self.process = subprocess.Popen(
+            [sys.executable, '-c', PREFORK_SERVER, self.database,
+             str(max_requests)], cwd=root, stdout=subprocess.PIPE)
+        self.addCleanup(self.stop)
+        self.port = int(self.process.stdout.readline())
+        self.wait_for_workers(2)
+
+    def stop(self):
+        if self.process.poll() is None:
+            self.process.terminate()
+        self.process.wait(10)
+        self.process.stdout.close()
+
+    def workers(self):
+        path = '/proc/{0}/task/{0}/children'.format(self.process.pid)
+        if not os.path.exists(path):
+            self.skipTest('The workers can not be listed')
+        with open(path) as children:
+            return set(map(int, children.read().split()))
+
+    def wait_for_workers(self, count, exclude=()):
+        """Wait until count workers are running, which are not excluded."""
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            workers = self.workers()
+            if len(workers) == count and not workers & set(exclude):
+                return workers
+            time.sleep(0.05)
+        self.fail('The workers have not been started')
+
+    def get(self, url):
+        connection = http.client.HTTPConnection('127.0.0.1', self.port,
+                                                timeout=10)
+        try:
+            connection.request('GET', url)
+            res = connection.getresponse()
+            return res.status, json.loads(res.read())
+        finally:
+            connection.close()
+
+    def post(self, url, data, headers={}):
+        connection = http.client.HTTPConnection('127.0.0.1', self.port,
+                                                timeout=10)
+        headers = dict(headers, **{'Content-Type': 'application/json'})
+        try:
+            connection.request('POST', url, body=json.dumps(data),
+                               headers=headers)
+            res = connection.getresponse()
+            return res.status, json.loads(res.read())
+        finally:
+            connection.close()
+
+    def test_revoked_adminrole(self):
+        self.start()
+        status, data = self.post('/login', {'email': self.consumeremails[0],
+                                            'password':
+                                            self.consumerpasswords[0]})
+        self.assertEqual(status, 200)
+        headers = {'token': data['token']}
+        deposit = {'amount': 100, 'consumer_id': 1,
+                   'comment': 'prefork deposit'}
+
+        # Every worker caches the adminroles of the admin
+        for i in range(0, 6):
+            self.assertEqual(self.post('/deposits', deposit, headers)[0], 201)
+
+        # The adminrole is removed by another process. None of the workers
+        # may accept the admin afterwards.
+        consumer = self.api.get_consumer(id=1)
+        department = self.api.get_department(id=1)
+        self.api.setAdmin(consumer, department, False)
+        for i in range(0, 6):
+            self.assertEqual(self.post('/deposits', deposit, headers)[0], 403)
+
+    def test_concurrent_writes(self):
+        self.start()
+        errors = []
+
+        def buy(consumer_id):
+            connection = http.client.HTTPConnection('127.0.0.1', self.port,
+                                                    timeout=10)
+            data = json.dumps({'consumer_id': consumer_id, 'product_id': 1,
+                               'amount': 1, 'comment': 'prefork purchase'})
+            for i in range(0, 25):
+                connection.request('POST', '/purchases', body=data,
+                                   headers={'Content-Type':
+                                            'application/json'})
+                res = connection.getresponse()
+                res.read()
+                if res.status != 201:
+                    errors.append(res.status)
+            connection.close()
+
+        threads = [threading.Thread(target=buy, args=(i, ))
+                   for i in range(1, 5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # The workers have written the same database file
+        self.assertEqual(errors, [])
+        self.assertEqual(len(self.api.list_purchases()), 100)
+        for consumer in self.api.list_consumers():
+            self.assertEqual(consumer.credit, -25 * 25)
+        self.assertEqual(self.get('/purchases')[1][0]['comment'],
+                         'prefork purchase')
+
+    def test_graceful_restart(self):
+        self.start()
+        workers = self.workers()
+        errors = []
+        restarted = threading.Event()
+
+        def poll():
+            while not restarted.is_set():
+                try:
+                    status, products = self.get('/products')
+                except OSError as e:
+                    errors.append(e)
+                else:
+                    if status != 200:
+                        errors.append(status)
+
+        thread = threading.Thread(target=poll)
+        thread.start()
+        os.kill(self.process.pid, signal.SIGHUP)
+        self.wait_for_workers(2, exclude=workers)
+        restarted.set()
+        thread.join()
+
+        # No request has been refused or dropped during the restart
+        self.assertEqual(errors, [])
+        self.assertEqual(self.get('/products')[0], 200)
+
+    def test_worker_recycling(self):
+        self.start(max_requests=5)
+        workers = self.workers()
+        connection = http.client.HTTPConnection('127.0.0.1', self.port,
+                                                timeout=10)
+        self.addCleanup(connection.close)
+        for i in range(0, 20):
+            connection.request('GET', '/products')
+            res = connection.getresponse()
+            self.assertEqual(res.status, 200)
+            res.read()
+
+        # The last response of a worker closes its connection
+        self.assertNotEqual(self.wait_for_workers(2) & workers, workers)
+
+    def test_stop(self):
+        self.start()
+        workers = self.workers()
+        self.process.terminate()
+        self.assertEqual(self.process.wait(10), 0)
+        for pid in workers:
+            with self.assertRaises(ProcessLookupError):
+                os.kill(pid, 0)
+
+    def test_stop_timeout(self):
+        self.start()
+        # A client whose request would keep its worker for 5 seconds
+        sock = socket.create_connection(('127.0.0.1', self.port))
+        self.addCleanup(sock.close)
+        sock.sendall(b'GET /products HTTP/1.1\r\n')
+        time.sleep(0.2)
+
+        # The worker is killed after the graceful timeout of 2 seconds
+        start = time.monotonic()
+        self.process.terminate()
+        self.assertEqual(self.process.wait(10), 0)
+        self.assertLess(time.monotonic() - start, 4)
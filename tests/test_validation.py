@@ -76,3 +76,40 @@ class ValidationTestCase(BaseTestCase):
         self.test_obj.canbenone = None
         b = '<TestClass(id=None, age=9, amount=2, canbenone=None, name="test")>'
         self.assertEqual(str(self.test_obj), b)
+
+    def test_compiled_validators(self):
+        # The compiled check functions have to raise exactly the same
+        # exceptions as the validator objects themselves
+        values = [None, 'abc', 'banane', 'thisfieldismuchtoolong', -2, 0, 1,
+                  2, 5, 99, 100, 2.5, True, b'bytes']
+        for field, validators in self.test_obj._validators.items():
+            check = compile_validators(field, validators)
+            for value in values:
+                expected = None
+                try:
+                    for v in validators:
+                        v.validate(field, value)
+                except exc.InputException as e:
+                    expected = e
+
+                if expected is None:
+                    check(value)
+                    continue
+
+                with self.assertRaises(type(expected)) as cm:
+                    check(value)
+                self.assertEqual(cm.exception.info, expected.info)
+
+    def test_custom_validator(self):
+        # Validators without source are called by the compiled function
+        class Even(object):
+            def validate(self, field, value):
+                if value % 2:
+                    raise exc.WrongType(field, expected_type='even')
+
+        check = compile_validators('number', [Type(int), Even()])
+        check(4)
+        with self.assertRaises(exc.WrongType):
+            check(3)
+        with self.assertRaises(exc.WrongType):
+            check('4')
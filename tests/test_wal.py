@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+import os
+import sqlite3
+import threading
+from base import FileDatabaseTestCase
+import project.backend.models as models
+import project.webapi as webapi
+
+
+class WalTestCase(FileDatabaseTestCase):
+    options = {
+        'DATABASE_JOURNAL_MODE': 'WAL',
+        'DATABASE_READ_POOL_SIZE': 2,
+        'DATABASE_POOL_TIMEOUT': 5
+    }
+
+    def insert_purchase(self, consumer_id=1):
+        purchase = models.Purchase(consumer_id=consumer_id, product_id=1,
+                                   amount=1, comment='purchase')
+        self.api.insert_purchase(purchase)
+
+    def in_thread(self, function):
+        thread = threading.Thread(target=function)
+        thread.start()
+        return thread
+
+    def test_journal_mode(self):
+        res = self.api.con.execute('PRAGMA journal_mode;').fetchone()
+        self.assertEqual(res[0], 'wal')
+
+    def test_read_only_connection(self):
+        connection = webapi.readers.connection()
+        with self.assertRaises(sqlite3.OperationalError):
+            connection.execute('DELETE FROM purchases;')
+        webapi.readers.release()
+
+    def test_reader_and_writer_run_concurrently(self):
+        self.insert_purchase()
+        list_purchases = self.api.list_purchases
+        read = threading.Event()
+        written = threading.Event()
+        finished = threading.Event()
+        counts = []
+
+        # A long report, which reads the purchases twice
+        def report(limit=None, before_id=None):
+            counts.append(len(list_purchases()))
+            read.set()
+            written.wait(5)
+            purchases = list_purchases()
+            counts.append(len(purchases))
+            finished.set()
+            return [purchases]
+
+        self.api.iter_purchases = report
+        responses = []
+        thread = self.in_thread(
+            lambda: responses.append(self.client.get('/purchases')))
+        read.wait(5)
+
+        # While the report is running, purchases are committed
+        self.insert_purchase(2)
+        self.insert_purchase(3)
+        self.assertFalse(finished.is_set())
+        written.set()
+        thread.join()
+        del self.api.iter_purchases
+
+        # The report has seen the same snapshot of the database all the time
+        self.assertEqual(counts, [1, 1])
+        self.assertEqual(responses[0].status_code, 200)
+        self.assertEqual(len(responses[0].json), 1)
+        self.assertEqual(len(self.client.get('/purchases').json), 3)
+        self.assertEqual(webapi.readers.checked_out(), 0)
+
+    def test_concurrent_requests(self):
+        self.api.pool.release()
+        errors = []
+
+        def read():
+            for i in range(0, 20):
+                res = self.client.get('/purchases')
+                if res.status_code != 200:
+                    errors.append(res.status_code)
+
+        def write(consumer_id):
+            for i in range(0, 20):
+                self.insert_purchase(consumer_id)
+            self.api.pool.release()
+
+        threads = [self.in_thread(read) for i in range(0, 2)]
+        threads += [self.in_thread(lambda: write(1))]
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(self.api.list_purchases()), 20)
+
+    def test_checkpoint(self):
+        for i in range(0, 10):
+            self.insert_purchase()
+
+        log, checkpointed = self.api.checkpoint()
+        self.assertGreater(log, 0)
+        self.assertEqual(log, checkpointed)
+
+        # TRUNCATE empties the write-ahead log
+        self.assertEqual(self.api.checkpoint('TRUNCATE'), (0, 0))
+        self.assertEqual(os.path.getsize(self.database + '-wal'), 0)
+
+        with self.assertRaises(ValueError):
+            self.api.checkpoint('NOW')
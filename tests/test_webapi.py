@@ -5,11 +5,15 @@ import jwt
 import sys
 import pdb
 import copy
+import gzip
 import datetime
+import time
 from base import BaseTestCase
 
 import project.backend.exceptions as exc
 import project.backend.models as models
+import project.backend.validation as validation
+import project.webapi as webapi
 
 
 class WebapiTestCase(BaseTestCase):
@@ -76,8 +80,30 @@ class WebapiTestCase(BaseTestCase):
         self.assertTrue(data['result'])
 
     def test_token_expired(self):
-        # TODO: Expire Token!
-        pass
+        def post_deposit(token):
+            headers = {'content-type': 'application/json', 'token': token}
+            data = {'amount': 100, 'consumer_id': 1, 'comment': 'expiring'}
+            return self.client.post('/deposits', data=json.dumps(data),
+                                    headers=headers)
+
+        secret = self.app.config['SECRET_KEY']
+        admin = {'id': 1, 'adminroles': [1]}
+        token = jwt.encode({'admin': admin, 'exp': int(time.time()) - 1},
+                           secret)
+        self.assertException(post_deposit(token), exc.TokenInvalid)
+
+        # The verified token is cached, but only until it expires
+        exp = int(time.time()) + 1
+        token = jwt.encode({'admin': admin, 'exp': exp}, secret)
+        token = token.decode('UTF-8')
+        self.assertEqual(post_deposit(token).status_code, 201)
+        self.assertIsNotNone(webapi.tokens.get(token))
+        time.sleep(exp + 0.1 - time.time())
+        self.assertIsNone(webapi.tokens.get(token))
+
+        # PyJWT compares the expiry with whole seconds
+        time.sleep(1)
+        self.assertException(post_deposit(token), exc.TokenInvalid)
 
     def test_fake_admin(self):
         # Authentication as actual admin
@@ -150,6 +176,19 @@ class WebapiTestCase(BaseTestCase):
         self.assertEqual(data[1]['comment'], 'Testpurchase 2')
         self.assertEqual(data[1]['amount'], 2)
 
+        # Get the last purchase of consumer 1.
+        res = self.get('/consumer/1/purchases?limit=1', 'extern')
+        self.assertEqual(res.status_code, 200)
+        data = json.loads(res.data)
+        self.assertEqual(len(data), 1)
+        self.assertEqual(data[0]['comment'], 'Testpurchase 2')
+
+        # Get the purchase before.
+        res = self.get('/consumer/1/purchases?limit=1&offset=1', 'extern')
+        data = json.loads(res.data)
+        self.assertEqual(len(data), 1)
+        self.assertEqual(data[0]['comment'], 'Testpurchase 1')
+
     def test_get_consumer_deposits(self):
         # Get deposits of consumer 1. There shouldn't be any.
         res = self.get('/consumer/1/deposits', 'extern')
@@ -233,6 +272,156 @@ class WebapiTestCase(BaseTestCase):
             self.assertEqual(pur[i]['amount'], amounts[9 - i])
             self.assertEqual(pur[i]['comment'], 'Purchase #{}'.format(9 - i))
 
+    def test_paginate_purchases(self):
+        for i in range(0, 5):
+            p = models.Purchase(consumer_id=1, product_id=1, amount=1,
+                                comment='Purchase #{}'.format(i))
+            self.api.insert_purchase(p)
+
+        # A full page links to the next one
+        res = self.get('/purchases?limit=2', 'extern')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([p['id'] for p in res.json], [5, 4])
+        self.assertEqual(res.headers['Link'],
+                         '</purchases?limit=2&before_id=4>; rel="next"')
+
+        res = self.get('/purchases?limit=2&before_id=4', 'extern')
+        self.assertEqual([p['id'] for p in res.json], [3, 2])
+        self.assertIn('before_id=2', res.headers['Link'])
+
+        # The last page has no link
+        res = self.get('/purchases?limit=2&before_id=2', 'extern')
+        self.assertEqual([p['id'] for p in res.json], [1])
+        self.assertNotIn('Link', res.headers)
+
+        # The purchases of a consumer are paginated alike
+        res = self.get('/consumer/1/purchases?limit=3', 'extern')
+        self.assertEqual([p['id'] for p in res.json], [5, 4, 3])
+        self.assertEqual(
+            res.headers['Link'],
+            '</consumer/1/purchases?limit=3&before_id=3>; rel="next"')
+        res = self.get('/consumer/1/purchases?limit=3&before_id=3', 'extern')
+        self.assertEqual([p['id'] for p in res.json], [2, 1])
+        self.assertNotIn('Link', res.headers)
+
+        # The next page of an offset page follows its last row
+        res = self.get('/consumer/1/purchases?limit=2&offset=1', 'extern')
+        self.assertEqual([p['id'] for p in res.json], [4, 3])
+        self.assertEqual(
+            res.headers['Link'],
+            '</consumer/1/purchases?limit=2&before_id=3>; rel="next"')
+        res = self.get('/consumer/1/purchases?limit=2&before_id=3', 'extern')
+        self.assertEqual([p['id'] for p in res.json], [2, 1])
+
+        # Without limit, the offset skips the oldest purchases
+        res = self.get('/consumer/1/purchases?offset=1', 'extern')
+        self.assertEqual([p['id'] for p in res.json], [2, 3, 4, 5])
+        self.assertNotIn('Link', res.headers)
+
+    def test_stream_lists(self):
+        self.app.config['STREAM_CHUNK_SIZE'] = 2
+        for path in ['/purchases', '/deposits', '/payoffs']:
+            res = self.get(path, 'extern')
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(res.json, [])
+
+        for i in range(0, 5):
+            p = models.Purchase(consumer_id=1, product_id=1, amount=1,
+                                comment='Purchase #{}'.format(i))
+            self.api.insert_purchase(p)
+
+        # The streamed list is the same as a list of all purchases
+        res = self.client.get('/purchases', buffered=False)
+        self.assertTrue(res.is_streamed)
+        self.assertEqual(res.mimetype, 'application/json')
+        self.assertEqual(res.json, json.loads(json.dumps(
+            list(map(validation.to_dict, self.api.list_purchases())))))
+        res.close()
+
+        res = self.get('/purchases?before_id=4', 'extern')
+        self.assertEqual([p['id'] for p in res.json], [3, 2, 1])
+
+    def test_conditional_get(self):
+        res = self.client.get('/products')
+        self.assertEqual(res.status_code, 200)
+        etag = res.headers['ETag']
+        self.assertTrue(etag.startswith('W/'))
+
+        # An unchanged list is not sent again and not even listed
+        list_products = self.api.list_products
+        self.api.list_products = None
+        headers = {'If-None-Match': etag}
+        res = self.client.get('/products', headers=headers)
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.data, b'')
+        self.assertEqual(res.headers['ETag'], etag)
+        self.api.list_products = list_products
+
+        # Every change of the products changes the tag
+        self.api.update_product(models.Product(id=1, price=30))
+        res = self.client.get('/products', headers=headers)
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers['ETag'], etag)
+        self.assertEqual(res.json[0]['price'], 30)
+
+        # A purchase changes the credit of the consumer
+        etag = self.client.get('/consumers').headers['ETag']
+        purchase = models.Purchase(consumer_id=1, product_id=1, amount=1,
+                                   comment='purchase')
+        self.api.insert_purchase(purchase)
+        res = self.client.get('/consumers', headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 200)
+
+        # The full list of an admin has a tag of its own
+        etag = res.headers['ETag']
+        res = self.get('/consumers', 'admin')
+        self.assertNotEqual(res.headers['ETag'], etag)
+        self.assertIn('adminroles', res.json[0])
+
+    def test_compression(self):
+        for i in range(0, 50):
+            self.api.insert_consumer(models.Consumer(
+                name='Consumer {}'.format(i)))
+        plain = self.client.get('/consumers')
+        self.assertNotIn('Content-Encoding', plain.headers)
+        self.assertIn('Accept-Encoding', plain.headers['Vary'])
+
+        # The list is sent gzipped to the clients which accept it
+        headers = {'Accept-Encoding': 'gzip, deflate'}
+        res = self.client.get('/consumers', headers=headers)
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(res.data), plain.data)
+        self.assertLess(len(res.data), len(plain.data) / 5)
+
+        # Polls of the same version are not compressed again
+        calls = []
+        compress = gzip.compress
+        gzip.compress = lambda *args, **kwargs: (
+            calls.append(args) or compress(*args, **kwargs))
+        try:
+            cached = self.client.get('/consumers', headers=headers)
+            self.api.insert_consumer(models.Consumer(name='Consumer 50'))
+            changed = self.client.get('/consumers', headers=headers)
+        finally:
+            gzip.compress = compress
+        self.assertEqual(cached.data, res.data)
+        self.assertEqual(len(calls), 1)
+        self.assertIn(b'Consumer 50', gzip.decompress(changed.data))
+
+        # Small responses are not worth it
+        res = self.client.get('/status', headers=headers)
+        self.assertNotIn('Content-Encoding', res.headers)
+
+        # Streamed lists are compressed while they are sent
+        for i in range(0, 20):
+            p = models.Purchase(consumer_id=1, product_id=1, amount=1,
+                                comment='Purchase #{}'.format(i))
+            self.api.insert_purchase(p)
+        plain = self.client.get('/purchases')
+        res = self.client.get('/purchases', headers=headers)
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(res.data), plain.data)
+
     def test_list_deposits(self):
         # Insert test deposits
         consumer_ids = [1, 2, 3, 1, 1, 1, 3, 2, 3, 1]
@@ -335,6 +524,19 @@ class WebapiTestCase(BaseTestCase):
         for consumer in consumers:
             assert 'email' in consumer
             assert 'credit' in consumer
+            assert 'password' not in consumer
+        self.assertEqual(len(consumers[0]['adminroles']), 1)
+        self.assertEqual(consumers[0]['adminroles'][0]['department_id'], 1)
+        self.assertEqual(consumers[1]['adminroles'], [])
+
+        # The number of queries must not depend on the number of consumers
+        queries = self.count_queries(self.client.get, '/consumers',
+                                     headers={'token': token})
+        for name in ['Hans Müller', 'Peter Meier', 'Max Mustermann']:
+            self.api.insert_consumer(models.Consumer(name=name))
+        self.assertEqual(self.count_queries(self.client.get, '/consumers',
+                                            headers={'token': token}),
+                         queries)
 
     def test_consumer_favorite_products(self):
         res = self.get('/consumer/1/favorites', 'extern')
@@ -457,6 +659,41 @@ class WebapiTestCase(BaseTestCase):
         # Check consumers credit
         self.assertEqual(self.api.get_consumer(1).credit, 0)
 
+    def test_insert_cart(self):
+        data = {'consumer_id': 1, 'comment': 'Default comment',
+                'items': [{'product_id': 1, 'amount': 2},
+                          {'product_id': 2, 'amount': 1,
+                           'comment': 'Another comment'}]}
+        res = self.post('/cart', data, 'extern')
+        self.assertEqual(res.status_code, 201)
+        purchases = self.api.list_purchases()
+        self.assertEqual([(p.product_id, p.amount, p.comment)
+                          for p in purchases],
+                         [(1, 2, 'Default comment'),
+                          (2, 1, 'Another comment')])
+        self.assertEqual(self.api.get_consumer(id=1).credit, -150)
+
+        # Nothing of an invalid cart is applied
+        items = [{'product_id': 1, 'amount': 1},
+                 {'product_id': 5, 'amount': 1}]
+        res = self.post('/cart', dict(data, items=items), 'extern')
+        self.assertException(res, exc.ForeignKeyNotExisting)
+        items = [{'product_id': 1, 'amount': 1, 'revoked': True}]
+        res = self.post('/cart', dict(data, items=items), 'extern')
+        self.assertException(res, exc.ForbiddenField)
+        items = [{'product_id': 1, 'amount': 1, 'consumer_id': 3}]
+        res = self.post('/cart', dict(data, items=items), 'extern')
+        self.assertException(res, exc.ForbiddenField)
+        self.assertEqual(self.api.get_consumer(id=3).credit, 0)
+        res = self.post('/cart', dict(data, items=[]), 'extern')
+        self.assertException(res, exc.MissingData)
+        res = self.post('/cart', dict(data, items=[1]), 'extern')
+        self.assertException(res, exc.WrongType)
+        del data['items']
+        res = self.post('/cart', data, 'extern')
+        self.assertException(res, exc.MissingData)
+        self.assertEqual(len(self.api.list_purchases()), 2)
+
     def test_insert_departmentpurchase(self):
         dpcollections = self.api.list_departmentpurchasecollections()
         self.assertEqual(len(dpcollections), 0)
@@ -512,6 +749,14 @@ class WebapiTestCase(BaseTestCase):
         dpcollections = self.api.list_departmentpurchasecollections()
         self.assertEqual(len(dpcollections), 2)
 
+        # A collection with an unknown product is not inserted at all
+        invalid = copy.deepcopy(data)
+        invalid['dpurchases'][-1]['product_id'] = 42
+        res = self.post('/departmentpurchases', invalid, 'admin')
+        self.assertEqual(res.status_code, 401)
+        dpcollections = self.api.list_departmentpurchasecollections()
+        self.assertEqual(len(dpcollections), 2)
+
         self.assertEqual(dpcollections[0].sum_price, len(products) * 100)
         self.assertEqual(dpcollections[0].comment,
                          'Departmentpurchase collection 1')
@@ -581,6 +826,31 @@ class WebapiTestCase(BaseTestCase):
         deposits = self.api.list_deposits()
         self.assertFalse(deposits[0].revoked)
 
+    def test_admin_principal_cache(self):
+        res = self.login(self.consumeremails[0], self.consumerpasswords[0])
+        headers = {'content-type': 'application/json',
+                   'token': json.loads(res.data)['token']}
+        data = {'amount': 100, 'consumer_id': 1, 'comment': 'cached admin'}
+
+        def post_deposit():
+            return self.client.post('/deposits', data=json.dumps(data),
+                                    headers=headers)
+
+        self.assertEqual(post_deposit().status_code, 201)
+
+        # The adminroles of the admin are not loaded again, only their version
+        queries = self.count_queries(post_deposit)
+        self.api.get_principal(1)
+        self.assertEqual(self.count_queries(self.api.get_principal, 1), 1)
+        self.assertEqual(self.count_queries(post_deposit), queries)
+
+        # Removing the adminrole takes effect at once
+        consumer = self.api.get_consumer(id=1)
+        department = self.api.get_department(id=1)
+        self.api.setAdmin(consumer, department, False)
+        self.assertException(post_deposit(), exc.NotAuthorized)
+        self.assertEqual(len(self.api.list_deposits()), 3)
+
     def test_insert_payoff(self):
         # TODO: Check payoffs
         pass
@@ -726,7 +996,7 @@ class WebapiTestCase(BaseTestCase):
         # Test duplicate object
         data = b_data.copy()
         product = self.api.get_product(id=1)
-        for key in product.__dict__['_data'].keys():
+        for key in product._data.keys():
             if key in b_data:
                 data[key] = getattr(product, key)
 
@@ -922,10 +1192,52 @@ class WebapiTestCase(BaseTestCase):
         adminroles = self.api.getAdminroles(consumer)
         self.assertEqual(len(adminroles), 0)
 
+    def test_list_activities(self):
+        self.api.insert_workactivity(models.Workactivity(name='Aufräumen'))
+        deadline = datetime.datetime.now() + datetime.timedelta(days=1)
+        for i in range(0, 2):
+            self.api.insert_activity(models.Activity(
+                workactivity_id=1, date_deadline=deadline,
+                date_event=deadline + datetime.timedelta(days=1),
+                created_by=1))
+        for consumer_id, feedback in [(1, True), (2, True), (1, False)]:
+            self.api.insert_activityfeedback(models.Activityfeedback(
+                activity_id=2, consumer_id=consumer_id, feedback=feedback))
+
+        # Only consumers with a token get the feedback
+        res = self.get('/activities', 'extern')
+        self.assertEqual(len(res.json), 2)
+        self.assertNotIn('feedback', res.json[0])
+
+        res = self.get('/activities', 'consumer')
+        self.assertEqual(res.json[0]['feedback'],
+                         {'1': None, '2': None, '3': None, '4': None})
+        self.assertEqual(res.json[1]['feedback'],
+                         {'1': False, '2': True, '3': None, '4': None})
+
     def test_list_products(self):
         products = json.loads(self.client.get('/products').data)
         self.assertEqual(len(products), 3)
 
+    def test_login_rehash(self):
+        # A hash with another work factor than BCRYPT_LOG_ROUNDS
+        pwhash = self.hasher.generate('secret')
+        self.hasher.log_rounds = 5
+        self.api.update_consumer(models.Consumer(id=1, password=pwhash))
+
+        res = self.login(self.consumeremails[0], 'secret')
+        self.assertEqual(res.status_code, 200)
+        pwhash = self.api.get_consumer_by_email(
+            self.consumeremails[0]).password
+        self.assertFalse(self.hasher.needs_rehash(pwhash))
+        self.assertEqual(pwhash[:7], b'$2b$05$')
+
+        # The new hash is checked on the next login
+        res = self.login(self.consumeremails[0], 'secret')
+        self.assertEqual(res.status_code, 200)
+        res = self.login(self.consumeremails[0], 'wrong secret')
+        self.assertException(res, exc.NotAuthorized)
+
     def test_login(self):
         # Test wrong password
         res = self.login(self.consumeremails[0], 'wrong password')
@@ -951,6 +1263,10 @@ class WebapiTestCase(BaseTestCase):
         assert 'admin' in token
         assert 'consumer' not in token
 
+        # The token only holds the ids of the admin and its departments
+        self.assertEqual(set(token.keys()), {'admin', 'exp'})
+        self.assertEqual(token['admin'], {'id': 1, 'adminroles': [1]})
+
         # Login consumer which is not an administrator
         res = self.login(self.consumeremails[1], self.consumerpasswords[1])
         self.assertEqual(res.status_code, 200)
@@ -960,3 +1276,4 @@ class WebapiTestCase(BaseTestCase):
         token = jwt.decode(data['token'], self.app.config['SECRET_KEY'])
         assert 'admin' not in token
         assert 'consumer' in token
+        self.assertEqual(token['consumer'], {'id': 2})
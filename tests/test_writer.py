@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+
+import sqlite3
+import threading
+from flask import json
+from base import FileDatabaseTestCase
+import project.backend.exceptions as exc
+import project.backend.models as models
+import project.webapi as webapi
+
+
+class WriterTestCase(FileDatabaseTestCase):
+    # The writer needs a connection of its own to the database
+    options = {
+        'DATABASE_POOL_SIZE': 4,
+        'GROUP_COMMIT': True,
+        'GROUP_COMMIT_DELAY': 0.05
+    }
+
+    def setUp(self):
+        super().setUp()
+        self.writer = webapi.writer
+
+    def purchase(self, consumer_id, product_id=1):
+        return models.Purchase(consumer_id=consumer_id, product_id=product_id,
+                               amount=1, comment='purchase')
+
+    def post_purchase(self, consumer_id):
+        data = {'consumer_id': consumer_id, 'product_id': 1, 'amount': 1,
+                'comment': 'purchase'}
+        return self.client.post('/purchases', data=json.dumps(data),
+                                headers={'content-type': 'application/json'})
+
+    def trace(self):
+        """Record the statements of the writer thread."""
+        statements = []
+        self.writer.call(lambda: self.api.con.set_trace_callback(
+            statements.append))
+        statements.clear()
+        return statements
+
+    def test_group_commit(self):
+        statements = self.trace()
+        futures = [self.writer.submit(self.api.insert_purchase,
+                                      self.purchase(i % 4 + 1))
+                   for i in range(0, 20)]
+        for future in futures:
+            self.assertIsNone(future.result())
+
+        # All purchases have been committed at once
+        self.assertEqual(statements.count('COMMIT'), 1)
+        self.assertEqual(len(self.api.list_purchases()), 20)
+        for consumer in self.api.list_consumers():
+            self.assertEqual(consumer.credit, -125)
+            self.assertTrue(self.api.verify_consumer_credit(consumer.id))
+
+    def test_failing_write(self):
+        futures = [
+            self.writer.submit(self.api.insert_purchase, self.purchase(1)),
+            self.writer.submit(self.api.insert_purchase, self.purchase(5)),
+            self.writer.submit(self.api.insert_purchase, self.purchase(2))
+        ]
+
+        # Only the write with the wrong consumer fails
+        self.assertIsNone(futures[0].result())
+        with self.assertRaises(exc.ForeignKeyNotExisting):
+            futures[1].result()
+        self.assertIsNone(futures[2].result())
+
+        purchases = self.api.list_purchases()
+        self.assertEqual([p.consumer_id for p in purchases], [1, 2])
+        self.assertEqual(self.api.get_consumer(id=1).credit, -25)
+
+    def test_failing_commit(self):
+        self.api.con.execute(
+            'CREATE TABLE deferred ('
+            'consumer_id INTEGER REFERENCES consumers(id) '
+            'DEFERRABLE INITIALLY DEFERRED);')
+        self.api.con.commit()
+
+        def insert_deferred():
+            self.api.con.execute('INSERT INTO deferred VALUES (42);')
+
+        # The foreign key is only checked when the batch is committed
+        futures = [
+            self.writer.submit(self.api.insert_purchase, self.purchase(1)),
+            self.writer.submit(insert_deferred)
+        ]
+        for future in futures:
+            with self.assertRaises(sqlite3.IntegrityError):
+                future.result()
+
+        # None of the writes has been applied
+        self.assertEqual(len(self.api.list_purchases()), 0)
+        self.assertEqual(self.api.get_consumer(id=1).credit, 0)
+
+        # The next batch is committed again
+        self.writer.call(self.api.insert_purchase, self.purchase(1))
+        self.assertEqual(len(self.api.list_purchases()), 1)
+
+    def test_close(self):
+        future = self.writer.submit(self.api.insert_purchase,
+                                    self.purchase(1))
+        self.writer.close()
+
+        # Queued writes are applied before the writer stops
+        self.assertIsNone(future.result())
+        self.assertEqual(len(self.api.list_purchases()), 1)
+        with self.assertRaises(exc.DatabaseUnavailable):
+            self.writer.submit(self.api.insert_purchase, self.purchase(1))
+
+    def test_admin_writes(self):
+        res = self.client.post('/login', data=json.dumps({
+            'email': self.consumeremails[0],
+            'password': self.consumerpasswords[0]}),
+            headers={'content-type': 'application/json'})
+        headers = {'content-type': 'application/json',
+                   'token': res.json['token']}
+        requests = [
+            ('post', '/consumers', {'name': 'Writer Consumer'}),
+            ('put', '/consumer/2', {'adminroles': {'2': True}}),
+            ('post', '/products', {'name': 'Writer Product', 'price': 50,
+                                   'department_id': 1, 'countable': True,
+                                   'revocable': True}),
+            ('put', '/product/1', {'price': 30})
+        ]
+
+        # The writes of the admin routes are applied by the writer as well
+        writes = self.trace()
+        statements = []
+        self.api.con.set_trace_callback(statements.append)
+        try:
+            for method, url, data in requests:
+                res = getattr(self.client, method)(
+                    url, data=json.dumps(data), headers=headers)
+                self.assertIn(res.status_code, [200, 201])
+        finally:
+            self.api.con.set_trace_callback(None)
+
+        for statement in statements:
+            self.assertFalse(statement.startswith(('INSERT', 'UPDATE',
+                                                   'DELETE', 'COMMIT')),
+                             statement)
+        for table in ['INSERT INTO consumers', 'INSERT INTO adminroles',
+                      'INSERT INTO products', 'UPDATE products']:
+            self.assertTrue(any(w.startswith(table) for w in writes), table)
+        self.assertEqual(self.api.get_principal(2)['adminroles'], [2])
+        self.assertEqual(self.api.get_product(id=1).price, 30)
+
+    def test_concurrent_requests(self):
+        self.api.pool.release()
+
+        def purchase(consumer_id):
+            for i in range(0, 10):
+                res = self.post_purchase(consumer_id)
+                responses.append(res.status_code)
+
+        responses = []
+        threads = [threading.Thread(target=purchase, args=(i % 4 + 1, ))
+                   for i in range(0, 8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(responses, [201] * 80)
+        self.assertEqual(len(self.api.list_purchases()), 80)
+        for consumer in self.api.list_consumers():
+            self.assertEqual(consumer.credit, -500)
+
+        # An invalid purchase is answered like without the writer
+        res = self.post_purchase(5)
+        self.assertEqual(res.status_code, 400)
+        self.assertIn('foreign-key-not-existing', res.json['error_types'])